@@ -36,7 +36,7 @@ activates their account.
 Please note that users cannot log in to their accounts until their email addresses are verified.
 """,
     tags=['Authentication'])
-async def register(payload: schemas.RegisterIn = Body(**schemas.RegisterIn.examples())):
+def register(payload: schemas.RegisterIn = Body(**schemas.RegisterIn.examples())):
     return AccountService.register(**payload.model_dump(exclude={"password_confirm"}))
 
 
@@ -47,7 +47,7 @@ async def register(payload: schemas.RegisterIn = Body(**schemas.RegisterIn.examp
     summary='Verify user registration',
     description='Verify a new user registration by confirming the provided OTP.',
     tags=['Authentication'])
-async def verify_registration(payload: schemas.RegisterVerifyIn):
+def verify_registration(payload: schemas.RegisterVerifyIn):
     return AccountService.verify_registration(**payload.model_dump())
 
 
@@ -63,7 +63,7 @@ async def verify_registration(payload: schemas.RegisterVerifyIn):
     summary='Login a user',
     description='Login a user with valid credentials, if user account is active.',
     tags=['Authentication'])
-async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+def login(form_data: OAuth2PasswordRequestForm = Depends()):
     return AccountService.login(form_data.username, form_data.password)
 
 
@@ -74,7 +74,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     description="Logout the currently authenticated user. "
                 "Revokes the user's access token and invalidates the session.",
     tags=['Authentication'])
-async def logout(current_user: User = Depends(AccountService.current_user)):
+def logout(current_user: User = Depends(AccountService.current_user)):
     AccountService.logout(current_user)
 
 
@@ -91,7 +91,7 @@ async def logout(current_user: User = Depends(AccountService.current_user)):
     description="Initiate a password reset request by sending a verification email to the user's "
                 "registered email address.",
     tags=['Authentication'])
-async def reset_password(payload: schemas.PasswordResetIn):
+def reset_password(payload: schemas.PasswordResetIn):
     return AccountService.reset_password(**payload.model_dump())
 
 
@@ -103,7 +103,7 @@ async def reset_password(payload: schemas.PasswordResetIn):
     description="Verify the password reset request by confirming the provided OTP sent to the user's "
                 "registered email address. If the change is successful, the user will need to login again.",
     tags=['Authentication'])
-async def verify_reset_password(payload: schemas.PasswordResetVerifyIn):
+def verify_reset_password(payload: schemas.PasswordResetVerifyIn):
     return AccountService.verify_reset_password(**payload.model_dump(exclude={"password_confirm"}))
 
 
@@ -125,7 +125,7 @@ async def verify_reset_password(payload: schemas.PasswordResetVerifyIn):
     """,
 
     tags=['Authentication'])
-async def resend_otp(payload: schemas.OTPResendIn = Body(**schemas.OTPResendIn.examples())):
+def resend_otp(payload: schemas.OTPResendIn = Body(**schemas.OTPResendIn.examples())):
     AccountService.resend_otp(**payload.model_dump())
 
 
@@ -141,7 +141,7 @@ async def resend_otp(payload: schemas.OTPResendIn = Body(**schemas.OTPResendIn.e
     summary='Retrieve current user',
     description='Retrieve current user if user is active.',
     tags=['Users'])
-async def retrieve_me(current_user: User = Depends(AccountService.current_user)):
+def retrieve_me(current_user: User = Depends(AccountService.current_user)):
     return {'user': UserManager.to_dict(current_user)}
 
 
@@ -152,7 +152,7 @@ async def retrieve_me(current_user: User = Depends(AccountService.current_user))
     summary='Update current user',
     description='Update current user.',
     tags=['Users'])
-async def update_me(payload: schemas.UpdateUserSchema, current_user: User = Depends(AccountService.current_user)):
+def update_me(payload: schemas.UpdateUserSchema, current_user: User = Depends(AccountService.current_user)):
     user = UserManager.update_user(current_user.id, **payload.model_dump())
     return {'user': UserManager.to_dict(user)}
 
@@ -165,8 +165,8 @@ async def update_me(payload: schemas.UpdateUserSchema, current_user: User = Depe
     description='Change the password for the current user. If the change is successful, the user will '
                 'need to login again.',
     tags=['Users'])
-async def change_password(payload: schemas.PasswordChangeIn = Body(**schemas.PasswordChangeIn.examples()),
-                          current_user: User = Depends(AccountService.current_user)):
+def change_password(payload: schemas.PasswordChangeIn = Body(**schemas.PasswordChangeIn.examples()),
+                    current_user: User = Depends(AccountService.current_user)):
     return AccountService.change_password(current_user, **payload.model_dump(exclude={"password_confirm"}))
 
 
@@ -180,7 +180,7 @@ async def change_password(payload: schemas.PasswordChangeIn = Body(**schemas.Pas
 After the new email is set, an OTP code will be sent to the new email address for verification purposes.
 """,
     tags=['Users'])
-async def change_email(email: schemas.EmailChangeIn, current_user: User = Depends(AccountService.current_user)):
+def change_email(email: schemas.EmailChangeIn, current_user: User = Depends(AccountService.current_user)):
     return AccountService.change_email(current_user, **email.model_dump())
 
 
@@ -195,8 +195,8 @@ Validating the OTP code sent to the user's new email address. If the OTP is vali
 email address will be saved as the user's main email address.
 """,
     tags=['Users'])
-async def verify_change_email(otp: schemas.EmailChangeVerifyIn,
-                              current_user: User = Depends(AccountService.current_user)):
+def verify_change_email(otp: schemas.EmailChangeVerifyIn,
+                        current_user: User = Depends(AccountService.current_user)):
     return AccountService.verify_change_email(current_user, **otp.model_dump())
 
 
@@ -209,7 +209,7 @@ async def verify_change_email(otp: schemas.EmailChangeVerifyIn,
     tags=['Users'],
     dependencies=[Depends(Permission.is_admin)]
 )
-async def retrieve_user(user_id: int):
+def retrieve_user(user_id: int):
     return {'user': UserManager.to_dict(UserManager.get_user(user_id))}
 
 # TODO DELETE /accounts/me
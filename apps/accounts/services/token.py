@@ -112,7 +112,7 @@ class TokenService:
 
         # --- get user ---
         # TODO move user data to token and dont fetch them from database
-        user = UserManager.get_user(user_id)
+        user = await UserManager.aget_user(user_id)
         if user is None:
             print(f"User {user_id} not found")
             raise cls.credentials_exception
@@ -53,6 +53,17 @@ class UserManager:
 
         return user
 
+    @staticmethod
+    async def aget_user(user_id: Optional[int] = None, email: Optional[str] = None) -> Optional[User]:
+        """
+        `get_user` on the async engine, for async routes (e.g. authenticating every request).
+        """
+        if user_id:
+            return await User.aget(user_id)
+        elif email:
+            return await User.afirst(User.email == email)
+        return None
+
     @staticmethod
     def get_user_or_404(user_id: Optional[int] = None, email: Optional[str] = None):
         user: User | None = None
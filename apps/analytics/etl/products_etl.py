@@ -1,35 +1,187 @@
 # apps/analytics/etl/products_etl.py
+import io
+from typing import Dict, Iterable, Optional
+
 import pandas as pd
-from sqlalchemy import create_engine
-from config.settings import DATABASES
-
-def load_products_from_csv():
-    df = pd.read_csv('products.csv')
-    
-    # Преобразование данных под вашу модель
-    df_clean = df.rename(columns={
-        'name': 'product_name',
-        'link': 'external_link',
-        'image': 'external_image_url',
-        'ratings': 'external_ratings',
-        'no_of_ratings': 'external_ratings_count',
-        'actual_price': 'external_price',
-        'discount_price': 'external_discount_price'
-    })
-    
-    # Очистка числовых полей (например, "30,227" -> 30227)
-    df_clean['external_ratings_count'] = df_clean['external_ratings_count'].str.replace(',', '').astype(int)
-    
-    # Загрузка в PostgreSQL
-    engine = create_engine(DATABASES["url"])
-    df_clean.to_sql('products', engine, if_exists='append', index=False)
+from sqlalchemy import text
 
 from config.elasticsearch import es
 from config.database import DatabaseManager
 from apps.products.models import Product, ProductVariant
+from apps.products.services import ProductService
 from sqlalchemy.orm import joinedload
 import asyncio
 
+# колонки CSV маркетплейса (как `data/Backpacks.csv`) -> колонки `products`
+CSV_COLUMNS = {
+    'name': 'product_name',
+    'main_category': 'main_category',
+    'sub_category': 'sub_category',
+    'image': 'external_image_url',
+    'link': 'external_link',
+    'ratings': 'external_ratings',
+    'no_of_ratings': 'external_ratings_count',
+    'actual_price': 'external_price',
+    'discount_price': 'external_discount_price',
+}
+STAGING_COLUMNS = list(CSV_COLUMNS.values()) + ['price']
+CHUNK_SIZE = 100_000
+# id изменённых товаров в одном NOTIFY
+NOTIFY_BATCH_SIZE = 500
+
+
+def clean_products(chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    Привести часть CSV к колонкам `products` целыми колонками, без цикла по строкам.
+
+    Цены остаются исходными строками ("₹2,100", как в `Product.external_price`), а числовая цена варианта
+    (`price`, со скидкой, если она есть) получается из них удалением знака рупии, разделителей тысяч и пробелов.
+    Значения, которые и после этого не являются числом ("FREE", "Only 1 left in stock."), становятся NULL.
+    """
+    df = chunk.rename(columns=CSV_COLUMNS)[list(CSV_COLUMNS.values())]
+
+    def to_number(column: pd.Series) -> pd.Series:
+        return pd.to_numeric(column.str.replace(r'[₹,\s]', '', regex=True), errors='coerce')
+
+    df['external_ratings'] = pd.to_numeric(df['external_ratings'], errors='coerce')
+    df['external_ratings_count'] = to_number(df['external_ratings_count']).round().astype('Int64')
+    df['price'] = to_number(df['external_discount_price']).fillna(to_number(df['external_price'])).round(2)
+    df['product_name'] = df['product_name'].str.slice(0, 255)
+    # товар фида определяется ссылкой (см. `load_products_from_csv`)
+    return df[df['product_name'].notna() & df['external_link'].notna()]
+
+
+def load_products_from_csv(path: str, seller_ids: Optional[Iterable[int]] = None,
+                           chunksize: int = CHUNK_SIZE) -> Dict[str, int]:
+    """
+    Загрузить или обновить товары из CSV маркетплейса, вернуть число строк `rows`, созданных (`inserted`),
+    изменённых (`updated`), не изменившихся (`unchanged`) и пропущенных (`skipped`, без названия или ссылки)
+    товаров.
+
+    Товар фида определяется своей ссылкой `external_link`, а его содержимое хешем `external_hash` (md5 полей из
+    CSV). Файл читается частями по `chunksize` строк, каждая часть очищается (`clean_products`), копируется через
+    `COPY` во временную таблицу и переносится в `products` одним `INSERT ... ON CONFLICT (external_link)`: новые
+    товары создаются вместе с вариантом по умолчанию (без остатка, цена со скидкой), изменённые обновляются вместе
+    с ценой варианта по умолчанию, а строки с прежним хешем не пишутся вовсе, поэтому повторный импорт почти не
+    изменившегося фида не создаёт дубликатов и событий CDC (Debezium). Новые товары распределяются по продавцам
+    `seller_ids` (по умолчанию по всем продавцам).
+
+    Файл загружается целиком в одной транзакции, затем создаются и обновляются карточки каталога, а кэш
+    изменённых товаров сбрасывается.
+    """
+    counts = dict.fromkeys(('rows', 'inserted', 'updated', 'unchanged', 'skipped'), 0)
+    updated_ids = []
+
+    with DatabaseManager.engine.begin() as connection:
+        if seller_ids is None:
+            seller_ids = connection.scalars(text("SELECT id FROM sellers ORDER BY id")).all()
+        seller_ids = list(seller_ids)
+        if not seller_ids:
+            raise ValueError("Нет продавцов, которым можно назначить товары")
+
+        connection.execute(text("""
+            CREATE TEMP TABLE products_staging (
+                row_number bigserial,
+                product_name varchar(255),
+                main_category varchar(100),
+                sub_category varchar(200),
+                external_image_url varchar(500),
+                external_link varchar(500),
+                external_ratings double precision,
+                external_ratings_count integer,
+                external_price varchar(50),
+                external_discount_price varchar(50),
+                price numeric(12, 2)
+            ) ON COMMIT DROP
+        """))
+        cursor = connection.connection.cursor()
+
+        for chunk in pd.read_csv(path, dtype=str, chunksize=chunksize):
+            products = clean_products(chunk)
+            counts['rows'] += len(chunk)
+            counts['skipped'] += len(chunk) - len(products)
+
+            buffer = io.StringIO()
+            products.to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cursor.copy_expert(
+                f"COPY products_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+            changes = connection.execute(UPSERT_PRODUCTS, {"seller_ids": seller_ids}).all()
+            inserted = sum(1 for _, is_inserted in changes if is_inserted)
+            counts['inserted'] += inserted
+            counts['updated'] += len(changes) - inserted
+            counts['unchanged'] += len(products) - len(changes)
+            updated_ids.extend(product_id for product_id, is_inserted in changes if not is_inserted)
+
+            connection.execute(text("TRUNCATE products_staging"))
+
+        # другие воркеры сбрасывают свой кэш изменённых товаров после коммита (NOTIFY ограничен 8000 байт)
+        for start in range(0, len(updated_ids), NOTIFY_BATCH_SIZE):
+            DatabaseManager.notify(connection, Product.notify_channel,
+                                   ','.join(map(str, updated_ids[start:start + NOTIFY_BATCH_SIZE])))
+
+    if counts['inserted']:
+        ProductService.backfill_cards()
+    for start in range(0, len(updated_ids), NOTIFY_BATCH_SIZE):
+        batch = updated_ids[start:start + NOTIFY_BATCH_SIZE]
+        ProductService.refresh_cards(batch)
+        ProductService.invalidate_cache(*batch)
+    return counts
+
+
+# Строки фида без названия или ссылки пропускаются (`clean_products`), повторы ссылки в одной части схлопываются в
+# последнюю строку (`ON CONFLICT` не может изменить строку дважды). Продавец нового товара определяется его
+# ссылкой, поэтому не зависит от порядка строк. Изменённый товар обновляется только при другом хеше, а цена его
+# варианта по умолчанию — только если она изменилась.
+UPSERT_PRODUCTS = text("""
+    WITH feed AS (
+        SELECT DISTINCT ON (external_link) *,
+               md5(ROW(product_name, main_category, sub_category, external_image_url, external_ratings,
+                       external_ratings_count, external_price, external_discount_price)::text) AS external_hash
+        FROM products_staging
+        ORDER BY external_link, row_number DESC
+    ),
+    changes AS (
+        INSERT INTO products AS product (product_name, status, seller_id, main_category, sub_category,
+                                         external_image_url, external_link, external_ratings, external_ratings_count,
+                                         external_price, external_discount_price, external_hash, published_at)
+        SELECT product_name, 'active',
+               (:seller_ids)[1 + (hashtext(external_link) & 2147483647) % cardinality(:seller_ids)],
+               main_category, sub_category, external_image_url, external_link, external_ratings,
+               external_ratings_count, external_price, external_discount_price, external_hash, now()
+        FROM feed
+        ON CONFLICT (external_link) DO UPDATE SET
+            product_name = excluded.product_name,
+            main_category = excluded.main_category,
+            sub_category = excluded.sub_category,
+            external_image_url = excluded.external_image_url,
+            external_ratings = excluded.external_ratings,
+            external_ratings_count = excluded.external_ratings_count,
+            external_price = excluded.external_price,
+            external_discount_price = excluded.external_discount_price,
+            external_hash = excluded.external_hash,
+            updated_at = now()
+        WHERE product.external_hash IS DISTINCT FROM excluded.external_hash
+        RETURNING product.id, product.external_link, xmax = 0 AS inserted
+    ),
+    new_variants AS (
+        INSERT INTO product_variants (product_id, price, stock)
+        SELECT changes.id, coalesce(feed.price, 0), 0
+        FROM changes JOIN feed USING (external_link)
+        WHERE changes.inserted
+    ),
+    updated_variants AS (
+        UPDATE product_variants AS variant SET price = coalesce(feed.price, 0), updated_at = now()
+        FROM changes JOIN feed USING (external_link)
+        WHERE NOT changes.inserted AND variant.product_id = changes.id
+          AND variant.option1 IS NULL AND variant.option2 IS NULL AND variant.option3 IS NULL
+          AND variant.price IS DISTINCT FROM coalesce(feed.price, 0)
+    )
+    SELECT id, inserted FROM changes
+""")
+
+
 async def sync_products_to_elasticsearch():
     with DatabaseManager.session as session:
         # Загружаем продукты вместе с вариантами и медиа
@@ -0,0 +1,42 @@
+import pandas as pd
+
+from apps.analytics.etl.products_etl import clean_products
+
+# rows 481, 612 and 950 of data/Backpacks.csv, and a regular one
+ROWS = [
+    {'name': 'The Clownfish Marcellus Polyester 21.5 litres Unisex Travel Laptop Backpack', 'ratings': '4.1',
+     'no_of_ratings': 'Only 1 left in stock.', 'discount_price': '₹659', 'actual_price': '₹999'},
+    {'name': 'UJEAVETTE Ball Bearing Fishing Swivel with Snap Clip Stainless Steel Connector Tackle 1',
+     'ratings': 'FREE', 'no_of_ratings': 'Usually dispatched in 5 to 6 days.', 'discount_price': '₹783',
+     'actual_price': '₹1,574'},
+    {'name': 'CALANDIS Decoupler Seat Fishing Gear Tool Fishing Box Accessories Fishing Gadget Blue',
+     'ratings': None, 'no_of_ratings': 'Usually dispatched in 4 to 5 days.', 'discount_price': None,
+     'actual_price': '₹1,574'},
+    {'name': 'Wildcraft 44 Ltrs Casual Backpack', 'ratings': '4.3', 'no_of_ratings': '2,386',
+     'discount_price': '₹1,099.50', 'actual_price': '₹2,100'},
+]
+
+
+def make_chunk(rows):
+    chunk = pd.DataFrame(rows, dtype=str)
+    chunk['main_category'] = 'bags & luggage'
+    chunk['sub_category'] = 'Backpacks'
+    chunk['image'] = 'https://m.media-amazon.com/images/I/image.jpg'
+    chunk['link'] = [f'https://www.amazon.in/dp/{number}' for number in range(len(rows))]
+    return chunk
+
+
+def test_clean_products_text_is_not_a_number():
+    products = clean_products(make_chunk(ROWS))
+
+    assert products['external_ratings_count'].isna().tolist() == [True, True, True, False]
+    assert products['external_ratings'].isna().tolist() == [False, True, True, False]
+
+
+def test_clean_products_prices():
+    products = clean_products(make_chunk(ROWS))
+
+    assert products['external_ratings_count'].iloc[3] == 2386
+    # the discount price if there is one, otherwise the actual price
+    assert products['price'].tolist() == [659, 783, 1574, 1099.5]
+    assert products['external_price'].tolist() == ['₹999', '₹1,574', '₹1,574', '₹2,100']
@@ -0,0 +1,291 @@
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import parse_qs
+
+import anyio
+from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from apps.accounts.services.token import TokenService
+from apps.core.services.profiler import RequestProfiler
+from config.database import DatabaseManager
+from config.metrics import HTTP_REQUESTS, HTTP_REQUEST_SECONDS, HTTP_REQUESTS_IN_PROGRESS
+from config.settings import DB_READ_YOUR_WRITES_SECONDS, SQL_N_PLUS_ONE_THRESHOLD, PROFILING_DIR, \
+    PROFILING_ON_DEMAND, PROFILING_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+# statistics of the current request (see `SQLInstrumentationMiddleware`)
+_query_stats: ContextVar[Optional['QueryStats']] = ContextVar('query_stats', default=None)
+
+# literals and bind parameters (`%(name)s` of psycopg2, `$1` of asyncpg) of a statement, quoted identifiers are
+# matched to be kept as they are (digits of unquoted identifiers like `option1` are not at a word boundary)
+_literals = re.compile(r"%\(\w+\)s|\$\d+|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\b\d+(?:\.\d+)?\b")
+# `IN (?, ?, ...)` lists of any length
+_in_lists = re.compile(r"\bIN \((?:\?, )*\?\)", re.IGNORECASE)
+
+
+def _replace_literal(match: re.Match) -> str:
+    return match.group() if match.group().startswith('"') else '?'
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """
+    The statement with its literals and parameters replaced by `?`, so executions of the same query with different
+    values have the same fingerprint.
+    """
+    statement = _literals.sub(_replace_literal, ' '.join(statement.split()))
+    return _in_lists.sub('IN (...)', statement)
+
+
+class QueryStats:
+    """
+    Number, total duration and fingerprints of the SQL statements of a request, recorded by the cursor events of
+    every engine (sync routes run in other threads, so updates are locked).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, duration: float):
+        statement = fingerprint(statement)
+        with self._lock:
+            self.count += 1
+            self.duration += duration
+            self.fingerprints[statement] += 1
+
+    def repeated(self, threshold: int = SQL_N_PLUS_ONE_THRESHOLD) -> list[tuple[str, int]]:
+        """
+        Statements executed at least `threshold` times, most repeated first, likely N+1 queries (a query per row
+        of a previous query) that can be merged into one.
+        """
+        with self._lock:
+            return [(statement, count) for statement, count in self.fingerprints.most_common() if count >= threshold]
+
+
+def get_route(scope: Scope) -> str:
+    """
+    Path template of the route of a request (`/products/{product_id}`), requested paths would make a metric label
+    value (or a profiling directory) per product id.
+    """
+    partial = None
+    for route in scope['app'].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or 'unmatched'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _query_stats.get() is not None:
+        context._query_started_at = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _query_stats.get()
+    started_at = getattr(context, '_query_started_at', None)
+    if stats is not None and started_at is not None:
+        stats.record(statement, time.perf_counter() - started_at)
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pin a client to the primary database for `DB_READ_YOUR_WRITES_SECONDS` after a successful write (a request
+    with an unsafe method), with a cookie read by `DatabaseManager.read_only`, so the lag of the replica never
+    hides the client's own writes.
+    """
+
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['method'] in self.safe_methods or DatabaseManager.engine_replica is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message):
+            if message['type'] == 'http.response.start' and message['status'] < 400:
+                # the expiry is in the value too, for clients that don't honor `Max-Age`
+                until = int(time.time()) + DB_READ_YOUR_WRITES_SECONDS
+                MutableHeaders(scope=message).append(
+                    'set-cookie', f"{DatabaseManager.primary_cookie}={until}; Max-Age={DB_READ_YOUR_WRITES_SECONDS}; "
+                                  f"Path=/; HttpOnly; SameSite=Lax")
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+class SQLInstrumentationMiddleware:
+    """
+    Record the SQL statements of every request, of all engines (primary, replica, sync and async):
+
+    - a `Server-Timing` header with the number of statements and the time spent in the database, shown by the
+      network panel of browsers (statements of a streamed body, after the headers, are only logged)
+    - a log line per request, and a warning with the fingerprints of statements repeated at least
+      `SQL_N_PLUS_ONE_THRESHOLD` times, which are likely N+1 queries
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _query_stats.set(stats)
+        started_at = time.perf_counter()
+        status_code = None
+
+        async def send_with_timing(message: Message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                MutableHeaders(scope=message).append('server-timing', self.server_timing(stats, started_at))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _query_stats.reset(token)
+            self.log(scope, status_code, stats, started_at)
+
+    @staticmethod
+    def server_timing(stats: QueryStats, started_at: float) -> str:
+        return (f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries", '
+                f'app;dur={(time.perf_counter() - started_at) * 1000:.1f}')
+
+    @staticmethod
+    def log(scope: Scope, status_code: Optional[int], stats: QueryStats, started_at: float):
+        request = f"{scope['method']} {scope['path']}"
+        logger.info(f"{request} {status_code}: {stats.count} queries, {stats.duration * 1000:.1f}ms in the "
+                    f"database, {(time.perf_counter() - started_at) * 1000:.1f}ms total")
+        for statement, count in stats.repeated():
+            logger.warning(f"Possible N+1 query in {request}, executed {count} times: {statement}")
+
+
+class MetricsMiddleware:
+    """
+    Report the latency, status codes and requests in progress of every route to Prometheus (see `config.metrics`).
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method, route = scope['method'], get_route(scope)
+        status_code = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUEST_SECONDS.labels(method, route).observe(time.perf_counter() - started_at)
+            HTTP_REQUESTS.labels(method, route, status_code).inc()
+            in_progress.dec()
+
+
+class ProfilingMiddleware:
+    """
+    Run a request under a profiler and save the report (see `RequestProfiler`) to
+    `PROFILING_DIR/<route>/<time>-<method>.html`:
+
+    - on demand, for requests of admins with the `X-Profile: 1` header or the `profile=1` query parameter, the path
+      of the report (relative to `PROFILING_DIR`) is sent in the `X-Profile-Report` header
+    - at random, for a `PROFILING_SAMPLE_RATE` fraction of all requests, the report is only saved (its path
+      would expose the internals to any client)
+
+    A worker profiles one request at a time, requests that arrive meanwhile aren't profiled.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._busy = threading.Lock()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        requested = await self.is_requested(scope)
+        if not requested and not (PROFILING_SAMPLE_RATE and random.random() < PROFILING_SAMPLE_RATE):
+            await self.app(scope, receive, send)
+            return
+        if not self._busy.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = RequestProfiler()
+        path = RequestProfiler.get_report_path(get_route(scope), scope['method'])
+
+        async def send_with_report(message: Message):
+            if requested and message['type'] == 'http.response.start':
+                MutableHeaders(scope=message).append('x-profile-report', str(path.relative_to(PROFILING_DIR)))
+            await send(message)
+
+        try:
+            with profiler.activate():
+                await self.app(scope, receive, send_with_report)
+        finally:
+            self._busy.release()
+            try:
+                await anyio.to_thread.run_sync(profiler.save, path)
+            except Exception as e:
+                logger.error(f"Saving the profile of {scope['method']} {scope['path']} failed: {e}")
+
+    @staticmethod
+    async def is_requested(scope: Scope) -> bool:
+        """
+        Whether an admin asked for the profile of the request.
+        """
+
+        if not PROFILING_ON_DEMAND:
+            return False
+
+        headers = Headers(scope=scope)
+        requested = headers.get('x-profile') or parse_qs(scope['query_string'].decode()).get('profile', [None])[0]
+        if requested not in ('1', 'true'):
+            return False
+
+        scheme, _, token = headers.get('authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return False
+        try:
+            user = await TokenService.fetch_user(token)
+        except HTTPException:
+            return False
+        return user.role == 'admin'
@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from config.metrics import generate_metrics
+
+router = APIRouter()
+
+
+@router.get(
+    '/metrics',
+    summary='Prometheus metrics',
+    description='Metrics of all workers in the Prometheus text format, for the Prometheus scraper.',
+    include_in_schema=False)
+def metrics():
+    # the content type has a charset already, `media_type` would add another one
+    return Response(content=generate_metrics(), headers={'Content-Type': CONTENT_TYPE_LATEST})
@@ -0,0 +1,287 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+from decimal import Decimal
+from typing import Any, Awaitable, Callable
+
+import anyio
+from redis.exceptions import RedisError
+
+from config import settings
+from config.database import DatabaseManager
+from config.metrics import CACHE_REQUESTS
+from config.redis import redis
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def _json_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+class CacheService:
+    """
+    Read-through cache with two levels:
+
+    - L1: an in-process LRU with a short TTL, so the hottest keys never leave the worker.
+    - L2: Redis, shared by all workers, with a longer TTL.
+
+    Concurrent misses of the same key are collapsed (single-flight): only one thread runs the loader and the
+    others wait for its result instead of hitting the database at the same time. `aget_or_set` does the same for
+    the coroutines of a worker with an async loader.
+
+    Loaders read from the primary database: a value loaded from a lagging replica right after a write (and its
+    invalidation) would stay stale in the cache until it expires.
+
+    Cached values must be JSON serializable (`Decimal` is stored as `float`) and must not be mutated by callers,
+    because L1 hands out the same object to every reader.
+    """
+
+    def __init__(self, namespace: str, l1_max_size: int = settings.CACHE_L1_MAX_SIZE,
+                 l1_ttl: int = settings.CACHE_L1_TTL, l2_ttl: int = settings.CACHE_L2_TTL):
+        self.namespace = namespace
+        self.l1_max_size = l1_max_size
+        self.l1_ttl = l1_ttl
+        self.l2_ttl = l2_ttl
+
+        self._l1: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._l1_lock = threading.Lock()
+
+        # key -> (lock, number of threads using it)
+        self._flights: dict[str, tuple[threading.Lock, int]] = {}
+        self._flights_lock = threading.Lock()
+        # key -> (asyncio lock, number of coroutines using it), used on the event loop thread only
+        self._async_flights: dict[str, tuple[asyncio.Lock, int]] = {}
+
+        # incremented on every invalidation, a value loaded while it changed may be stale, so it isn't stored
+        self._generation = 0
+
+        # skip Redis for a while after an error, so a Redis outage doesn't slow down every request
+        self._l2_retry_at = 0.0
+
+    def get_or_set(self, key: str, loader: Callable[[], Any]) -> Any:
+        """
+        Return the cached value of `key`, or load it with `loader` and cache it.
+        """
+
+        if not settings.CACHE_ENABLED:
+            return loader()
+
+        key = f"{self.namespace}:{key}"
+        value = self._l1_get(key)
+        if value is not _MISSING:
+            self._count('l1')
+            return value
+
+        with self._single_flight(key):
+            # another thread could load the value while this one was waiting
+            value = self._l1_get(key)
+            if value is not _MISSING:
+                self._count('l1')
+                return value
+
+            generation = self._generation
+            value = self._l2_get(key)
+            from_l2 = value is not _MISSING
+            self._count('l2' if from_l2 else 'miss')
+            if not from_l2:
+                with DatabaseManager.read_from_primary():
+                    value = loader()
+
+            if generation == self._generation:
+                if not from_l2:
+                    self._l2_set(key, value)
+                self._l1_set(key, value)
+        return value
+
+    async def aget_or_set(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        `get_or_set` with an async loader, waiting for a concurrent load doesn't block the event loop, and neither do
+        the Redis calls (they run in a worker thread).
+        """
+
+        if not settings.CACHE_ENABLED:
+            return await loader()
+
+        key = f"{self.namespace}:{key}"
+        value = self._l1_get(key)
+        if value is not _MISSING:
+            self._count('l1')
+            return value
+
+        async with self._async_single_flight(key):
+            value = self._l1_get(key)
+            if value is not _MISSING:
+                self._count('l1')
+                return value
+
+            generation = self._generation
+            value = await self._al2_get(key)
+            from_l2 = value is not _MISSING
+            self._count('l2' if from_l2 else 'miss')
+            if not from_l2:
+                with DatabaseManager.read_from_primary():
+                    value = await loader()
+
+            if generation == self._generation:
+                if not from_l2:
+                    await self._al2_set(key, value)
+                self._l1_set(key, value)
+        return value
+
+    def invalidate(self, *keys: str):
+        """
+        Remove keys from both levels.
+
+        L2 goes first: a load that reads L2 before the delete started before the generation is bumped by the L1
+        eviction, so its value is discarded.
+        """
+
+        l2_keys = [f"{self.namespace}:{key}" for key in keys]
+        if self._l2_available():
+            try:
+                redis.delete(*l2_keys)
+            except (RedisError, OSError) as e:
+                self._l2_failed(e)
+        self.evict_local(*keys)
+
+    def evict_local(self, *keys: str):
+        """
+        Remove keys from L1 only.
+        """
+
+        with self._l1_lock:
+            self._generation += 1
+            for key in keys:
+                self._l1.pop(f"{self.namespace}:{key}", None)
+
+    def clear_local(self):
+        """
+        Remove all keys from L1.
+        """
+
+        with self._l1_lock:
+            self._generation += 1
+            self._l1.clear()
+
+    def _count(self, result: str):
+        CACHE_REQUESTS.labels(self.namespace, result).inc()
+
+    # ----------
+    # --- L1 ---
+    # ----------
+
+    def _l1_get(self, key: str):
+        with self._l1_lock:
+            item = self._l1.get(key)
+            if item is None:
+                return _MISSING
+
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._l1[key]
+                return _MISSING
+
+            self._l1.move_to_end(key)
+            return value
+
+    def _l1_set(self, key: str, value: Any):
+        with self._l1_lock:
+            self._l1[key] = (time.monotonic() + self.l1_ttl, value)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_max_size:
+                self._l1.popitem(last=False)
+
+    # ----------
+    # --- L2 ---
+    # ----------
+
+    def _l2_available(self) -> bool:
+        return self._l2_retry_at <= time.monotonic()
+
+    def _l2_failed(self, error: Exception):
+        logger.warning(f"Redis cache is unavailable: {error}")
+        self._l2_retry_at = time.monotonic() + settings.CACHE_L2_RETRY_SECONDS
+
+    def _l2_get(self, key: str):
+        if not self._l2_available():
+            return _MISSING
+        try:
+            value = redis.get(key)
+        except (RedisError, OSError) as e:
+            self._l2_failed(e)
+            return _MISSING
+        return _MISSING if value is None else json.loads(value)
+
+    def _l2_set(self, key: str, value: Any):
+        if not self._l2_available():
+            return
+        try:
+            redis.set(key, json.dumps(value, default=_json_default), ex=self.l2_ttl)
+        except (RedisError, OSError) as e:
+            self._l2_failed(e)
+
+    async def _al2_get(self, key: str):
+        if not self._l2_available():
+            return _MISSING
+        return await anyio.to_thread.run_sync(self._l2_get, key)
+
+    async def _al2_set(self, key: str, value: Any):
+        if self._l2_available():
+            await anyio.to_thread.run_sync(self._l2_set, key, value)
+
+    # ---------------------
+    # --- Single Flight ---
+    # ---------------------
+
+    @contextmanager
+    def _single_flight(self, key: str):
+        """
+        Hold the lock of `key`, the lock is removed when no thread uses it anymore.
+        """
+
+        with self._flights_lock:
+            lock, users = self._flights.get(key, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._flights[key] = (lock, users + 1)
+
+        try:
+            with lock:
+                yield
+        finally:
+            with self._flights_lock:
+                users = self._flights[key][1]
+                if users == 1:
+                    del self._flights[key]
+                else:
+                    self._flights[key] = (lock, users - 1)
+
+    @asynccontextmanager
+    async def _async_single_flight(self, key: str):
+        """
+        `_single_flight` for coroutines.
+        """
+
+        lock, users = self._async_flights.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._async_flights[key] = (lock, users + 1)
+
+        try:
+            async with lock:
+                yield
+        finally:
+            users = self._async_flights[key][1]
+            if users == 1:
+                del self._async_flights[key]
+            else:
+                self._async_flights[key] = (lock, users - 1)
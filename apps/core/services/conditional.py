@@ -0,0 +1,70 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response, HTTPException, status
+
+
+class ConditionalService:
+    """
+    Conditional GET (RFC 9110): answer `304 Not Modified` when the client already has the current representation.
+
+    Validators (a weak ETag and a Last-Modified date) must be computed without building the payload, otherwise
+    nothing is saved by skipping it.
+    """
+
+    @classmethod
+    def evaluate(cls, request: Request, response: Response, etag: str, last_modified: Optional[datetime] = None):
+        """
+        Set the validators on `response`, or raise a `304 Not Modified` when the request preconditions match them.
+        """
+
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if last_modified is not None:
+            headers['Last-Modified'] = cls.http_date(last_modified)
+
+        if cls.is_not_modified(request, etag, last_modified):
+            raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        response.headers.update(headers)
+
+    @classmethod
+    def is_not_modified(cls, request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match is not None:
+            # `If-Modified-Since` is ignored when `If-None-Match` is present, ETags are compared weakly
+            if if_none_match.strip() == '*':
+                return True
+            return cls._opaque_tag(etag) in {cls._opaque_tag(tag) for tag in if_none_match.split(',')}
+
+        if_modified_since = request.headers.get('if-modified-since')
+        if if_modified_since is not None and last_modified is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            # HTTP dates have a precision of one second
+            return cls._as_utc(last_modified).replace(microsecond=0) <= since
+        return False
+
+    @staticmethod
+    def make_etag(digest: str) -> str:
+        # weak, because the validator describes the data of a resource, not the bytes of the serialized response
+        return f'W/"{digest}"'
+
+    @classmethod
+    def http_date(cls, value: datetime) -> str:
+        return format_datetime(cls._as_utc(value), usegmt=True)
+
+    @staticmethod
+    def _as_utc(value: datetime) -> datetime:
+        # naive database timestamps are stored in UTC
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+
+    @staticmethod
+    def _opaque_tag(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith('W/') else tag
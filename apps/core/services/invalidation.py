@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Callable, Optional
+
+from config.database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidationBus:
+    """
+    Deliver Postgres NOTIFY messages (sent by `FastModel` CRUD helpers or `DatabaseManager.notify`) to
+    subscribers of this worker.
+
+    Each worker runs one listener task on a dedicated connection. Subscribers are called with the payload of a
+    message, or with `None` after (re)connecting, because messages sent while the listener was disconnected are
+    lost and everything cached may be stale.
+    """
+
+    reconnect_delay = 5
+
+    def __init__(self):
+        self._subscribers: dict[str, list[Callable[[Optional[str]], None]]] = defaultdict(list)
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, channel: str, callback: Callable[[Optional[str]], None]):
+        self._subscribers[channel].append(callback)
+
+    def start(self):
+        if self._task is None and self._subscribers:
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _listen(self):
+        while True:
+            connection = None
+            try:
+                # connecting and LISTEN block on the network, keep them off the event loop
+                connection = await asyncio.get_running_loop().run_in_executor(None, self._connect)
+                self._dispatch_all(None)
+                await self._read(connection)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Invalidation listener disconnected: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _connect(self):
+        # a dedicated connection, detached from the pool, so it doesn't hold a pool slot
+        pool_connection = DatabaseManager.engine.raw_connection()
+        pool_connection.detach()
+        connection = pool_connection.dbapi_connection
+        connection.autocommit = True
+
+        with connection.cursor() as cursor:
+            for channel in self._subscribers:
+                cursor.execute(f'LISTEN "{channel}"')
+        return connection
+
+    async def _read(self, connection):
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(connection.fileno(), readable.set)
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    self._dispatch(notify.channel, notify.payload)
+        finally:
+            loop.remove_reader(connection.fileno())
+
+    def _dispatch(self, channel: str, payload: Optional[str]):
+        for callback in self._subscribers.get(channel, []):
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"Invalidation callback of channel {channel} failed: {e}")
+
+    def _dispatch_all(self, payload: Optional[str]):
+        for channel in self._subscribers:
+            self._dispatch(channel, payload)
+
+
+invalidation_bus = InvalidationBus()
@@ -1,16 +1,33 @@
+import contextlib
+import hashlib
+import logging
+import multiprocessing
 import os
-import uuid
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, Future
 from pathlib import Path
 
 from fastapi import UploadFile, status, HTTPException
+from PIL import Image, ImageOps
 
 from config.database import DatabaseManager
-from config.settings import MEDIA_DIR, MAX_FILE_SIZE
-from typing import Union
+from config.settings import MEDIA_DIR, MAX_FILE_SIZE, MEDIA_DERIVATIVE_SIZES, MEDIA_DERIVATIVE_QUALITY, \
+    MEDIA_DERIVATIVE_WORKERS
+from typing import Any, Callable, Union, Optional, List
+
+logger = logging.getLogger(__name__)
 
 
 # TODO set permission to access media-directory and files
 class MediaService:
+    # uploads are copied in blocks of this size, so only one block of a file is in memory at a time
+    chunk_size = 1024 * 1024
+
+    # image format of derivatives by the extension of the original (GIF derivatives are not animated)
+    derivative_extensions = {'jpg': 'jpg', 'jpeg': 'jpg', 'png': 'png', 'gif': 'png'}
+
+    _executor: Optional[ProcessPoolExecutor] = None
+
     def __init__(self, parent_directory: str = "media", sub_directory: Union[str, int] = None):
         testing = DatabaseManager.get_testing_mode()
         if not testing:
@@ -20,29 +37,86 @@ class MediaService:
                 f"{MEDIA_DIR}/test/{parent_directory}/{sub_directory}" if sub_directory else parent_directory)
         # self.path.mkdir(parents=True, exist_ok=True)
 
-    def save_file(self, file: UploadFile):
-        # TODO separate exceptions to a module in core app
+    def store_file(self, file: UploadFile, lock: Optional[Callable[[str], Any]] = None):
+        """
+        Save an upload under its content hash, `ab/cd/<sha256>.<ext>` relative to `self.path`, so identical uploads
+        share a single file that never changes (and can be cached forever).
+
+        `lock` is called with the content hash right before the file is linked under its name, so the caller can
+        serialize it with the deletion of the same content.
 
-        file_extension = self.get_file_extension(file)
+        A hash is stored once, under the extension of its first upload: the same content uploaded with another
+        extension (`.jpeg` after `.jpg`) reuses that file, so its references can be counted by the hash.
 
-        # Generate a unique filename with a random string and date
-        file_name = self.generate_unique_filename(file.filename)
-        if not os.path.exists(self.path):
-            os.makedirs(self.path, exist_ok=True)
+        Returns `(src, extension, content_hash, is_new)`, `is_new` is False if the same content was already stored,
+        then nothing is written.
+        """
 
-            # for file in files:
-        new_file = os.path.join(self.path, file_name)
+        file_extension = self.get_file_extension(file).lower()
+        os.makedirs(self.path, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=self.path, prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                content_hash = self._copy_upload(file, temp_file)
+            os.chmod(temp_path, 0o644)
+
+            if lock is not None:
+                lock(content_hash)
+            src = self.find_content_path(content_hash) or self.get_content_path(content_hash, file_extension)
+            file_extension = os.path.basename(src).partition('.')[2]
+            destination = os.path.join(self.path, src)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            try:
+                # a hard link creates the name only if it doesn't exist, so a duplicate (even a concurrent one)
+                # is a no-op, and a new file appears complete
+                os.link(temp_path, destination)
+                is_new = True
+            except FileExistsError:
+                is_new = False
+        finally:
+            os.remove(temp_path)
+        return src, file_extension, content_hash, is_new
 
-        with open(new_file, 'wb') as f:
-            f.write(file.file.read())
+    @staticmethod
+    def get_content_path(content_hash: str, extension: str) -> str:
+        # fan-out directories keep the number of files per directory small
+        file_name = f"{content_hash}.{extension}" if extension else content_hash
+        return f"{content_hash[:2]}/{content_hash[2:4]}/{file_name}"
 
-        return file_name, file_extension
+    def find_content_path(self, content_hash: str) -> Optional[str]:
+        """
+        Return the path of the stored file of `content_hash` (relative to `self.path`), with any extension.
+        """
+
+        directory = os.path.dirname(self.get_content_path(content_hash, ''))
+        try:
+            names = os.listdir(os.path.join(self.path, directory))
+        except FileNotFoundError:
+            return None
+        # derivatives are named `<hash>_<size>.<ext>`
+        for name in names:
+            if name == content_hash or name.startswith(f"{content_hash}."):
+                return f"{directory}/{name}"
+        return None
 
-    def generate_unique_filename(self, filename: str) -> str:
-        random_string = str(uuid.uuid4().hex)
-        file_extension = filename.split('.')[-1]
-        unique_filename = f"{random_string}.{file_extension}"
-        return unique_filename
+    def _copy_upload(self, file: UploadFile, target) -> str:
+        """
+        Copy an upload to `target` in chunks, rejecting it as soon as it exceeds `MAX_FILE_SIZE`.
+        Returns the sha256 of the content.
+        """
+
+        max_size = MAX_FILE_SIZE * 1024 * 1024
+        content_hash = hashlib.sha256()
+        size = 0
+        file.file.seek(0)
+        while chunk := file.file.read(self.chunk_size):
+            size += len(chunk)
+            if size > max_size:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"File size exceeds {MAX_FILE_SIZE}MB limit")
+            content_hash.update(chunk)
+            target.write(chunk)
+        return content_hash.hexdigest()
 
     @staticmethod
     def get_file_extension(file: UploadFile) -> str:
@@ -61,21 +135,93 @@ class MediaService:
         return True
 
     @staticmethod
-    async def is_allowed_file_size(file: UploadFile):
-        file_size_in_bytes = MAX_FILE_SIZE * 1024 * 1024  # MB in bytes
-
-        file_size = len(await file.read())
-        if file_size > file_size_in_bytes:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                                detail=f"File size exceeds {file_size_in_bytes}MB limit")
+    def is_allowed_file_size(file: UploadFile):
+        # measured by seeking to the end of the (spooled) upload, without reading it into memory
+        file_size = MediaService.get_file_size_mb(file)
 
         # to reset the cursor to the beginning of the file.
         file.file.seek(0)
+        if file_size > MAX_FILE_SIZE:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"File size exceeds {MAX_FILE_SIZE}MB limit")
         return True
 
+    # -------------------
+    # --- Derivatives ---
+    # -------------------
+
+    @classmethod
+    def get_derivative_names(cls, file_name: str) -> Optional[dict]:
+        """
+        Return the file names of the derivatives of an image, `{size: {'src': name, 'webp': name}}`, or `None` if
+        no derivatives are made for its type.
+        """
+
+        stem, _, extension = file_name.rpartition('.')
+        derivative_extension = cls.derivative_extensions.get(extension.lower())
+        if not stem or derivative_extension is None:
+            return None
+        return {
+            size: {'src': f"{stem}_{size}.{derivative_extension}", 'webp': f"{stem}_{size}.webp"}
+            for size in MEDIA_DERIVATIVE_SIZES
+        }
+
+    def has_derivatives(self, file_name: str) -> bool:
+        """
+        Whether all derivatives of a saved image exist.
+        """
+
+        names = self.get_derivative_names(file_name)
+        return names is not None and all(os.path.exists(os.path.join(self.path, name))
+                                         for sizes in names.values() for name in sizes.values())
+
+    def create_derivatives(self, file_name: str) -> Optional[Future]:
+        """
+        Resize a saved image to every size of `MEDIA_DERIVATIVE_SIZES` in a worker process.
+
+        Returns right away, the derivatives appear next to the original when they are done, the future's result is
+        the list of the created names (empty if the original was deleted meanwhile).
+        """
+
+        names = self.get_derivative_names(file_name)
+        if names is None:
+            return None
+
+        future = self._get_executor().submit(_make_derivatives, str(self.path), file_name,
+                                             MEDIA_DERIVATIVE_SIZES, names, MEDIA_DERIVATIVE_QUALITY)
+        future.add_done_callback(_log_derivatives_error)
+        return future
+
+    @classmethod
+    def _get_executor(cls) -> ProcessPoolExecutor:
+        if cls._executor is None:
+            # forking the threaded server process could copy locks held by its other threads and its open
+            # sockets (database pools, the LISTEN connection) into the workers, so they are spawned
+            cls._executor = ProcessPoolExecutor(max_workers=MEDIA_DERIVATIVE_WORKERS,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return cls._executor
+
+    @classmethod
+    def shutdown_executor(cls):
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=True)
+            cls._executor = None
+
     def delete_file(self, file_name: str):
+        """
+        Delete a file and its derivatives, `file_name` is relative to `self.path`.
+        """
+
         file_path = os.path.join(self.path, file_name)
 
+        # derivatives are removed with the original, missing ones are ignored
+        for names in (self.get_derivative_names(file_name) or {}).values():
+            for name in names.values():
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+
         # Attempt to delete the file
         try:
             os.remove(file_path)
@@ -84,3 +230,59 @@ class MediaService:
             # Handle the case where the file could not be deleted
             print(f"Error: {e}")
             return False  # Return False if there was an error deleting the file
+
+
+def _make_derivatives(directory: str, file_name: str, sizes: dict, names: dict, quality: int) -> List[str]:
+    """
+    Save resized copies of an image, runs in a worker process of `MediaService`.
+    `file_name` and the derivative `names` are relative to `directory`.
+    """
+
+    created = []
+    with Image.open(os.path.join(directory, file_name)) as image:
+        # respect the camera orientation, and drop it, because the pixels are rotated now
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+        for size, max_side in sizes.items():
+            derivative = image.copy()
+            # only shrinks, smaller images keep their size
+            derivative.thumbnail((max_side, max_side), Image.LANCZOS)
+
+            for name in (names[size]['src'], names[size]['webp']):
+                extension = name.rpartition('.')[2]
+                if extension == 'jpg':
+                    frame, options = derivative.convert('RGB'), {'format': 'JPEG', 'quality': quality,
+                                                                  'optimize': True, 'progressive': True}
+                elif extension == 'webp':
+                    frame, options = derivative, {'format': 'WEBP', 'quality': quality, 'method': 4}
+                else:
+                    frame, options = derivative, {'format': 'PNG', 'optimize': True}
+
+                # written to a temp file and renamed, so a partial derivative is never served
+                destination = os.path.join(directory, name)
+                descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(destination), prefix='.derivative-')
+                try:
+                    with os.fdopen(descriptor, 'wb') as temp_file:
+                        frame.save(temp_file, **options)
+                    os.chmod(temp_path, 0o644)
+                    os.replace(temp_path, destination)
+                except BaseException:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
+                created.append(name)
+
+    # the file was deleted (its last media is gone) while its derivatives were made
+    if not os.path.exists(os.path.join(directory, file_name)):
+        for name in created:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(directory, name))
+        return []
+    return created
+
+
+def _log_derivatives_error(future: Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Image derivatives failed: {future.exception()}")
@@ -0,0 +1,139 @@
+import asyncio
+import cProfile
+import functools
+import os
+import pstats
+import re
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from fastapi.routing import APIRoute
+
+from config.settings import PROFILING_DIR, PROFILING_KEEP_PER_ROUTE
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import HTMLRenderer
+    from pyinstrument.session import Session
+except ImportError:
+    Profiler = None
+
+# profiler of the current request (see `ProfilingMiddleware`)
+_request_profiler: ContextVar[Optional['RequestProfiler']] = ContextVar('request_profiler', default=None)
+
+
+class RequestProfiler:
+    """
+    Profile of a single request, an HTML report of pyinstrument when it is installed, a pstats file of cProfile
+    otherwise.
+
+    Profilers only see the thread they run in, so the event loop part of a request and its sync endpoint (in the
+    thread pool, see `profile_sync_endpoints`) are profiled separately and merged into one report. With cProfile
+    the event loop part includes the other requests served meanwhile.
+    """
+
+    extension = 'html' if Profiler is not None else 'pstats'
+
+    def __init__(self):
+        self._results = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def current(cls) -> Optional['RequestProfiler']:
+        return _request_profiler.get()
+
+    @contextmanager
+    def activate(self):
+        """
+        Profile the block in the current thread, and sync endpoints called in it.
+        """
+        token = _request_profiler.set(self)
+        try:
+            with self.profile(async_mode=True):
+                yield
+        finally:
+            _request_profiler.reset(token)
+
+    @contextmanager
+    def profile(self, async_mode: bool = False):
+        """
+        Profile the block in the current thread, `async_mode` follows the current task across `await`s.
+        """
+        if Profiler is not None:
+            profiler = Profiler(async_mode='enabled' if async_mode else 'disabled')
+            profiler.start()
+            try:
+                yield
+            finally:
+                self._add(profiler.stop())
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                self._add(profiler)
+
+    def _add(self, result):
+        with self._lock:
+            self._results.append(result)
+
+    def save(self, path: Path):
+        """
+        Write the report to `path`, and remove the oldest reports of the same route beyond
+        `PROFILING_KEEP_PER_ROUTE`.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            results = list(self._results)
+
+        if Profiler is not None:
+            session = functools.reduce(Session.combine, results)
+            path.write_text(HTMLRenderer().render(session), encoding='utf-8')
+        else:
+            stats = pstats.Stats(results[0])
+            for profile in results[1:]:
+                stats.add(profile)
+            stats.dump_stats(path)
+
+        reports = sorted(path.parent.glob(f"*.{self.extension}"))
+        for report in reports[:-PROFILING_KEEP_PER_ROUTE]:
+            try:
+                os.remove(report)
+            except FileNotFoundError:
+                pass
+
+    @classmethod
+    def get_report_path(cls, route: str, method: str) -> Path:
+        """
+        `PROFILING_DIR/<route>/<time>-<method>.<ext>`, reports of a route sort by time.
+        """
+        directory = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        name = f"{datetime.now().strftime('%Y%m%dT%H%M%S.%f')}-{method}.{cls.extension}"
+        return Path(PROFILING_DIR) / directory / name
+
+
+def profile_sync_endpoints(routes):
+    """
+    Run sync endpoints under the profiler of their request (if it's profiled), they are called in the thread pool,
+    out of sight of the profiler of the event loop.
+    """
+    for route in routes:
+        if isinstance(route, APIRoute) and not asyncio.iscoroutinefunction(route.dependant.call):
+            route.dependant.call = _profiled(route.dependant.call)
+
+
+def _profiled(call):
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        profiler = RequestProfiler.current()
+        if profiler is None:
+            return call(*args, **kwargs)
+        with profiler.profile():
+            return call(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from typing import Optional
+
+from config import settings
+from config.database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaMonitor:
+    """
+    Measure the replication lag of the read replica every `DB_REPLICA_CHECK_INTERVAL` seconds.
+
+    Reads go to the primary while the replica is behind by more than `DB_REPLICA_MAX_LAG`, can't be reached, or
+    wasn't measured recently (this task stopped), see `DatabaseManager.replica_available`.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and DatabaseManager.engine_replica is not None:
+            self._task = asyncio.get_running_loop().create_task(self._monitor())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _monitor(self):
+        while True:
+            was_available = DatabaseManager.replica_available()
+            lag = await DatabaseManager.check_replica()
+            available = DatabaseManager.replica_available()
+            if available != was_available:
+                if available:
+                    logger.info(f"Reading from the replica, lag {lag:.1f}s")
+                else:
+                    logger.warning(f"Reading from the primary, replica lag is {'unknown' if lag is None else lag}")
+            await asyncio.sleep(settings.DB_REPLICA_CHECK_INTERVAL)
+
+
+replica_monitor = ReplicaMonitor()
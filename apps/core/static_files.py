@@ -0,0 +1,175 @@
+import os
+import re
+import stat
+from datetime import datetime, timezone
+from mimetypes import guess_type
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import PathLike, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+from apps.core.services.conditional import ConditionalService
+from config.settings import MEDIA_IMMUTABLE_MAX_AGE, MEDIA_MAX_AGE
+
+
+class MediaFiles(StaticFiles):
+    """
+    `StaticFiles` for uploaded media:
+
+    - content-addressed files (see `MediaService.store_file`) and their derivatives are cached as `immutable`
+    - strong ETags, conditional requests and single `Range` requests (with `If-Range`)
+    - the WebP copy of an image (`<name>.webp`) is served to clients that accept `image/webp`, and a precompressed
+      `<name>.br`/`<name>.gz` sibling to clients that accept its encoding
+
+    In production `/media` is served by nginx with the same rules (`nginx/nginx.conf`), so media requests don't
+    reach the app, this is the fallback when it runs without the proxy.
+    """
+
+    # content-addressed names, `<sha256>.<ext>` or `<sha256>_<size>.<ext>`, never change their content
+    immutable_name = re.compile(r'(^|/)[0-9a-f]{64}(_[a-z]+)?\.[a-z0-9]+$')
+    webp_extensions = ('jpg', 'jpeg', 'png', 'gif')
+    # precompressed siblings in the order of preference
+    encodings = (('br', '.br'), ('gzip', '.gz'))
+
+    def file_response(self, full_path: PathLike, stat_result: os.stat_result, scope: Scope,
+                      status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        path = str(full_path)
+        media_type = guess_type(path)[0] or 'application/octet-stream'
+        headers = {'Cache-Control': self.get_cache_control(path), 'Accept-Ranges': 'bytes'}
+        vary = []
+
+        stem, _, extension = path.rpartition('.')
+        if extension.lower() in self.webp_extensions:
+            vary.append('Accept')
+            if self._accepts(request_headers.get('accept', ''), 'image/webp'):
+                sibling = self._stat_file(f"{stem}.webp")
+                if sibling is not None:
+                    path, stat_result, media_type = f"{stem}.webp", sibling, 'image/webp'
+
+        # images are compressed already
+        if not media_type.startswith(('image/', 'video/', 'audio/')) or media_type == 'image/svg+xml':
+            vary.append('Accept-Encoding')
+            for encoding, suffix in self.encodings:
+                if self._accepts(request_headers.get('accept-encoding', ''), encoding):
+                    sibling = self._stat_file(path + suffix)
+                    if sibling is not None:
+                        path, stat_result = path + suffix, sibling
+                        headers['Content-Encoding'] = encoding
+                        break
+
+        if vary:
+            headers['Vary'] = ', '.join(vary)
+        # strong, a served file (or sibling) is replaced by renaming, never rewritten in place
+        headers['ETag'] = f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+        last_modified = datetime.fromtimestamp(stat_result.st_mtime, tz=timezone.utc)
+        headers['Last-Modified'] = ConditionalService.http_date(last_modified)
+
+        request = Request(scope)
+        if ConditionalService.is_not_modified(request, headers['ETag'], last_modified):
+            return Response(status_code=304, headers=headers)
+
+        byte_range = None
+        if status_code == 200 and scope['method'] in ('GET', 'HEAD'):
+            byte_range = self.get_byte_range(request_headers, headers, stat_result.st_size)
+            if byte_range == ():
+                headers['Content-Range'] = f"bytes */{stat_result.st_size}"
+                return Response(status_code=416, headers=headers)
+            if byte_range is not None:
+                status_code = 206
+                headers['Content-Range'] = f"bytes {byte_range[0]}-{byte_range[1] - 1}/{stat_result.st_size}"
+
+        return MediaFileResponse(path, status_code=status_code, headers=headers, media_type=media_type,
+                                 stat_result=stat_result, method=scope['method'], byte_range=byte_range)
+
+    def get_cache_control(self, path: str) -> str:
+        if self.immutable_name.search(path):
+            return f"public, max-age={MEDIA_IMMUTABLE_MAX_AGE}, immutable"
+        return f"public, max-age={MEDIA_MAX_AGE}"
+
+    @staticmethod
+    def get_byte_range(request_headers: Headers, headers: dict, size: int) -> Optional[Tuple[int, ...]]:
+        """
+        Return `(start, stop)` of a `Range: bytes=...` request, `None` to send the whole file (no range, multiple
+        ranges, or a stale `If-Range`), or `()` if the range can't be satisfied.
+        """
+
+        range_header = request_headers.get('range')
+        if range_header is None:
+            return None
+        if_range = request_headers.get('if-range')
+        if if_range is not None and if_range.strip() not in (headers['ETag'], headers['Last-Modified']):
+            return None
+
+        unit, _, ranges = range_header.partition('=')
+        match = re.fullmatch(r'\s*(\d*)\s*-\s*(\d*)\s*', ranges)
+        if unit.strip().lower() != 'bytes' or match is None or match.group(1) == match.group(2) == '':
+            return None
+
+        first, last = match.groups()
+        if first == '':
+            # the last N bytes
+            start, stop = max(size - int(last), 0), size
+        else:
+            start, stop = int(first), size if last == '' else min(int(last) + 1, size)
+        if start >= stop:
+            return ()
+        return start, stop
+
+    @staticmethod
+    def _accepts(header: str, value: str) -> bool:
+        for item in header.split(','):
+            name, _, params = item.partition(';')
+            if name.strip().lower() != value:
+                continue
+            quality = params.strip().replace(' ', '')
+            return not quality.startswith('q=') or quality[2:] not in ('0', '0.0', '0.00', '0.000')
+        return False
+
+    @staticmethod
+    def _stat_file(path: str) -> Optional[os.stat_result]:
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        return stat_result if stat.S_ISREG(stat_result.st_mode) else None
+
+
+class MediaFileResponse(FileResponse):
+    """
+    `FileResponse` of a byte range, sent with the zero-copy (sendfile) extension when the ASGI server has it.
+    """
+
+    def __init__(self, *args, byte_range: Optional[Tuple[int, int]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        start, stop = byte_range or (0, self.stat_result.st_size)
+        self.start, self.count = start, stop - start
+        self.headers['content-length'] = str(self.count)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        if self.send_header_only or not self.count:
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            return
+
+        async with await anyio.open_file(self.path, mode='rb') as file:
+            if 'http.response.zerocopysend' in scope.get('extensions', {}):
+                await send({'type': 'http.response.zerocopysend', 'file': file.wrapped, 'offset': self.start,
+                            'count': self.count, 'more_body': False})
+                return
+
+            await file.seek(self.start)
+            remaining = self.count
+            while remaining:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    # the file was truncated, the response can't be completed
+                    break
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': bool(remaining)})
+            if remaining:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
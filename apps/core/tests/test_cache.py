@@ -0,0 +1,213 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from apps.core.services import cache as cache_module
+from apps.core.services.cache import CacheService
+
+
+class FakeRedis:
+    """
+    L2 in a dict, expiry is ignored.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(cache_module, 'redis', fake)
+    monkeypatch.setattr(cache_module.settings, 'CACHE_ENABLED', True)
+    return fake
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, 'monotonic', clock)
+    return clock
+
+
+class Loader:
+    def __init__(self, value=None, delay=0.0):
+        self.value = value
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return self.value
+
+
+def test_loads_once_then_hits_l1_and_l2(redis):
+    cache = CacheService('test')
+    loader = Loader({'name': 'bag'})
+
+    assert cache.get_or_set('key', loader) == {'name': 'bag'}
+    assert cache.get_or_set('key', loader) == {'name': 'bag'}
+    assert loader.calls == 1
+    assert json.loads(redis.values['test:key']) == {'name': 'bag'}
+
+    # another worker (an empty L1) is served from L2
+    assert CacheService('test').get_or_set('key', loader) == {'name': 'bag'}
+    assert loader.calls == 1
+
+
+def test_l1_ttl_expiry(redis, clock):
+    cache = CacheService('test', l1_ttl=30)
+    cache.get_or_set('key', Loader('old'))
+    redis.values['test:key'] = json.dumps('new')
+
+    clock.now += 29
+    assert cache.get_or_set('key', Loader('loaded')) == 'old'
+
+    # expired in L1, read again from L2
+    clock.now += 2
+    assert cache.get_or_set('key', Loader('loaded')) == 'new'
+
+
+def test_l1_lru_eviction(redis):
+    cache = CacheService('test', l1_max_size=2)
+    for key in ('a', 'b'):
+        cache.get_or_set(key, Loader(key))
+    # `a` is used last, so `b` is evicted by `c`
+    cache.get_or_set('a', Loader('reloaded'))
+    cache.get_or_set('c', Loader('c'))
+    redis.values.clear()
+
+    assert cache.get_or_set('a', Loader('reloaded')) == 'a'
+    assert cache.get_or_set('c', Loader('reloaded')) == 'c'
+    assert cache.get_or_set('b', Loader('reloaded')) == 'reloaded'
+
+
+def test_invalidate_removes_both_levels(redis):
+    cache = CacheService('test')
+    cache.get_or_set('key', Loader('old'))
+
+    cache.invalidate('key')
+
+    assert 'test:key' not in redis.values
+    assert cache.get_or_set('key', Loader('new')) == 'new'
+
+
+def test_concurrent_misses_load_once(redis):
+    cache = CacheService('test')
+    loader = Loader('value', delay=0.1)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def read():
+        barrier.wait()
+        results.append(cache.get_or_set('key', loader))
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ['value'] * 8
+    assert loader.calls == 1
+    assert cache._flights == {}
+
+
+def test_invalidation_during_load_discards_value(redis):
+    cache = CacheService('test')
+
+    def loader():
+        # the row changes (and is invalidated) while the old one is being loaded
+        cache.invalidate('key')
+        return 'old'
+
+    assert cache.get_or_set('key', loader) == 'old'
+    assert 'test:key' not in redis.values
+    assert cache.get_or_set('key', Loader('new')) == 'new'
+
+
+def test_local_eviction_during_load_discards_value(redis):
+    cache = CacheService('test')
+
+    def loader():
+        # the NOTIFY of another worker's write arrives while the old row is being loaded
+        cache.evict_local('key')
+        return 'old'
+
+    cache.get_or_set('key', loader)
+    redis.values.clear()
+
+    assert cache.get_or_set('key', Loader('new')) == 'new'
+
+
+def test_l2_read_before_invalidation_is_discarded(redis):
+    cache = CacheService('test')
+    redis.values['test:key'] = json.dumps('old')
+    get = redis.get
+
+    def get_then_invalidate(key):
+        value = get(key)
+        # the write's invalidation runs right after L2 was read
+        cache.invalidate('key')
+        return value
+
+    redis.get = get_then_invalidate
+    assert cache.get_or_set('key', Loader('new')) == 'old'
+    redis.get = get
+
+    assert cache.get_or_set('key', Loader('new')) == 'new'
+
+
+def test_redis_errors_fall_back_to_loader(redis, monkeypatch):
+    def fail(*args, **kwargs):
+        raise ConnectionError('redis is down')
+
+    monkeypatch.setattr(redis, 'get', fail)
+    monkeypatch.setattr(redis, 'set', fail)
+    cache = CacheService('test')
+
+    assert cache.get_or_set('key', Loader('value')) == 'value'
+    # Redis is skipped until the retry delay passed
+    assert not cache._l2_available()
+
+
+@pytest.mark.asyncio
+async def test_async_concurrent_misses_load_once(redis):
+    cache = CacheService('test')
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return 'value'
+
+    results = await asyncio.gather(*(cache.aget_or_set('key', loader) for _ in range(8)))
+
+    assert results == ['value'] * 8
+    assert calls == 1
+    assert cache._async_flights == {}
@@ -0,0 +1,93 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import FastAPI, Request, Response
+from fastapi.testclient import TestClient
+
+from apps.core.services.conditional import ConditionalService
+
+ETAG = ConditionalService.make_etag('abc123')
+LAST_MODIFIED = datetime(2024, 5, 1, 12, 30, 15, 123456)
+
+app = FastAPI()
+
+
+@app.get('/resource')
+def get_resource(request: Request, response: Response):
+    ConditionalService.evaluate(request, response, ETAG, LAST_MODIFIED)
+    return {'name': 'bag'}
+
+
+client = TestClient(app)
+
+
+def test_validators_are_set():
+    response = client.get('/resource')
+
+    assert response.status_code == 200
+    assert response.json() == {'name': 'bag'}
+    assert response.headers['etag'] == 'W/"abc123"'
+    assert response.headers['cache-control'] == 'no-cache'
+    assert response.headers['last-modified'] == 'Wed, 01 May 2024 12:30:15 GMT'
+
+
+@pytest.mark.parametrize('if_none_match', [
+    'W/"abc123"',
+    # compared weakly, so a strong tag of the same value matches too
+    '"abc123"',
+    '*',
+    ' * ',
+    '"other", W/"abc123"',
+    '"other",W/"abc123" ,"more"',
+])
+def test_not_modified(if_none_match):
+    response = client.get('/resource', headers={'If-None-Match': if_none_match})
+
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['etag'] == 'W/"abc123"'
+    assert response.headers['cache-control'] == 'no-cache'
+    assert response.headers['last-modified'] == 'Wed, 01 May 2024 12:30:15 GMT'
+
+
+@pytest.mark.parametrize('if_none_match', [
+    'W/"other"',
+    '"abc1234"',
+    'W/"abc"',
+    '"other", "more"',
+    'abc123',
+])
+def test_modified(if_none_match):
+    response = client.get('/resource', headers={'If-None-Match': if_none_match})
+
+    assert response.status_code == 200
+    assert response.json() == {'name': 'bag'}
+    assert response.headers['etag'] == 'W/"abc123"'
+
+
+@pytest.mark.parametrize('if_modified_since, status_code', [
+    ('Wed, 01 May 2024 12:30:15 GMT', 304),
+    ('Wed, 01 May 2024 12:30:16 GMT', 304),
+    ('Wed, 01 May 2024 12:30:14 GMT', 200),
+    ('Wed, 01 May 2024 14:30:15 +0200', 304),
+    ('not a date', 200),
+])
+def test_if_modified_since(if_modified_since, status_code):
+    response = client.get('/resource', headers={'If-Modified-Since': if_modified_since})
+
+    assert response.status_code == status_code
+
+
+def test_if_none_match_takes_precedence():
+    response = client.get('/resource', headers={
+        'If-None-Match': '"other"',
+        'If-Modified-Since': 'Wed, 01 May 2024 12:30:16 GMT',
+    })
+
+    assert response.status_code == 200
+
+
+def test_http_date_of_aware_datetime():
+    value = datetime(2024, 5, 1, 14, 30, 15, tzinfo=timezone.utc).astimezone()
+
+    assert ConditionalService.http_date(value) == 'Wed, 01 May 2024 14:30:15 GMT'
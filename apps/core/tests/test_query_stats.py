@@ -0,0 +1,49 @@
+import pytest
+
+from apps.core.middleware import QueryStats, fingerprint
+
+
+@pytest.mark.parametrize('statement, expected', [
+    # psycopg2
+    ('SELECT * FROM products WHERE id = %(id_1)s LIMIT %(param_1)s',
+     'SELECT * FROM products WHERE id = ? LIMIT ?'),
+    # asyncpg
+    ('SELECT * FROM products WHERE id = $1 LIMIT $2',
+     'SELECT * FROM products WHERE id = ? LIMIT ?'),
+    # inlined literals, a quote is escaped by doubling it
+    ("SELECT * FROM products WHERE name = 'it''s 42' AND price > 10.5 AND stock < -3",
+     'SELECT * FROM products WHERE name = ? AND price > ? AND stock < -?'),
+    ("SELECT '' , 'a'", 'SELECT ? , ?'),
+    # lists of any length and style
+    ('SELECT * FROM products WHERE id IN (%(id_1_1)s, %(id_1_2)s, %(id_1_3)s)',
+     'SELECT * FROM products WHERE id IN (...)'),
+    ('SELECT * FROM products WHERE id IN ($1)', 'SELECT * FROM products WHERE id IN (...)'),
+    ('SELECT * FROM products WHERE id in (1, 2)', 'SELECT * FROM products WHERE id IN (...)'),
+    # digits of identifiers are kept, quoted or not
+    ('SELECT option1, anon_1.id, t2.name FROM t2, anon_1',
+     'SELECT option1, anon_1.id, t2.name FROM t2, anon_1'),
+    ('SELECT "column 1", "say ""2""" FROM t WHERE x = 3',
+     'SELECT "column 1", "say ""2""" FROM t WHERE x = ?'),
+    # whitespace is normalized
+    ('SELECT *\n  FROM products\n\tWHERE id = 1', 'SELECT * FROM products WHERE id = ?'),
+])
+def test_fingerprint(statement, expected):
+    assert fingerprint(statement) == expected
+
+
+def test_repeated():
+    stats = QueryStats()
+    for product_id in range(5):
+        stats.record(f'SELECT * FROM product_media WHERE product_id = {product_id}', 0.001)
+    for product_id in range(3):
+        stats.record(f'SELECT * FROM product_options WHERE product_id = %(id_{product_id})s', 0.001)
+    stats.record('SELECT * FROM products LIMIT 10', 0.002)
+
+    assert stats.count == 9
+    assert stats.duration == pytest.approx(0.010)
+    assert stats.repeated(threshold=3) == [
+        ('SELECT * FROM product_media WHERE product_id = ?', 5),
+        ('SELECT * FROM product_options WHERE product_id = ?', 3),
+    ]
+    assert stats.repeated(threshold=4) == [('SELECT * FROM product_media WHERE product_id = ?', 5)]
+    assert stats.repeated(threshold=6) == []
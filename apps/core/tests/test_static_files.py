@@ -0,0 +1,128 @@
+import gzip
+import hashlib
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+from apps.core.static_files import MediaFiles
+from config.settings import MEDIA_IMMUTABLE_MAX_AGE, MEDIA_MAX_AGE
+
+CONTENT = bytes(range(256)) * 4
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+IMMUTABLE = f'ab/cd/{CONTENT_HASH}.jpg'
+
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path / 'ab' / 'cd').mkdir(parents=True)
+    (tmp_path / IMMUTABLE).write_bytes(CONTENT)
+    (tmp_path / 'ab' / 'cd' / f'{CONTENT_HASH}_thumb.jpg').write_bytes(CONTENT[:100])
+    (tmp_path / 'ab' / 'cd' / f'{CONTENT_HASH}.webp').write_bytes(b'webp')
+    (tmp_path / 'notes.txt').write_bytes(b'plain text')
+    (tmp_path / 'notes.txt.gz').write_bytes(gzip.compress(b'compressed text'))
+    app = Starlette(routes=[Mount('/media', MediaFiles(directory=tmp_path))])
+    return TestClient(app)
+
+
+def test_full_response(client):
+    response = client.get(f'/media/{IMMUTABLE}')
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers['content-length'] == str(len(CONTENT))
+    assert response.headers['content-type'] == 'image/jpeg'
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert response.headers['vary'] == 'Accept'
+    assert response.headers['etag'].startswith('"')
+
+
+@pytest.mark.parametrize('path, cache_control', [
+    (IMMUTABLE, f'public, max-age={MEDIA_IMMUTABLE_MAX_AGE}, immutable'),
+    (f'ab/cd/{CONTENT_HASH}_thumb.jpg', f'public, max-age={MEDIA_IMMUTABLE_MAX_AGE}, immutable'),
+    ('notes.txt', f'public, max-age={MEDIA_MAX_AGE}'),
+])
+def test_cache_control(client, path, cache_control):
+    response = client.get(f'/media/{path}')
+
+    assert response.headers['cache-control'] == cache_control
+
+
+@pytest.mark.parametrize('byte_range, content_range, content', [
+    ('bytes=0-99', 'bytes 0-99/1024', CONTENT[:100]),
+    ('bytes=1000-', 'bytes 1000-1023/1024', CONTENT[1000:]),
+    ('bytes=-24', 'bytes 1000-1023/1024', CONTENT[-24:]),
+    # the end is clamped to the size
+    ('bytes=1000-5000', 'bytes 1000-1023/1024', CONTENT[1000:]),
+])
+def test_range(client, byte_range, content_range, content):
+    response = client.get(f'/media/{IMMUTABLE}', headers={'Range': byte_range})
+
+    assert response.status_code == 206
+    assert response.headers['content-range'] == content_range
+    assert response.headers['content-length'] == str(len(content))
+    assert response.content == content
+
+
+@pytest.mark.parametrize('byte_range', ['bytes=1024-', 'bytes=2000-3000'])
+def test_range_not_satisfiable(client, byte_range):
+    response = client.get(f'/media/{IMMUTABLE}', headers={'Range': byte_range})
+
+    assert response.status_code == 416
+    assert response.headers['content-range'] == 'bytes */1024'
+    assert response.content == b''
+
+
+@pytest.mark.parametrize('byte_range', ['bytes=0-9, 20-29', 'items=0-9', 'bytes=-'])
+def test_unsupported_range_sends_whole_file(client, byte_range):
+    response = client.get(f'/media/{IMMUTABLE}', headers={'Range': byte_range})
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+def test_if_range(client):
+    etag = client.get(f'/media/{IMMUTABLE}').headers['etag']
+
+    response = client.get(f'/media/{IMMUTABLE}', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert response.status_code == 206
+
+    response = client.get(f'/media/{IMMUTABLE}', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+def test_not_modified(client):
+    headers = client.get(f'/media/{IMMUTABLE}').headers
+
+    response = client.get(f'/media/{IMMUTABLE}', headers={'If-None-Match': headers['etag']})
+
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['etag'] == headers['etag']
+    assert response.headers['cache-control'] == f'public, max-age={MEDIA_IMMUTABLE_MAX_AGE}, immutable'
+
+    response = client.get(f'/media/{IMMUTABLE}', headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200
+
+
+def test_webp_sibling(client):
+    response = client.get(f'/media/{IMMUTABLE}', headers={'Accept': 'image/avif,image/webp,*/*'})
+    assert response.headers['content-type'] == 'image/webp'
+    assert response.content == b'webp'
+
+    response = client.get(f'/media/{IMMUTABLE}', headers={'Accept': 'image/webp;q=0'})
+    assert response.headers['content-type'] == 'image/jpeg'
+
+
+def test_precompressed_sibling(client):
+    response = client.get('/media/notes.txt', headers={'Accept-Encoding': 'br, gzip'})
+
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert response.content == b'compressed text'
+
+    response = client.get('/media/notes.txt', headers={'Accept-Encoding': 'identity'})
+    assert 'content-encoding' not in response.headers
+    assert response.content == b'plain text'
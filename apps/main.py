@@ -1,10 +1,16 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
 from config.database import DatabaseManager
+from config.metrics import mark_process_dead
 from config.routers import RouterManager
-from config.settings import MEDIA_DIR
+from config.settings import MEDIA_DIR, SQL_INSTRUMENTATION
+from apps.core.middleware import ReadYourWritesMiddleware, SQLInstrumentationMiddleware, MetricsMiddleware, \
+    ProfilingMiddleware
+from apps.core.services.profiler import profile_sync_endpoints
+from apps.core.services.invalidation import invalidation_bus
+from apps.core.services.replica import replica_monitor
+from apps.core.static_files import MediaFiles
 #from config.elasticsearch import es
 
 from apps.search.routers import router as search_router
@@ -21,7 +27,8 @@ DatabaseManager().create_database_tables()
 # --- Init FastAPI ---
 # --------------------
 
-app = FastAPI()
+# every request gets a database session of its own
+app = FastAPI(dependencies=[Depends(DatabaseManager.session_scope)])
 
 # ------------------
 # --- Middleware ---
@@ -34,12 +41,25 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"])
 
+# clients read their own writes from the primary, not from a lagging replica
+app.add_middleware(ReadYourWritesMiddleware)
+
+# reports of requests profiled on demand (by admins) or at random, see `ProfilingMiddleware`
+app.add_middleware(ProfilingMiddleware)
+
+# Prometheus metrics of every route, served on `GET /metrics`
+app.add_middleware(MetricsMiddleware)
+
+# query count and database time of every request (`Server-Timing` and logs), added last so it wraps everything
+if SQL_INSTRUMENTATION:
+    app.add_middleware(SQLInstrumentationMiddleware)
+
 # -------------------
 # --- Static File ---
 # -------------------
 
-# add static-file support, for see images by URL
-app.mount("/media", StaticFiles(directory=MEDIA_DIR), name="media")
+# add static-file support, for see images by URL (served by nginx in production, see `MediaFiles`)
+app.mount("/media", MediaFiles(directory=MEDIA_DIR), name="media")
 
 # --------------------
 # --- Init Routers ---
@@ -49,11 +69,30 @@ RouterManager(app).import_routers()
 app.include_router(search_router)
 app.include_router(orders_router)
 
+# sync endpoints run in the thread pool, profiled requests profile them there
+profile_sync_endpoints(app.routes)
+
+
 @app.on_event("startup")
 async def startup_event():
-    
+    # drop cached data of this worker when another worker changes it
+    invalidation_bus.start()
+    # route reads to the replica only while its lag is acceptable
+    replica_monitor.start()
+
     from apps.analytics.etl.products_etl import sync_products_to_elasticsearch
     try:
         await sync_products_to_elasticsearch()
     except Exception as e:
-        print(f"Ошибка синхронизации с Elasticsearch: {e}")
\ No newline at end of file
+        print(f"Ошибка синхронизации с Elasticsearch: {e}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await invalidation_bus.stop()
+    await replica_monitor.stop()
+    mark_process_dead()
+
+    # let pending image derivatives finish
+    from apps.core.services.media import MediaService
+    MediaService.shutdown_executor()
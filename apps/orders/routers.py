@@ -6,6 +6,7 @@ from apps.accounts.services.user import User
 #from apps.orders.models import 
 from typing import List
 from apps.orders.services.order_service import OrderService, PaymentService
+from config.database import DatabaseManager
 
 
 router = APIRouter(prefix="/orders", tags=["Orders"])
@@ -27,7 +28,7 @@ async def pay_order(
     """Оплата заказа"""
     return await PaymentService.process_payment(order_id, current_user.id, payment_data)
 
-@router.get("/{order_id}", response_model=schemas.OrderDetail)
+@router.get("/{order_id}", response_model=schemas.OrderDetail, dependencies=[Depends(DatabaseManager.read_only)])
 async def get_order(
     order_id: int,
     current_user: User = Depends(Permission.is_authenticated)
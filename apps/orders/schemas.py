@@ -1,11 +1,22 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Optional
 from datetime import datetime
 
 class OrderItemCreate(BaseModel):
-    variant_id: int
+    variant_id: Optional[int] = None
+    # a variant of a product with sparse variants can be ordered by its options combination
+    product_id: Optional[int] = None
+    option1: Optional[int] = None
+    option2: Optional[int] = None
+    option3: Optional[int] = None
     quantity: int = Field(gt=0, le=100)
 
+    @model_validator(mode='after')
+    def validate_variant(self):
+        if self.variant_id is None and self.product_id is None:
+            raise ValueError('variant_id or product_id with options is required')
+        return self
+
 class OrderDetail(BaseModel):
     id: int
     status: str
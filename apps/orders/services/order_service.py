@@ -1,7 +1,13 @@
 from typing import List
+
+import anyio
+from sqlalchemy import select
+from sqlalchemy.orm import Session
 from config.database import DatabaseManager
+from config.metrics import ORDERS_CREATED, ORDERS_AMOUNT, PAYMENTS
 from apps.orders.schemas import OrderItemCreate, PaymentCreate
 from apps.products.models import ProductVariant, Product
+from apps.products.services import ProductService
 from apps.accounts.models import Seller
 from fastapi import HTTPException, status
 from apps.orders.models import Order, OrderItem, Payment
@@ -10,22 +16,27 @@ import uuid
 class OrderService:
     @classmethod
     async def create_order(cls, user_id: int, items: List[OrderItemCreate]):
-        with DatabaseManager.session as session:
+        async with DatabaseManager.get_async_session() as session:
             # Проверка наличия товаров
             for item in items:
-                variant = session.get(ProductVariant, item.variant_id)
+                if item.variant_id is None:
+                    # store the ordered combination of a product with sparse variants
+                    variant = await session.run_sync(ProductService.get_or_store_variant, item.product_id,
+                                                     (item.option1, item.option2, item.option3))
+                    item.variant_id = variant.id
+                variant = await session.get(ProductVariant, item.variant_id)
                 if not variant:
                     raise HTTPException(
                         status_code=status.HTTP_400_BAD_REQUEST,
                         detail=f"Variant {item.variant_id} not found"
                     )
-                product = session.get(Product, variant.product_id)
+                product = await session.get(Product, variant.product_id)
                 if not product:
                     raise HTTPException(
                         status_code=status.HTTP_400_BAD_REQUEST,
                         detail=f"Product {variant.product_id} not found"
                     )
-                seller = session.get(Seller, product.seller_id)
+                seller = await session.get(Seller, product.seller_id)
                 if not seller:
                     raise HTTPException(
                         status_code=status.HTTP_400_BAD_REQUEST,
@@ -40,14 +51,15 @@ class OrderService:
             # Создание заказа
             order = Order(user_id=user_id, status="created", total_amount=0)
             session.add(order)
-            session.flush()
+            await session.flush()
             
             # Добавление товаров
             total = 0
+            ordered_product_ids = set()
             for item in items:
-                variant = session.get(ProductVariant, item.variant_id)
-                product = session.get(Product, variant.product_id)
-                seller = session.get(Seller, product.seller_id)
+                variant = await session.get(ProductVariant, item.variant_id)
+                product = await session.get(Product, variant.product_id)
+                seller = await session.get(Seller, product.seller_id)
                 
                 order_item = OrderItem(
                     order_id=order.id,
@@ -60,23 +72,36 @@ class OrderService:
                 total += variant.price * item.quantity
                 variant.stock -= item.quantity  # Уменьшаем остаток
                 session.add(order_item)
+                ordered_product_ids.add(variant.product_id)
             
             order.total_amount = total
-            session.commit()
+            await session.run_sync(cls._refresh_products, ordered_product_ids)
+            await session.commit()
+
+            # stock of ordered variants is changed, the Redis delete runs in a worker thread
+            await anyio.to_thread.run_sync(ProductService.invalidate_cache, *ordered_product_ids)
+            ORDERS_CREATED.inc()
+            ORDERS_AMOUNT.inc(float(total))
             
             return {"order_id": order.id, "total": total}
+
+    @staticmethod
+    def _refresh_products(session: Session, product_ids):
+        # in the transaction of the order
+        ProductService.refresh_cards(product_ids, session)
+        ProductService.notify_changes(session, product_ids)
     
     @staticmethod
     async def get_order_detail(order_id: int, user_id: int):
-        with DatabaseManager.session as session:
-            order = session.get(Order, order_id)
+        async with DatabaseManager.get_async_session() as session:
+            order = await session.get(Order, order_id)
             if not order or order.user_id != user_id:
                 raise HTTPException(status_code=404, detail="Order not found")
             
             items = []
-            for item in order.items:
-                product = session.get(Product, item.product_id)
-                variant = session.get(ProductVariant, item.variant_id)
+            for item in await session.scalars(select(OrderItem).where(OrderItem.order_id == order.id)):
+                product = await session.get(Product, item.product_id)
+                variant = await session.get(ProductVariant, item.variant_id)
                 
                 items.append({
                     "product_name": product.product_name,
@@ -97,8 +122,8 @@ class OrderService:
 class PaymentService:
     @staticmethod
     async def process_payment(order_id: int, user_id: int, payment_data: PaymentCreate):
-        with DatabaseManager.session as session:
-            order = session.get(Order, order_id)
+        async with DatabaseManager.get_async_session() as session:
+            order = await session.get(Order, order_id)
             if not order or order.user_id != user_id:
                 raise HTTPException(status_code=404, detail="Order not found")
             
@@ -116,5 +141,6 @@ class PaymentService:
             payment.transaction_id = f"txn_{uuid.uuid4().hex}"
             order.status = "paid"
             
-            session.commit()
+            await session.commit()
+            PAYMENTS.labels(payment.status).inc()
             return {"status": "success", "transaction_id": payment.transaction_id}
\ No newline at end of file
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Float, UniqueConstraint, Text, DateTime, func, Numeric
+from sqlalchemy import Column, ForeignKey, Integer, String, Float, UniqueConstraint, Text, DateTime, func, Numeric, Index, \
+    Boolean, DDL, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.types import Float
 from sqlalchemy.orm import relationship
 
@@ -8,14 +10,21 @@ from config.database import FastModel
 class Product(FastModel):
     __tablename__ = "products"
 
+    # workers drop cached payloads of a product when it (or its variants, media) is changed
+    notify_channel = "product_changes"
+
     # Существующие поля (оставить без изменений)
     id = Column(Integer, primary_key=True)
     product_name = Column(String(255), nullable=False)
     description = Column(Text, nullable=True)
     status = Column(String, default='draft')
     created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=True, onupdate=func.now())
     published_at = Column(DateTime, nullable=True)
+
+    # if True, only the default variant and customized combinations are stored in `product_variants`,
+    # the rest of options combinations are computed on read.
+    sparse_variants = Column(Boolean, default=False, server_default='false', nullable=False)
     #quantity_in_stock = Column(Integer, default=0)
 
     seller_id = Column(Integer, ForeignKey("sellers.id"), nullable=False)
@@ -29,6 +38,11 @@ class Product(FastModel):
     external_ratings_count = Column(Integer)  # Количество оценок (из 'no_of_ratings', предварительно очистить от запятых)
     external_price = Column(String(50))  # Цена из CSV (например, "₹648")
     external_discount_price = Column(String(50))  # Цена со скидкой из CSV
+    # md5 полей товара из CSV, повторный импорт не изменившейся строки ничего не пишет (см. `load_products_from_csv`)
+    external_hash = Column(String(32))
+
+    # ключ товара фида при импорте CSV, у товаров без ссылки (созданных в приложении) NULL
+    __table_args__ = (Index('ix_products_external_link', 'external_link', unique=True),)
 
     # Существующие отношения (оставить без изменений)
     options = relationship("ProductOption", back_populates="product", cascade="all, delete-orphan")
@@ -65,6 +79,7 @@ class ProductOptionItem(FastModel):
 
 class ProductVariant(FastModel):
     __tablename__ = "product_variants"
+    notify_channel = Product.notify_channel
 
     id = Column(Integer, primary_key=True)
     product_id = Column(Integer, ForeignKey("products.id"))
@@ -78,15 +93,22 @@ class ProductVariant(FastModel):
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
 
+    # lowest and highest prices of a product (see `ProductCard`) are read from this index
+    __table_args__ = (Index('ix_product_variants_product_id_price', 'product_id', 'price'),)
+
     # option1 = relationship("ProductOptionItem", foreign_keys=[option1_id])
     # option2 = relationship("ProductOptionItem", foreign_keys=[option2_id])
     # option3 = relationship("ProductOptionItem", foreign_keys=[option3_id])
 
     product = relationship("Product", back_populates="variants")
 
+    def notify_payload(self) -> str:
+        return str(self.product_id)
+
 
 class ProductMedia(FastModel):
     __tablename__ = "product_media"
+    notify_channel = Product.notify_channel
 
     id = Column(Integer, primary_key=True)
     product_id = Column(Integer, ForeignKey("products.id"))
@@ -99,7 +121,71 @@ class ProductMedia(FastModel):
     alt = Column(String, nullable=True)
     src = Column(String)
     type = Column(String)
+    # sha256 of the file of a content-addressed `src`, the file is shared by all media with the same hash and
+    # is deleted with the last of them
+    content_hash = Column(String(64), nullable=True, index=True)
+    # the resized copies (`MediaService.create_derivatives`) of the file exist, they are made in the background
+    # after an upload, clients get the original `src` until then
+    has_derivatives = Column(Boolean, default=False, server_default='false', nullable=False)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
 
     product = relationship("Product", back_populates="media")
+
+    def notify_payload(self) -> str:
+        return str(self.product_id)
+
+
+class ProductCard(FastModel):
+    """
+    Denormalized listing data of a product, `GET /products` is served from this table only.
+
+    A card is refreshed by `ProductService.refresh_cards` on every product, variant and media write, and is removed
+    with its product.
+    """
+
+    __tablename__ = "product_cards"
+
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    product_name = Column(String(255), nullable=False)
+    status = Column(String)
+    created_at = Column(DateTime)
+
+    # price of the default variant, or of the first variant with a non-zero price and stock
+    price = Column(Numeric(12, 2), nullable=False, default=0)
+    # price bounds of all variants, for the `min_price`/`max_price` list filters (`None` without variants)
+    min_price = Column(Numeric(12, 2))
+    max_price = Column(Numeric(12, 2))
+    total_stock = Column(Integer, nullable=False, default=0)
+
+    # file name of the main (first) media, `external_image_url` is used when the product has no media
+    main_media_src = Column(String)
+    # `ProductMedia.has_derivatives` of the main media, the listing shows its `card` size only if it exists
+    main_media_has_derivatives = Column(Boolean, default=False, server_default='false', nullable=False)
+    external_image_url = Column(String(500))
+
+    rating = Column(Float)
+    ratings_count = Column(Integer)
+    main_category = Column(String(100))
+    sub_category = Column(String(200))
+
+    # weighted words of the name (A) and description (B), for the full-text `search` filter
+    search_vector = Column(TSVECTOR)
+
+    # list filters and keyset pagination of every sort key, which seeks on (sort_key, product_id)
+    __table_args__ = (
+        Index('ix_product_cards_created_at_product_id', 'created_at', 'product_id'),
+        Index('ix_product_cards_price_product_id', 'price', 'product_id'),
+        Index('ix_product_cards_min_price', 'min_price'),
+        Index('ix_product_cards_max_price', 'max_price'),
+        Index('ix_product_cards_status', 'status'),
+        Index('ix_product_cards_main_category', 'main_category'),
+        Index('ix_product_cards_search_vector', 'search_vector', postgresql_using='gin'),
+        # substring (`ILIKE '%term%'`) matches of names
+        Index('ix_product_cards_product_name_trgm', 'product_name', postgresql_using='gin',
+              postgresql_ops={'product_name': 'gin_trgm_ops'}),
+    )
+
+
+# the trigram index of product cards needs the extension
+event.listen(ProductCard.__table__, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
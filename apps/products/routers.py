@@ -29,15 +29,17 @@ attached to it.
 """
 
 from fastapi import APIRouter, status, Form, UploadFile, File, HTTPException, Query, Path, Depends
-from fastapi import Request
-from fastapi.responses import JSONResponse
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import Optional, List, Union
 
 from apps.accounts.services.permissions import Permission
+from apps.core.services.conditional import ConditionalService
 from apps.core.services.media import MediaService
 from apps.products import schemas
 from apps.products.services import ProductService
 from apps.accounts.models import User
+from config.database import DatabaseManager
 from fastapi import FastAPI, HTTPException, status
 import logging
 
@@ -61,7 +63,7 @@ router = APIRouter(
     summary='Create a new product',
     description='Create a new product.',
     tags=["Product"])
-async def create_product(
+def create_product(
     request: Request,
     product: schemas.CreateProductIn,
     current_user: User = Depends(Permission.is_seller)  # Только продавцы могут создавать товары
@@ -73,41 +75,65 @@ async def create_product(
     return {'product': ProductService(request).create_product(product_data)}
 
 
+@router.post(
+    '/bulk',
+    status_code=status.HTTP_201_CREATED,
+    response_model=schemas.CreateProductsBulkOut,
+    summary='Create products in bulk',
+    description='Create a list of products (with their options and variants) in a single transaction.',
+    tags=["Product"])
+def create_products_bulk(
+    request: Request,
+    payload: schemas.CreateProductsBulkIn,
+    current_user: User = Depends(Permission.is_seller)
+):
+    seller_id = current_user.seller_profile[0].id
+    products_data = [{**product.model_dump(), 'seller_id': seller_id} for product in payload.products]
+
+    service = ProductService(request)
+    product_ids = service.create_products(products_data)
+    return {'products': service.retrieve_products(product_ids)}
+
+
+@router.get(
+    '/export',
+    status_code=status.HTTP_200_OK,
+    summary='Export the catalog',
+    description="Stream the catalog as one row per product variant (product fields, option item names, price, "
+                "stock and main image) in NDJSON (`application/x-ndjson`) or CSV (`text/csv`) format. "
+                "Includes unpublished products, so it is restricted to admins and sellers.",
+    tags=['Product'],
+    dependencies=[Depends(Permission.is_admin)])
+def export_products(
+    request: Request,
+    export_format: str = Query('ndjson', alias='format', pattern='^(ndjson|csv)$', description="ndjson or csv"),
+    product_status: Optional[str] = Query(None, alias="status",
+                                          description="Filter by status (active, archived, draft)")
+):
+    rows = ProductService(request).export_products(export_format, product_status)
+    media_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return StreamingResponse(rows, media_type=media_type, headers={
+        'Content-Disposition': f'attachment; filename="products.{export_format}"'})
+
+
 @router.get(
     '/{product_id}',
     status_code=status.HTTP_200_OK,
     response_model=schemas.RetrieveProductOut,
     summary='Retrieve a single product',
-    description="Retrieve a single product.",
-    tags=["Product"])
-async def retrieve_product(request: Request, product_id: int):
+    description="Retrieve a single product. "
+                "Answers `304 Not Modified` to a matching `If-None-Match` or `If-Modified-Since`.",
+    tags=["Product"],
+    dependencies=[Depends(DatabaseManager.read_only)])
+async def retrieve_product(request: Request, response: Response, product_id: int):
     # TODO user can retrieve products with status of (active , archived)
-    # TODO fix bug if there are not product in database
-    product = ProductService(request).retrieve_product(product_id)
+    validator = await ProductService(request).aget_validator(product_id)
+    if validator is not None:
+        ConditionalService.evaluate(request, response, *validator)
+    product = await ProductService(request).aretrieve_product(product_id)
     return {"product": product}
 
 
-@router.get(
-    '/',
-    status_code=status.HTTP_200_OK,
-    response_model=schemas.ListProductOut,
-    summary='Retrieve a list of products',
-    description='Retrieve a list of products.',
-    tags=["Product"])
-async def list_produces(request: Request):
-    # TODO permission: admin users (admin, is_admin), none-admin users
-    # TODO as none-admin permission, list products that they status is `active`.
-    # TODO as none-admin, dont list the product with the status of `archived` and `draft`.
-    # TODO only admin can list products with status `draft`.
-    products = ProductService(request).list_products()
-    if products:
-        return {'products': products}
-    return JSONResponse(
-        content=None,
-        status_code=status.HTTP_204_NO_CONTENT
-    )
-
-
 @router.put(
     '/variants/{variant_id}',
     status_code=status.HTTP_200_OK,
@@ -115,7 +141,7 @@ async def list_produces(request: Request):
     summary='Updates an existing product variant',
     description='Modify an existing Product Variant.',
     tags=['Product Variant'])
-async def update_variant(
+def update_variant(
     variant_id: int,
     payload: schemas.UpdateVariantIn,
     current_user: User = Depends(Permission.is_seller)
@@ -149,7 +175,7 @@ async def update_variant(
     description='Deletes an existing product.',
     tags=['Product'],
     dependencies=[Depends(Permission.is_admin)])
-async def delete_product(
+def delete_product(
     product_id: int,
     current_user: User = Depends(Permission.is_seller)
 ):
@@ -179,7 +205,7 @@ async def delete_product(
     description='Modify an existing Product Variant.',
     tags=['Product Variant'],
     dependencies=[Depends(Permission.is_admin)])
-async def update_variant(variant_id: int, payload: schemas.UpdateVariantIn):
+def update_variant(variant_id: int, payload: schemas.UpdateVariantIn):
     update_data = {}
 
     for key, value in payload.model_dump().items():
@@ -198,8 +224,9 @@ async def update_variant(variant_id: int, payload: schemas.UpdateVariantIn):
     response_model=schemas.RetrieveVariantOut,
     summary='Retrieve a single product variant',
     description='Retrieves a single product variant.',
-    tags=['Product Variant'])
-async def retrieve_variant(variant_id: int):
+    tags=['Product Variant'],
+    dependencies=[Depends(DatabaseManager.read_only)])
+def retrieve_variant(variant_id: int):
     return {'variant': ProductService.retrieve_variant(variant_id)}
 
 
@@ -208,12 +235,30 @@ async def retrieve_variant(variant_id: int):
     status_code=status.HTTP_200_OK,
     response_model=schemas.ListVariantsOut,
     summary='Retrieves a list of product variants',
-    description='Retrieves a list of product variants.',
-    tags=['Product Variant'])
-async def list_variants(product_id: int):
+    description='Retrieves a list of product variants. '
+                'Answers `304 Not Modified` to a matching `If-None-Match` or `If-Modified-Since`.',
+    tags=['Product Variant'],
+    dependencies=[Depends(DatabaseManager.read_only)])
+def list_variants(request: Request, response: Response, product_id: int):
+    validator = ProductService(request).get_validator(product_id, media=False)
+    if validator is not None:
+        ConditionalService.evaluate(request, response, *validator)
     return {'variants': ProductService.retrieve_variants(product_id)}
 
 
+@router.post(
+    '/{product_id}/variants',
+    status_code=status.HTTP_201_CREATED,
+    response_model=schemas.MaterializeVariantOut,
+    summary='Store a product variant',
+    description='Store a variant (an options combination) of a product with sparse variants, '
+                'so it can be updated by its `variant_id`.',
+    tags=['Product Variant'],
+    dependencies=[Depends(Permission.is_seller)])
+def materialize_variant(product_id: int, payload: schemas.MaterializeVariantIn):
+    return {'variant': ProductService.materialize_variant(product_id, **payload.model_dump())}
+
+
 # -----------------------------
 # --- Product-Media Routers ---
 # -----------------------------
@@ -232,12 +277,13 @@ when updating a product, actions on product's images are:
     description="Create a new product image.",
     tags=['Product Image'],
     dependencies=[Depends(Permission.is_admin)])
-async def create_product_media(request: Request, x_files: List[UploadFile] = File(), product_id: int = Path(),
-                               alt: Optional[str] = Form(None)):
+def create_product_media(request: Request, x_files: List[UploadFile] = File(), product_id: int = Path(),
+                         alt: Optional[str] = Form(None)):
+    # a plain route: copying, hashing and storing the uploads run in the thread pool, not on the event loop
     # check the file size and type
     for file in x_files:
         MediaService.is_allowed_extension(file)
-        await MediaService.is_allowed_file_size(file)
+        MediaService.is_allowed_file_size(file)
 
     media = ProductService(request).create_media(product_id=product_id, alt=alt, files=x_files)
     return {'media': media}
@@ -249,8 +295,9 @@ async def create_product_media(request: Request, x_files: List[UploadFile] = Fil
     response_model=schemas.RetrieveMediaOut,
     summary='Retrieve a single product image',
     description='Get a single product image by id.',
-    tags=['Product Image'])
-async def retrieve_single_media(request: Request, media_id: int):
+    tags=['Product Image'],
+    dependencies=[Depends(DatabaseManager.read_only)])
+def retrieve_single_media(request: Request, media_id: int):
     return {'media': ProductService(request).retrieve_single_media(media_id)}
 
 
@@ -259,9 +306,14 @@ async def retrieve_single_media(request: Request, media_id: int):
     status_code=status.HTTP_200_OK,
     response_model=schemas.RetrieveProductMediaOut,
     summary="Receive a list of all Product Images",
-    description="Receive a list of all Product Images.",
-    tags=['Product Image'])
-async def list_product_media(request: Request, product_id: int):
+    description="Receive a list of all Product Images. "
+                "Answers `304 Not Modified` to a matching `If-None-Match` or `If-Modified-Since`.",
+    tags=['Product Image'],
+    dependencies=[Depends(DatabaseManager.read_only)])
+def list_product_media(request: Request, response: Response, product_id: int):
+    validator = ProductService(request).get_validator(product_id, variants=False)
+    if validator is not None:
+        ConditionalService.evaluate(request, response, *validator)
     media = ProductService(request).retrieve_media_list(product_id=product_id)
     if media:
         return {'media': media}
@@ -279,7 +331,7 @@ async def list_product_media(request: Request, product_id: int):
     description='Updates an existing image.',
     tags=['Product Image'],
     dependencies=[Depends(Permission.is_admin)])
-async def update_media(request: Request, media_id: int, file: UploadFile = File(), alt: Optional[str] = Form(None)):
+def update_media(request: Request, media_id: int, file: UploadFile = File(), alt: Optional[str] = Form(None)):
     update_data = {}
 
     if file is not None:
@@ -291,6 +343,8 @@ async def update_media(request: Request, media_id: int, file: UploadFile = File(
     try:
         updated_media = ProductService(request).update_media(media_id, **update_data)
         return {'media': updated_media}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
@@ -302,7 +356,7 @@ async def update_media(request: Request, media_id: int, file: UploadFile = File(
     description='Delete image from a product.',
     tags=['Product Image'],
     dependencies=[Depends(Permission.is_admin)])
-async def delete_product_media(product_id: int, media_ids: str = Query(...)):
+def delete_product_media(product_id: int, media_ids: str = Query(...)):
     media_ids_list = list(map(int, media_ids.split(',')))
     ProductService.delete_product_media(product_id, media_ids_list)
 
@@ -314,7 +368,7 @@ async def delete_product_media(product_id: int, media_ids: str = Query(...)):
     description='Delete a media file.',
     tags=['Product Image'],
     dependencies=[Depends(Permission.is_admin)])
-async def delete_media_file(media_id: int):
+def delete_media_file(media_id: int):
     ProductService.delete_media_file(media_id)
 
 
@@ -328,27 +382,42 @@ from fastapi import Query
     status_code=status.HTTP_200_OK,
     response_model=schemas.ListProductOut,
     summary='Retrieve a list of products',
-    description="""Retrieve a list of products with pagination and filtering.
+    description="""Retrieve a list of product cards (listing price, price range, stock, main image, rating and
+    category) with pagination and filtering, use `GET /products/{product_id}` for the details of a product.
     
     **Filters**:
     - status: Filter by product status (active, archived, draft)
+    - category: Filter by main category
     - min_price: Minimum product price
     - max_price: Maximum product price
-    - search: Search in product names and descriptions
+    - search: Full-text search in product names and descriptions, or a part of a product name
     
     **Pagination**:
     - page: Page number (default 1)
     - limit: Items per page (default 12)
+
+    **Cursor pagination**:
+    - sort: Sort key `id`, `created_at`, `price` or `relevance` (best match first, only with `search`), prefix with
+      `-` for descending order (default `relevance` with `search`, otherwise `id`)
+    - after: Opaque cursor taken from `next_cursor` of the previous page, `page` is ignored when it is set
+    - include_total: Set to `false` to skip counting products (recommended for infinite scroll)
     """,
-    tags=['Product'])
+    tags=['Product'],
+    dependencies=[Depends(DatabaseManager.read_only)])
 async def list_produces(
     request: Request,
-    status: Optional[str] = Query(None, description="Filter by status (active, archived, draft)"),
-    min_price: Optional[float] = Query(None, description="Minimum product price"),
-    max_price: Optional[float] = Query(None, description="Maximum product price"),
+    product_status: Optional[str] = Query(None, alias="status",
+                                          description="Filter by status (active, archived, draft)"),
+    category: Optional[str] = Query(None, description="Filter by main category"),
+    min_price: Optional[float] = Query(None, ge=0, description="Minimum product price"),
+    max_price: Optional[float] = Query(None, ge=0, description="Maximum product price"),
     search: Optional[str] = Query(None, description="Search in product names and descriptions"),
     page: int = Query(1, ge=1, description="Page number"),
-    limit: int = Query(12, ge=1, le=100, description="Items per page")
+    limit: int = Query(12, ge=1, le=100, description="Items per page"),
+    sort: Optional[str] = Query(None, description="Sort key: id, created_at, price or relevance "
+                                                  "(prefix with '-' for descending)"),
+    after: Optional[str] = Query(None, description="Cursor of the previous page (`next_cursor`)"),
+    include_total: bool = Query(True, description="Count all matched products")
 ):
     # TODO permission: admin users (admin, is_admin), none-admin users
     # TODO as none-admin permission, list products that they status is `active`.
@@ -356,16 +425,18 @@ async def list_produces(
     # TODO only admin can list products with status `draft`.
     
     filters = {
-        "status": status,
+        "status": product_status,
+        "category": category,
         "min_price": min_price,
         "max_price": max_price,
         "search": search
     }
     
-    products = ProductService(request).list_products(page=page, limit=limit, filters=filters)
-    if products:
+    products = await ProductService(request).alist_products(page=page, limit=limit, filters=filters, sort=sort,
+                                                            after=after, include_total=include_total)
+    if products['items']:
         return {'products': products}
     return JSONResponse(
         content=None,
         status_code=status.HTTP_204_NO_CONTENT
-    )
\ No newline at end of file
+    )
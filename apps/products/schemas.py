@@ -1,9 +1,11 @@
-from typing import List
+from typing import List, Dict
 from typing import Optional
 
 
 from fastapi import Query, UploadFile
-from pydantic import BaseModel, constr, field_validator, model_validator
+from pydantic import BaseModel, Field, constr, field_validator, model_validator
+
+from config import settings
 
 """
 ---------------------------------------
@@ -13,7 +15,8 @@ from pydantic import BaseModel, constr, field_validator, model_validator
 
 
 class VariantSchema(BaseModel):
-    variant_id: int
+    # not stored variants of a product with sparse variants don't have an id
+    variant_id: Optional[int]
     product_id: int
     price: Optional[float]
     stock: int
@@ -33,6 +36,16 @@ class UpdateVariantOut(BaseModel):
     variant: VariantSchema
 
 
+class MaterializeVariantIn(BaseModel):
+    option1: Optional[int] = None
+    option2: Optional[int] = None
+    option3: Optional[int] = None
+
+
+class MaterializeVariantOut(BaseModel):
+    variant: VariantSchema
+
+
 class RetrieveVariantOut(BaseModel):
     variant: VariantSchema
 
@@ -77,11 +90,18 @@ class OptionIn(BaseModel):
 """
 
 
+class MediaSizeSchema(BaseModel):
+    src: str
+    webp: str
+
+
 class ProductMediaSchema(BaseModel):
     media_id: int
     product_id: int
     alt: str
     src: str
+    # resized copies by size name (`thumb`, `card`, `full`)
+    sizes: Optional[Dict[str, MediaSizeSchema]] = None
     type: str
     updated_at: Optional[str]
     created_at: str
@@ -157,6 +177,9 @@ class CreateProductIn(BaseModel):
     stock: int = 0
     #seller_id: int
 
+    # store only customized variants instead of every options combination
+    sparse_variants: bool = False
+
     options: Optional[List[OptionIn]] = None
 
     class Config:
@@ -176,7 +199,7 @@ class CreateProductIn(BaseModel):
 
     @model_validator(mode='before')
     def validate_uniqueness(cls, values):
-        options = values.get("options", [])
+        options = values.get("options") or []
         option_name_set = set()
         items_set = set()
 
@@ -201,6 +224,14 @@ class CreateProductIn(BaseModel):
         return values
 
 
+class CreateProductsBulkIn(BaseModel):
+    products: List[CreateProductIn] = Field(..., min_length=1, max_length=settings.products_bulk_create_limit)
+
+
+class CreateProductsBulkOut(BaseModel):
+    products: List[ProductSchema]
+
+
 class RetrieveProductOut(BaseModel):
     product: ProductSchema
 
@@ -225,12 +256,29 @@ class UpdateProductOut(BaseModel):
 
 # Добавляем в apps/products/schemas.py
 
+class ProductCardSchema(BaseModel):
+    product_id: int
+    product_name: str
+    status: Optional[str]
+    price: float
+    min_price: Optional[float]
+    max_price: Optional[float]
+    total_stock: int
+    image: Optional[str]
+    rating: Optional[float]
+    ratings_count: Optional[int]
+    main_category: Optional[str]
+    sub_category: Optional[str]
+    created_at: Optional[str]
+
+
 class PaginatedProductList(BaseModel):
-    items: List[ProductSchema]
-    total: int
-    page: int
+    items: List[ProductCardSchema]
+    total: Optional[int] = None
+    page: Optional[int] = None
     limit: int
-    pages: int
+    pages: Optional[int] = None
+    next_cursor: Optional[str] = None
 
 class ListProductOut(BaseModel):
     products: PaginatedProductList
\ No newline at end of file
@@ -1,97 +1,181 @@
+import base64
+import csv
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+from contextvars import ContextVar
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from itertools import product as options_combination
-from typing import Optional, List, Union
+from typing import Optional, List, Iterator
 
-from fastapi import Request
-from sqlalchemy import select, and_, or_
+from fastapi import Request, HTTPException, status
+from sqlalchemy import select, insert, update, and_, or_, func, tuple_, true, false, case, cast, literal_column, \
+    Integer
+from sqlalchemy.dialects.postgresql import array, insert as pg_insert, REAL
 
 from apps.core.date_time import DateTime
+from apps.core.services.cache import CacheService
+from apps.core.services.conditional import ConditionalService
+from apps.core.services.invalidation import invalidation_bus
 from apps.core.services.media import MediaService
-from apps.products.models import Product, ProductOption, ProductOptionItem, ProductVariant, ProductMedia
+from apps.products.models import Product, ProductOption, ProductOptionItem, ProductVariant, ProductMedia, ProductCard
 from config import settings
 from config.database import DatabaseManager
-from sqlalchemy.orm import Session
-from apps.accounts.models import User
+from sqlalchemy.orm import Session, aliased
+from apps.accounts.models import User, Seller
+
+logger = logging.getLogger(__name__)
+
+# product detail payloads (`retrieve_product`, `retrieve_variants`, `retrieve_media_list`)
+product_cache = CacheService(namespace='products')
+
+# the request of the current task, concurrent requests of async routes share the `ProductService` class
+_current_request: ContextVar[Optional[Request]] = ContextVar('product_service_request', default=None)
 
 
 class ProductService:
     request: Optional[Request]= None
     product = None
-    price: Union[int, float]
-    stock: int
     options: Optional[List] = [] 
-    options_data: List = []
     variants: List = []
     media: Optional[List] = None
+    # content-addressed media files of all products are stored in `media/products/<media_store_directory>`
+    media_store_directory = "store"
 
     @classmethod
     def __init__(cls, request: Optional[Request] = None):
         cls.request = request
+        _current_request.set(request)
 
     @classmethod
     def create_product(cls, data: dict, get_obj: bool = False):
-
-        cls._create_product(data)
-        cls.__create_product_options()
-        cls.__create_variants()
+        product_id = cls.create_products([data])[0]
+        cls.product = Product.get(product_id)
 
         if get_obj:
             return cls.product
-        return cls.retrieve_product(cls.product.id)
+        return cls.retrieve_product(product_id)
 
     @classmethod
-    def _create_product(cls, data: dict):
-        cls.price = data.pop('price', 0)
-        cls.stock = data.pop('stock', 0)
-        cls.options_data = data.pop('options', [])
-        cls.seller_id = data.pop('seller_id')
+    def create_products(cls, products_data: List[dict]) -> List[int]:
+        """
+        Create products with their options, option items and variants in a single transaction.
+
+        Each table is written with one batched `INSERT ... RETURNING id` for the whole list of products
+        (instead of one commit per row), so creating hundreds of products costs a handful of round trips.
+        Returns the ids of the new products in the same order as `products_data`.
+        """
+
+        products_rows = []
+        products_extra = []
+        for data in products_data:
+            data = dict(data)
+            price = data.pop('price', 0)
+            stock = data.pop('stock', 0)
+            options = data.pop('options', None) or []
+            data['sparse_variants'] = bool(data.get('sparse_variants')) and bool(options)
 
-        if 'status' in data:
             # Check if the value is one of the specified values, if not, set it to 'draft'
             valid_statuses = ['active', 'archived', 'draft']
-            if data['status'] not in valid_statuses:
+            if data.get('status') not in valid_statuses:
                 data['status'] = 'draft'
 
-        # create a product
-        with DatabaseManager.session as db:
-            cls.product = Product.create(**data, seller_id=cls.seller_id)
+            products_rows.append(data)
+            products_extra.append((price, stock, options))
 
-            cls._update_seller_products(db)
-
-    @classmethod
-    def _update_seller_products(cls, db: Session):
-        """Обновляем product_ids у продавца"""
-        from apps.accounts.models import Seller
-        
-        seller = db.query(Seller).get(cls.seller_id)
-        if seller:
-            # Инициализируем product_ids если None
-            if seller.product_ids is None:
-                seller.product_ids = []
-            
-            # Добавляем новый product_id если его еще нет
-            if cls.product.id not in seller.product_ids:
-                seller.product_ids = list(seller.product_ids) + [cls.product.id]
-                db.commit()
+        with DatabaseManager.session as session:
+            try:
+                # --- products ---
+                product_ids = session.scalars(
+                    insert(Product).returning(Product.id, sort_by_parameter_order=True)
+                    .execution_options(render_nulls=True), products_rows).all()
+
+                # --- options ---
+                options_rows = []
+                for product_id, (_, _, options) in zip(product_ids, products_extra):
+                    for option in options:
+                        options_rows.append({'product_id': product_id, 'option_name': option['option_name']})
+                option_ids = iter(session.scalars(
+                    insert(ProductOption).returning(ProductOption.id, sort_by_parameter_order=True),
+                    options_rows).all() if options_rows else [])
+
+                # --- option items ---
+                items_rows = []
+                for _, _, options in products_extra:
+                    for option in options:
+                        option_id = next(option_ids)
+                        for item in option['items']:
+                            items_rows.append({'option_id': option_id, 'item_name': item})
+                item_ids = iter(session.scalars(
+                    insert(ProductOptionItem).returning(ProductOptionItem.id, sort_by_parameter_order=True),
+                    items_rows).all() if items_rows else [])
+
+                # --- variants ---
+                variants_rows = []
+                for product_id, row, (price, stock, options) in zip(product_ids, products_rows, products_extra):
+                    items_id = [[next(item_ids) for _ in option['items']] for option in options]
+                    if row['sparse_variants']:
+                        # only the default variant is stored, combinations are computed on read
+                        items_id = []
+                    variants_rows.extend(cls._get_variants_rows(product_id, items_id, price, stock))
+                # `render_nulls` keeps rows with and without options in the same batch
+                session.execute(insert(ProductVariant).execution_options(render_nulls=True), variants_rows)
+
+                cls._update_sellers_products(session, products_rows, product_ids)
+                cls.refresh_cards(product_ids, session)
+                cls.notify_changes(session, product_ids)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+
+        # a miss of a not yet created product could be cached (e.g. empty variants)
+        cls.invalidate_cache(*product_ids)
+        return list(product_ids)
 
-    @classmethod
-    def __create_product_options(cls):
+    @staticmethod
+    def _get_variants_rows(product_id: int, items_id: List[List[int]], price, stock) -> List[dict]:
         """
-        Create new option if it doesn't exist and update its items,
-        and ensures that options are uniq in a product and also items in each option are uniq.
+        Build a default variant or variants by options combination.
         """
 
-        if cls.options_data:
-            for option in cls.options_data:
+        if not items_id:
+            # set a default variant
+            return [{'product_id': product_id, 'option1': None, 'option2': None, 'option3': None,
+                     'price': price, 'stock': stock}]
 
-                # Creates a new instance of the ProductOption model, adds it to the database,
-                # and commits the transaction. Returns the newly created model instance
-                new_option = ProductOption.create(product_id=cls.product.id, option_name=option['option_name'])
+        # create variants by options combination
+        variants_rows = []
+        for variant in options_combination(*items_id):
+            values_tuple = tuple(variant)
 
-                for item in option['items']:
-                    ProductOptionItem.create(option_id=new_option.id, item_name=item)
-            cls.options = cls.retrieve_options(cls.product.id)
-        else:
-            cls.options = None
+            # set each value to an option and set none if it doesn't exist
+            while len(values_tuple) < 3:
+                values_tuple += (None,)
+            option1, option2, option3 = values_tuple
+
+            variants_rows.append({'product_id': product_id, 'option1': option1, 'option2': option2,
+                                  'option3': option3, 'price': price, 'stock': stock})
+        return variants_rows
+
+    @staticmethod
+    def _update_sellers_products(session: Session, products_rows: List[dict], product_ids: List[int]):
+        """Обновляем product_ids у продавцов"""
+
+        new_product_ids = {}
+        for row, product_id in zip(products_rows, product_ids):
+            new_product_ids.setdefault(row['seller_id'], []).append(product_id)
+
+        for seller_id, seller_product_ids in new_product_ids.items():
+            session.execute(
+                update(Seller)
+                .where(Seller.id == seller_id)
+                .values(product_ids=func.array_cat(Seller.product_ids, array(seller_product_ids)))
+            )
 
     @classmethod
     def retrieve_options(cls, product_id):
@@ -100,11 +184,11 @@ class ProductService:
         """
 
         product_options = []
-        options = ProductOption.filter(ProductOption.product_id == product_id).all()
+        options = ProductOption.filter(ProductOption.product_id == product_id).order_by(ProductOption.id).all()
         for option in options:
             # Retrieves records from the database based on a given filter condition.
             # Returns a list of model instances matching the filter condition.
-            items = ProductOptionItem.filter(ProductOptionItem.option_id == option.id).all()
+            items = ProductOptionItem.filter(ProductOptionItem.option_id == option.id).order_by(ProductOptionItem.id).all()
 
             product_options.append({
                 'options_id': option.id,
@@ -117,72 +201,147 @@ class ProductService:
             return None
 
     @classmethod
-    def __create_variants(cls):
+    def retrieve_variants(cls, product_id):
         """
-        Create a default variant or create variants by options combination.
+        Get all variants of a product
         """
 
-        if cls.options:
+        return product_cache.get_or_set(f"variants:{product_id}", lambda: cls._load_variants(product_id))
 
-            # create variants by options combination
-            items_id = cls.get_item_ids_by_product_id(cls.product.id)
-            variants = list(options_combination(*items_id))
-            for variant in variants:
-                values_tuple = tuple(variant)
-
-                # set each value to an option and set none if it doesn't exist
-                while len(values_tuple) < 3:
-                    values_tuple += (None,)
-                option1, option2, option3 = values_tuple
-
-                ProductVariant.create(
-                    product_id=cls.product.id,
-                    option1=option1,
-                    option2=option2,
-                    option3=option3,
-                    price=cls.price,
-                    stock=cls.stock
-                )
+    @classmethod
+    def _load_variants(cls, product_id):
+        product_variants = []
+        variants: list[ProductVariant] = ProductVariant.filter(ProductVariant.product_id == product_id) \
+            .order_by(ProductVariant.id).all()
+        product = Product.get(product_id)
+        if product is not None and product.sparse_variants:
+            product_variants = cls._expand_sparse_variants(
+                product_id, cls.get_item_ids_by_product_id(product_id), variants)
         else:
-            # set a default variant
-            ProductVariant.create(
-                product_id=cls.product.id,
-                price=cls.price,
-                stock=cls.stock
-            )
+            for variant in variants:
+                product_variants.append(cls._variant_to_dict(variant))
 
-        cls.variants = cls.retrieve_variants(cls.product.id)
+        if product_variants:
+            return product_variants
+        return None
 
     @classmethod
-    def retrieve_variants(cls, product_id):
+    def _expand_sparse_variants(cls, product_id: int, items_id: List[List[int]], variants: List[ProductVariant]):
         """
-        Get all variants of a product
+        Compute all variants of a product with sparse variants.
+
+        Every options combination is a variant, stored rows override a combination and the default variant
+        (the row without options) holds the price and stock of the combinations that are not stored yet.
+        Not stored variants don't have a `variant_id`.
+
+        The list is as long as the stored variants of the same product without sparse variants, and it is cached
+        with the product. Listing cards count every combination too (see `_upsert_cards`).
         """
 
-        product_variants = []
-        variants: list[ProductVariant] = ProductVariant.filter(ProductVariant.product_id == product_id).all()
+        default_variant = None
+        stored_variants = {}
         for variant in variants:
-            product_variants.append(
-                {
-                    "variant_id": variant.id,
-                    "product_id": variant.product_id,
-                    "price": variant.price,
-                    "stock": variant.stock,
-                    "option1": variant.option1,
-                    "option2": variant.option2,
-                    "option3": variant.option3,
-                    "created_at": DateTime.string(variant.created_at),
-                    "updated_at": DateTime.string(variant.updated_at)
+            key = (variant.option1, variant.option2, variant.option3)
+            if key == (None, None, None):
+                default_variant = variant
+            else:
+                stored_variants[key] = variant
+
+        product_variants = []
+        for combination in options_combination(*items_id):
+            key = tuple(combination) + (None,) * (3 - len(combination))
+            if key in stored_variants:
+                product_variants.append(cls._variant_to_dict(stored_variants[key]))
+            elif default_variant is not None:
+                product_variants.append({
+                    "variant_id": None,
+                    "product_id": product_id,
+                    "price": default_variant.price,
+                    "stock": default_variant.stock,
+                    "option1": key[0],
+                    "option2": key[1],
+                    "option3": key[2],
+                    "created_at": DateTime.string(default_variant.created_at),
+                    "updated_at": DateTime.string(default_variant.updated_at)
                 })
+        return product_variants
 
-        if product_variants:
-            return product_variants
-        return None
+    @classmethod
+    def materialize_variant(cls, product_id: int, option1: Optional[int] = None, option2: Optional[int] = None,
+                            option3: Optional[int] = None):
+        """
+        Store a variant of a product with sparse variants, so it can be updated or ordered by `variant_id`.
+        """
 
-    @staticmethod
-    def retrieve_variant(variant_id: int):
+        with DatabaseManager.session as session:
+            try:
+                variant = cls.get_or_store_variant(session, product_id, (option1, option2, option3))
+                session.commit()
+                variant_id = variant.id
+            except Exception:
+                session.rollback()
+                raise
+        cls.invalidate_cache(product_id)
+        return cls.retrieve_variant(variant_id)
+
+    @classmethod
+    def get_or_store_variant(cls, session: Session, product_id: int, options: tuple) -> ProductVariant:
+        """
+        Get the stored variant for an options combination or create it from the default variant.
+        Doesn't commit, so it can be a part of another transaction (e.g. creating an order).
+        """
+
+        # lock the product, so concurrent requests don't store the same combination twice
+        product = session.get(Product, product_id, with_for_update=True)
+        if product is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+
+        # a combination has one item of each option of the product and `None` for the rest
+        items_id = cls._query_item_ids(session, product_id)
+        expected_items = items_id + [[None]] * (3 - len(items_id))
+        options = tuple(options) + (None,) * (3 - len(options))
+        if not items_id or any(option not in items for option, items in zip(options, expected_items)):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="Invalid options combination for this product")
+        option1, option2, option3 = options
+
+        variants = session.query(ProductVariant).filter(
+            ProductVariant.product_id == product_id,
+            ProductVariant.option1.is_(None) if option1 is None else ProductVariant.option1 == option1,
+            ProductVariant.option2.is_(None) if option2 is None else ProductVariant.option2 == option2,
+            ProductVariant.option3.is_(None) if option3 is None else ProductVariant.option3 == option3,
+        ).all()
+        if variants:
+            return variants[0]
+
+        default_variant = session.query(ProductVariant).filter(
+            ProductVariant.product_id == product_id,
+            ProductVariant.option1.is_(None),
+            ProductVariant.option2.is_(None),
+            ProductVariant.option3.is_(None),
+        ).first()
+        variant = ProductVariant(
+            product_id=product_id,
+            option1=option1,
+            option2=option2,
+            option3=option3,
+            price=default_variant.price if default_variant else 0,
+            stock=default_variant.stock if default_variant else 0
+        )
+        session.add(variant)
+        session.flush()
+        cls.refresh_cards([product_id], session)
+        cls.notify_changes(session, [product_id])
+        return variant
+
+    @classmethod
+    def retrieve_variant(cls, variant_id: int):
         variant = ProductVariant.get_or_404(variant_id)
-        variant_data = {
+        return cls._variant_to_dict(variant)
+
+    @staticmethod
+    def _variant_to_dict(variant: ProductVariant):
+        return {
             "variant_id": variant.id,
             "product_id": variant.product_id,
             "price": variant.price,
@@ -193,54 +352,286 @@ class ProductService:
             "created_at": DateTime.string(variant.created_at),
             "updated_at": DateTime.string(variant.updated_at)
         }
-        return variant_data
 
     @classmethod
     def get_item_ids_by_product_id(cls, product_id):
+        with DatabaseManager.session as session:
+            return cls._query_item_ids(session, product_id)
+
+    @staticmethod
+    def _query_item_ids(session: Session, product_id: int) -> List[List[int]]:
         item_ids_by_option = []
         item_ids_dict = {}
-        with DatabaseManager.session as session:
 
-            # Query the ProductOptionItem table to retrieve item_ids
-            items = (
-                session.query(ProductOptionItem.option_id, ProductOptionItem.id)
-                .join(ProductOption)
-                .filter(ProductOption.product_id == product_id)
-                .all()
-            )
+        # Query the ProductOptionItem table to retrieve item_ids,
+        # options are ordered as they were created, so they match `option1`, `option2` and `option3`
+        items = (
+            session.query(ProductOptionItem.option_id, ProductOptionItem.id)
+            .join(ProductOption)
+            .filter(ProductOption.product_id == product_id)
+            .order_by(ProductOption.id, ProductOptionItem.id)
+            .all()
+        )
 
-            # Separate item_ids by option_id
-            for option_id, item_id in items:
-                if option_id not in item_ids_dict:
-                    item_ids_dict[option_id] = []
-                item_ids_dict[option_id].append(item_id)
+        # Separate item_ids by option_id
+        for option_id, item_id in items:
+            if option_id not in item_ids_dict:
+                item_ids_dict[option_id] = []
+            item_ids_dict[option_id].append(item_id)
 
-            # Append `item_ids` lists to the result list
-            item_ids_by_option.extend(item_ids_dict.values())
+        # Append `item_ids` lists to the result list
+        item_ids_by_option.extend(item_ids_dict.values())
 
         return item_ids_by_option
 
     @classmethod
     def retrieve_product(cls, product_id):
-        cls.product = Product.get_or_404(product_id)
-        cls.options = cls.retrieve_options(product_id)
-        cls.variants = cls.retrieve_variants(product_id)
-        cls.media = cls.retrieve_media_list(product_id)
-
-        product = {
-            'product_id': cls.product.id,
-            'product_name': cls.product.product_name,
-            'description': cls.product.description,
-            'status': cls.product.status,
-            'created_at': DateTime.string(cls.product.created_at),
-            'updated_at': DateTime.string(cls.product.updated_at),
-            'published_at': DateTime.string(cls.product.published_at),
-            'options': cls.options,
-            'variants': cls.variants,
-            'media': cls.media
-        }
+        product = product_cache.get_or_set(f"product:{product_id}", lambda: cls._load_product(product_id))
+
+        # media is cached without the base url of the request
+        product = {**product, 'media': cls._with_base_url(product['media'])}
+        cls.options = product['options']
+        cls.variants = product['variants']
+        cls.media = product['media']
         return product
 
+    @classmethod
+    async def aretrieve_product(cls, product_id):
+        """
+        `retrieve_product` on the async engine, for async routes.
+        """
+
+        product = await product_cache.aget_or_set(f"product:{product_id}", lambda: cls._aload_product(product_id))
+        return {**product, 'media': cls._with_base_url(product['media'])}
+
+    @classmethod
+    async def _aload_product(cls, product_id):
+        products_query, options_query, variants_query, media_query = cls._get_products_queries([product_id])
+        async with DatabaseManager.get_async_session() as session:
+            products = (await session.scalars(products_query)).all()
+            option_rows = (await session.execute(options_query)).all()
+            variants = (await session.scalars(variants_query)).all()
+            media_list = (await session.scalars(media_query)).all()
+
+        products = cls._products_to_dicts([product_id], products, option_rows, variants, media_list,
+                                          with_base_url=False)
+        if not products:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+        return products[0]
+
+    @classmethod
+    def _load_product(cls, product_id):
+        product = Product.get_or_404(product_id)
+
+        return {
+            'product_id': product.id,
+            'product_name': product.product_name,
+            'description': product.description,
+            'status': product.status,
+            'created_at': DateTime.string(product.created_at),
+            'updated_at': DateTime.string(product.updated_at),
+            'published_at': DateTime.string(product.published_at),
+            'options': cls.retrieve_options(product_id),
+            'variants': cls._load_variants(product_id),
+            'media': cls._load_media_list(product_id)
+        }
+
+    @classmethod
+    def invalidate_cache(cls, *product_ids: int):
+        """
+        Remove cached payloads of products, must be called after any change of a product, its variants or media.
+
+        Other workers drop their in-process cache when they receive the NOTIFY of the change
+        (see `evict_local_cache`). That NOTIFY arrives before the Redis keys are deleted here, so a worker may put
+        the old payload from Redis back in between, the second NOTIFY sent after the delete evicts it again.
+        """
+
+        keys = cls._get_cache_keys(product_ids)
+        if not keys:
+            return
+        product_cache.invalidate(*keys)
+        with DatabaseManager.session as session:
+            try:
+                cls.notify_changes(session, product_ids)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+
+    @classmethod
+    def evict_local_cache(cls, payload: Optional[str]):
+        """
+        Remove products from the in-process cache of this worker, `payload` is a comma separated list of product
+        ids or `None` to remove all of them.
+        """
+
+        if payload is None:
+            product_cache.clear_local()
+        else:
+            product_cache.evict_local(*cls._get_cache_keys(payload.split(',')))
+
+    @staticmethod
+    def notify_changes(session: Session, product_ids):
+        """
+        Notify workers about changed products in the current transaction, for writes that don't use the
+        `FastModel` CRUD helpers.
+        """
+
+        product_ids = list(product_ids)
+        # NOTIFY payload is limited to 8000 bytes
+        for index in range(0, len(product_ids), 500):
+            DatabaseManager.notify(session, Product.notify_channel,
+                                   ','.join(str(product_id) for product_id in product_ids[index:index + 500]))
+
+    @staticmethod
+    def _get_cache_keys(product_ids) -> List[str]:
+        keys = []
+        for product_id in product_ids:
+            keys.extend([f"product:{product_id}", f"variants:{product_id}", f"media:{product_id}"])
+        return keys
+
+    @classmethod
+    def get_validator(cls, product_id: int, variants: bool = True, media: bool = True):
+        """
+        Return `(etag, last_modified)` of the payloads of a product with one aggregate query, without loading them,
+        or `None` if the product doesn't exist.
+
+        Besides the latest `updated_at`, the number and the sum of ids of variants and media are part of the etag,
+        so deleted rows (and rows updated within the same second) change it as well.
+        """
+
+        with DatabaseManager.session as session:
+            row = session.execute(cls._get_validator_query(product_id, variants, media)).first()
+        return cls._make_validator(product_id, variants, media, row)
+
+    @classmethod
+    async def aget_validator(cls, product_id: int, variants: bool = True, media: bool = True):
+        """
+        `get_validator` on the async engine, for async routes.
+        """
+
+        async with DatabaseManager.get_async_session() as session:
+            row = (await session.execute(cls._get_validator_query(product_id, variants, media))).first()
+        return cls._make_validator(product_id, variants, media, row)
+
+    @classmethod
+    def _get_validator_query(cls, product_id: int, variants: bool, media: bool):
+        columns = [func.coalesce(Product.updated_at, Product.created_at)]
+        if variants:
+            columns.extend(cls._get_rows_validator(ProductVariant, product_id))
+        if media:
+            columns.extend(cls._get_rows_validator(ProductMedia, product_id))
+        return select(*columns).where(Product.id == product_id)
+
+    @classmethod
+    def _make_validator(cls, product_id: int, variants: bool, media: bool, row):
+        if row is None:
+            return None
+
+        last_modified = max(value for value in row if isinstance(value, datetime))
+        # media urls are absolute, so the base url is a part of the representation
+        base_url = cls.__get_base_url() if media else None
+        digest = hashlib.sha1(repr((product_id, variants, media, base_url, tuple(row))).encode()).hexdigest()
+        return ConditionalService.make_etag(digest), last_modified
+
+    @staticmethod
+    def _get_rows_validator(model, product_id: int):
+        rows = select(model).where(model.product_id == product_id).subquery()
+        return [
+            select(func.count()).select_from(rows).scalar_subquery(),
+            select(func.coalesce(func.sum(rows.c.id), 0)).scalar_subquery(),
+            select(func.max(func.coalesce(rows.c.updated_at, rows.c.created_at))).scalar_subquery()
+        ]
+
+    @classmethod
+    def retrieve_products(cls, product_ids: List[int]):
+        """
+        Get a page of products with the same shape as `retrieve_product`.
+
+        Instead of hydrating each product separately, every relation is loaded with a single
+        `product_id IN (...)` query, so the number of queries doesn't depend on the page size.
+        The result keeps the order of `product_ids`, missing products are skipped.
+        """
+
+        if not product_ids:
+            return []
+
+        products_query, options_query, variants_query, media_query = cls._get_products_queries(product_ids)
+        with DatabaseManager.session as session:
+            products = session.scalars(products_query).all()
+            option_rows = session.execute(options_query).all()
+            variants = session.scalars(variants_query).all()
+            media_list = session.scalars(media_query).all()
+        return cls._products_to_dicts(product_ids, products, option_rows, variants, media_list)
+
+    @staticmethod
+    def _get_products_queries(product_ids: List[int]):
+        """
+        Queries of products, their options (with items), variants and media.
+        """
+
+        return (
+            select(Product).where(Product.id.in_(product_ids)),
+            select(ProductOption, ProductOptionItem)
+            .outerjoin(ProductOptionItem, ProductOptionItem.option_id == ProductOption.id)
+            .where(ProductOption.product_id.in_(product_ids))
+            .order_by(ProductOption.id, ProductOptionItem.id),
+            select(ProductVariant).where(ProductVariant.product_id.in_(product_ids)).order_by(ProductVariant.id),
+            select(ProductMedia).where(ProductMedia.product_id.in_(product_ids)).order_by(ProductMedia.id)
+        )
+
+    @classmethod
+    def _products_to_dicts(cls, product_ids: List[int], products, option_rows, variants, media_list,
+                           with_base_url: bool = True):
+        # group options (with their items), variants and media by product
+        options_by_product = {}
+        options_by_id = {}
+        for option, item in option_rows:
+            if option.id not in options_by_id:
+                options_by_id[option.id] = {
+                    'options_id': option.id,
+                    'option_name': option.option_name,
+                    'items': []
+                }
+                options_by_product.setdefault(option.product_id, []).append(options_by_id[option.id])
+            if item is not None:
+                options_by_id[option.id]['items'].append({'item_id': item.id, 'item_name': item.item_name})
+
+        products_by_id = {product.id: product for product in products}
+        variants_by_product = {}
+        for variant in variants:
+            variants_by_product.setdefault(variant.product_id, []).append(variant)
+        for product_id, product_variants in variants_by_product.items():
+            if products_by_id[product_id].sparse_variants:
+                items_id = [[item['item_id'] for item in option['items']]
+                            for option in options_by_product.get(product_id, [])]
+                variants_by_product[product_id] = cls._expand_sparse_variants(product_id, items_id, product_variants)
+            else:
+                variants_by_product[product_id] = [cls._variant_to_dict(variant) for variant in product_variants]
+
+        media_by_product = {}
+        for media in media_list:
+            media_by_product.setdefault(media.product_id, []).append(cls._media_to_dict(media, with_base_url))
+
+        products_list = []
+        for product_id in product_ids:
+            product = products_by_id.get(product_id)
+            if product is None:
+                continue
+            products_list.append({
+                'product_id': product.id,
+                'product_name': product.product_name,
+                'description': product.description,
+                'status': product.status,
+                'created_at': DateTime.string(product.created_at),
+                'updated_at': DateTime.string(product.updated_at),
+                'published_at': DateTime.string(product.published_at),
+                'options': options_by_product.get(product.id),
+                'variants': variants_by_product.get(product.id) or None,
+                'media': media_by_product.get(product.id)
+            })
+        return products_list
+
     @classmethod
     def update_product(cls, product_id, current_user, **kwargs):
         """Update product with seller permission check"""
@@ -255,9 +646,10 @@ class ProductService:
                     detail="You don't have permission to update this product"
                 )
 
-        # Обновляем данные
-        kwargs['updated_at'] = DateTime.now()
+        # Обновляем данные (`updated_at` is set by the database, it is a part of the conditional GET validator)
         Product.update(product_id, **kwargs)
+        cls.refresh_cards([product_id])
+        cls.invalidate_cache(product_id)
         return cls.retrieve_product(product_id)
 
     @classmethod
@@ -279,59 +671,490 @@ class ProductService:
         else:
             raise HTTPException(403, "Admin or seller rights required")
 
-        # Обновляем вариант
-        kwargs['updated_at'] = DateTime.now()
+        # Обновляем вариант (`updated_at` is set by the database)
         ProductVariant.update(variant_id, **kwargs)
+        cls.refresh_cards([product_id])
+        cls.invalidate_cache(product_id)
         return cls.retrieve_variant(variant_id)
 
+    # ---------------------
+    # --- Product Cards ---
+    # ---------------------
+
     @classmethod
-    def list_products(cls, limit: int = 12):
-        # - if "default variant" is not set, first variant will be
-        # - on list of products, for price, get it from "default variant"
-        # - if price or stock of default variant is 0 then select first variant that is not 0
-        # - or for price, get it from "less price"
-        # do all of them with graphql and let the front devs decide witch query should be run.
+    def refresh_cards(cls, product_ids, session: Optional[Session] = None):
+        """
+        Recompute the cards (`ProductCard`) of products from their current rows, must be called on any change of
+        a product, its variants or media.
 
-        # also can override the list `limit` in settings.py
-        if hasattr(settings, 'products_list_limit'):
-            limit = settings.products_list_limit
+        With a `session` the cards are written in its transaction (not committed), so they are changed atomically
+        with the write, otherwise a new transaction is committed.
+        """
 
-        products_list = []
+        product_ids = sorted(set(int(product_id) for product_id in product_ids))
+        if not product_ids:
+            return
+
+        if session is None:
+            with DatabaseManager.session as session:
+                try:
+                    cls.refresh_cards(product_ids, session)
+                    session.commit()
+                except Exception:
+                    session.rollback()
+                    raise
+            return
+
+        session.flush()
+        # concurrent refreshes of a card wait for each other, so the later one reads the committed rows of the
+        # earlier one (the upsert below reads a snapshot taken after the lock is acquired)
+        session.execute(select(ProductCard.product_id).where(ProductCard.product_id.in_(product_ids))
+                        .order_by(ProductCard.product_id).with_for_update())
+        session.execute(cls._upsert_cards(Product.id.in_(product_ids)))
+
+    @classmethod
+    def backfill_cards(cls):
+        """
+        Create missing cards, e.g. of products inserted by the data loading scripts.
+        """
 
         with DatabaseManager.session as session:
-            products = session.execute(
-                select(Product.id).limit(limit)
+            try:
+                session.execute(cls._upsert_cards(
+                    ~select(ProductCard.product_id).where(ProductCard.product_id == Product.id).exists()))
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+
+    @staticmethod
+    def _upsert_cards(condition):
+        """
+        Build `INSERT INTO product_cards SELECT ... ON CONFLICT DO UPDATE` for products matched by `condition`.
+        """
+
+        # a product with sparse variants lists every options combination (see `_expand_sparse_variants`): its
+        # default variant is not listed itself, it holds the price and stock of the combinations that are not stored
+        items_count = (
+            select(func.count(ProductOptionItem.id))
+            .where(ProductOptionItem.option_id == ProductOption.id)
+            .scalar_subquery()
+        )
+        # the product of the numbers of items of the options (`NULL` without options, only sparse ones are counted)
+        combinations = (
+            select(case((func.min(items_count) == 0, 0),
+                        else_=cast(func.round(func.exp(func.sum(func.ln(func.greatest(items_count, 1))))),
+                                   Integer)).label('count'))
+            .where(ProductOption.product_id == Product.id, Product.sparse_variants)
+            .lateral()
+        )
+        is_default = and_(ProductVariant.option1.is_(None), ProductVariant.option2.is_(None),
+                          ProductVariant.option3.is_(None))
+        is_listed = or_(~Product.sparse_variants, ~is_default)
+        not_stored_count = case(
+            (Product.sparse_variants,
+             func.coalesce(combinations.c.count, 0) - func.count(ProductVariant.id).filter(~is_default)),
+            else_=0)
+        default_price = case((not_stored_count > 0, func.max(ProductVariant.price).filter(is_default)))
+        prices = (
+            select(func.least(func.min(ProductVariant.price).filter(is_listed), default_price).label('min_price'),
+                   func.greatest(func.max(ProductVariant.price).filter(is_listed), default_price).label('max_price'),
+                   (func.coalesce(func.sum(ProductVariant.stock).filter(is_listed), 0)
+                    + func.coalesce(func.greatest(not_stored_count, 0)
+                                    * func.max(ProductVariant.stock).filter(is_default), 0)).label('total_stock'))
+            .where(ProductVariant.product_id == Product.id)
+            .lateral()
+        )
+        # the default (first) variant, unless its price or stock is zero, then the first variant that has both
+        listing_price = (
+            select(ProductVariant.price)
+            .where(ProductVariant.product_id == Product.id)
+            .order_by(and_(ProductVariant.price > 0, ProductVariant.stock > 0).desc(), ProductVariant.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        main_media = (
+            select(ProductMedia.src, ProductMedia.has_derivatives)
+            .where(ProductMedia.product_id == Product.id)
+            .order_by(ProductMedia.id)
+            .limit(1)
+            .lateral()
+        )
+
+        cards = (
+            select(
+                Product.id,
+                Product.product_name,
+                Product.status,
+                Product.created_at,
+                func.coalesce(listing_price, 0),
+                prices.c.min_price,
+                prices.c.max_price,
+                prices.c.total_stock,
+                main_media.c.src,
+                func.coalesce(main_media.c.has_derivatives, false()),
+                Product.external_image_url,
+                Product.external_ratings,
+                Product.external_ratings_count,
+                Product.main_category,
+                Product.sub_category,
+                # product name words rank higher than description words (weights are `"char"`, a bound
+                # varchar parameter doesn't match `setweight` with asyncpg)
+                func.setweight(func.to_tsvector(settings.products_search_config,
+                                                func.coalesce(Product.product_name, '')), literal_column("'A'"))
+                .op('||')(func.setweight(func.to_tsvector(settings.products_search_config,
+                                                          func.coalesce(Product.description, '')),
+                                         literal_column("'B'")))
             )
+            .select_from(Product)
+            .join(combinations, true())
+            .join(prices, true())
+            .outerjoin(main_media, true())
+            .where(condition)
+        )
 
-        for product in products:
-            products_list.append(cls.retrieve_product(product.id))
+        columns = ['product_id', 'product_name', 'status', 'created_at', 'price', 'min_price', 'max_price',
+                   'total_stock', 'main_media_src', 'main_media_has_derivatives', 'external_image_url', 'rating', 'ratings_count',
+                   'main_category', 'sub_category', 'search_vector']
+        statement = pg_insert(ProductCard).from_select(columns, cards)
+        return statement.on_conflict_do_update(
+            index_elements=[ProductCard.product_id],
+            set_={column: statement.excluded[column] for column in columns[1:]}
+        )
 
-        return products_list
-        # --- list by join ----
-        # products_list = []
-        # with DatabaseManager.session as session:
-        #     products = select(
-        #         Product.id,
-        #         Product.product_name,
-        #         coalesce(ProductMedia.alt, None).label('alt'),
-        #         coalesce(ProductMedia.src, None).label('src'),
-        #         # media.alt,
-        #         ProductVariant.price,
-        #         ProductVariant.stock
-        #     ).outerjoin(ProductMedia).outerjoin(ProductVariant)
-        #     products = session.execute(products)
-        #
-        # for product in products:
-        #     media = {'src': product.src, 'alt': product.alt} if product.src is not None else None
-        #     products_list.append(
-        #         {
-        #             'product_id': product.id,
-        #             'product_name': product.product_name,
-        #             'price': product.price,
-        #             'stock': product.stock,
-        #             'media': media
-        #         }
-        #     )
+    @classmethod
+    def _card_to_dict(cls, card: ProductCard):
+        if card.main_media_src is not None:
+            # listings show the `card` size of the main image, once it is made
+            sizes = (MediaService.get_derivative_names(card.main_media_src)
+                     if card.main_media_has_derivatives else None) or {}
+            file_name = sizes['card']['src'] if 'card' in sizes else card.main_media_src
+            image = cls.__get_base_url() + cls.__get_media_path(card.product_id, file_name)
+        else:
+            image = card.external_image_url
+
+        return {
+            'product_id': card.product_id,
+            'product_name': card.product_name,
+            'status': card.status,
+            'price': card.price,
+            'min_price': card.min_price,
+            'max_price': card.max_price,
+            'total_stock': card.total_stock,
+            'image': image,
+            'rating': card.rating,
+            'ratings_count': card.ratings_count,
+            'main_category': card.main_category,
+            'sub_category': card.sub_category,
+            'created_at': DateTime.string(card.created_at)
+        }
+
+    # sort keys allowed for the product list, each one is paired with `ProductCard.product_id` as a tie-breaker
+    # so the (sort_key, product_id) pair is unique and can be used as a keyset cursor.
+    # `relevance` (best match first) is only allowed with the `search` filter, and is its default sort.
+    list_sort_keys = ('id', 'created_at', 'price', 'relevance')
+
+    @classmethod
+    def list_products(cls, page: int = 1, limit: int = settings.products_list_limit, filters: dict = None,
+                      sort: Optional[str] = None, after: Optional[str] = None, include_total: bool = True):
+        """
+        Retrieve paginated and filtered list of product cards.
+
+        Every page is a single query over `product_cards`, which holds the listing data of each product (listing
+        price, price range, stock, main image, rating and category) and has an index for every sort key.
+
+        There are two pagination modes:
+        - page mode (default): `page` is translated to an offset, so deep pages get slower.
+        - cursor mode: when `after` is set, the list seeks past the `(sort_key, product_id)` pair stored in the
+          cursor, so every page costs the same no matter how deep it is.
+
+        Each response has a `next_cursor` that can be passed as `after` to get the next page. The total count
+        is optional (`include_total=False`), so infinite-scroll clients don't pay for a count on every page.
+        """
+
+        sort, cards_query, total_query = cls._get_list_queries(limit, filters, sort, page, after, include_total)
+        with DatabaseManager.session as session:
+            rows = session.execute(cards_query).all()
+            total = session.execute(total_query).scalar() if total_query is not None else None
+        return cls._get_list_page(rows, total, page, limit, sort, after)
+
+    @classmethod
+    async def alist_products(cls, page: int = 1, limit: int = settings.products_list_limit, filters: dict = None,
+                             sort: Optional[str] = None, after: Optional[str] = None, include_total: bool = True):
+        """
+        `list_products` on the async engine, for async routes.
+        """
+
+        sort, cards_query, total_query = cls._get_list_queries(limit, filters, sort, page, after, include_total)
+        async with DatabaseManager.get_async_session() as session:
+            rows = (await session.execute(cards_query)).all()
+            total = (await session.execute(total_query)).scalar() if total_query is not None else None
+        return cls._get_list_page(rows, total, page, limit, sort, after)
+
+    @classmethod
+    def _get_list_queries(cls, limit: int, filters: Optional[dict], sort: Optional[str], page: int,
+                          after: Optional[str], include_total: bool):
+        """
+        Return `(sort, cards_query, total_query)` of a page, `total_query` is `None` without `include_total`.
+        """
+
+        search = (filters or {}).get("search")
+        sort = sort or ('relevance' if search else 'id')
+        descending = sort.startswith('-')
+        sort_key = sort.lstrip('-')
+        if sort_key not in cls.list_sort_keys:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Invalid sort key, allowed keys are: {', '.join(cls.list_sort_keys)}")
+        if sort_key == 'relevance' and not search:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="Sorting by relevance requires the search filter")
+
+        sort_column = cls._get_sort_column(sort_key, search)
+        query = cls._build_product_query(filters)
+
+        cards_query = select(ProductCard, sort_column.label('sort_value'))
+        if query is not None:
+            cards_query = cards_query.where(query)
+
+        if after is not None:
+            cursor_value, cursor_id = cls._decode_cursor(after, sort)
+            if sort_key == 'relevance':
+                # ranks are `real`, the cursor value must be compared in the same precision
+                cursor_value = cast(cursor_value, REAL)
+            seek = tuple_(sort_column, ProductCard.product_id)
+            cards_query = cards_query.where(
+                seek < tuple_(cursor_value, cursor_id) if descending else seek > tuple_(cursor_value, cursor_id))
+        else:
+            cards_query = cards_query.offset((page - 1) * limit)
+
+        if descending:
+            cards_query = cards_query.order_by(sort_column.desc(), ProductCard.product_id.desc())
+        else:
+            cards_query = cards_query.order_by(sort_column, ProductCard.product_id)
+
+        # fetch one extra row to know if there is a next page without counting
+        cards_query = cards_query.limit(limit + 1)
+
+        total_query = None
+        if include_total:
+            total_query = select(func.count()).select_from(ProductCard)
+            if query is not None:
+                total_query = total_query.where(query)
+        return sort, cards_query, total_query
+
+    @classmethod
+    def _get_list_page(cls, rows, total: Optional[int], page: int, limit: int, sort: str, after: Optional[str]):
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = None
+        if has_next:
+            next_cursor = cls._encode_cursor(sort, rows[-1].sort_value, rows[-1].ProductCard.product_id)
+
+        return {
+            "items": [cls._card_to_dict(row.ProductCard) for row in rows],
+            "total": total,
+            "page": page if after is None else None,
+            "limit": limit,
+            "pages": (total + limit - 1) // limit if total is not None else None,  # Calculate total pages
+            "next_cursor": next_cursor
+        }
+
+    @classmethod
+    def _get_sort_column(cls, sort_key: str, search: Optional[str] = None):
+        if sort_key == 'id':
+            return ProductCard.product_id
+        if sort_key == 'relevance':
+            # negated, so the best match comes first in the ascending order
+            return -func.ts_rank(ProductCard.search_vector, cls._get_search_query(search))
+        return getattr(ProductCard, sort_key)
+
+    @staticmethod
+    def _get_search_query(search: str):
+        return func.websearch_to_tsquery(settings.products_search_config, search)
+
+    @staticmethod
+    def _encode_cursor(sort: str, value, product_id: int) -> str:
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        payload = json.dumps({'sort': sort, 'value': value, 'id': product_id})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    @classmethod
+    def _decode_cursor(cls, cursor: str, sort: str):
+        """
+        Return `(sort_value, product_id)` of a cursor of `sort`, a malformed one (it is client input) is a 400.
+        """
+
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if payload['sort'] != sort:
+                raise ValueError('cursor belongs to another sort')
+            value = payload['value']
+            sort_key = sort.lstrip('-')
+            if sort_key == 'created_at':
+                value = datetime.fromisoformat(value)
+            elif sort_key == 'price':
+                # encoded as a string, so it keeps its exact value
+                if not isinstance(value, str):
+                    raise TypeError('price must be a string')
+                value = Decimal(value)
+                if not value.is_finite():
+                    raise ValueError('price must be finite')
+            elif sort_key == 'relevance':
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                    raise TypeError('relevance must be a number')
+                value = float(value)
+            elif not cls._is_integer_id(value):
+                raise TypeError('id must be an integer')
+            if not cls._is_integer_id(payload['id']):
+                raise TypeError('id must be an integer')
+            return value, payload['id']
+        except (ValueError, KeyError, TypeError, InvalidOperation):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+
+    @staticmethod
+    def _is_integer_id(value) -> bool:
+        # a value out of the range of `integer` columns would fail in the query
+        return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 2 ** 31 - 1
+
+    @classmethod
+    def _build_product_query(cls, filters: dict):
+        """
+        Build SQLAlchemy query based on filters.
+        """
+        if not filters:
+            return None
+
+        conditions = []
+
+        # Status filter
+        if filters.get("status"):
+            status_values = filters["status"].split(",")
+            conditions.append(ProductCard.status.in_(status_values))
+
+        # Category filter
+        if filters.get("category"):
+            conditions.append(ProductCard.main_category == filters["category"])
+
+        # Price range filter, all variants of a product must be in the range. The price bounds of products are
+        # stored (and indexed) in their cards, so a bound is a range scan instead of aggregating all variants.
+        if filters.get("min_price") is not None:
+            conditions.append(ProductCard.min_price >= filters["min_price"])
+        if filters.get("max_price") is not None:
+            conditions.append(ProductCard.max_price <= filters["max_price"])
+
+        # Search filter, full-text match of words in the name or description (GIN index on `search_vector`),
+        # or a substring of the name (trigram GIN index)
+        if filters.get("search"):
+            # wildcards of the input match literally, a bare `%` or `_` would match every name
+            pattern = filters["search"].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append(
+                or_(
+                    ProductCard.search_vector.op('@@')(cls._get_search_query(filters["search"])),
+                    ProductCard.product_name.ilike(f"%{pattern}%", escape='\\')
+                )
+            )
+
+        return and_(*conditions) if conditions else None
+
+    # --------------
+    # --- Export ---
+    # --------------
+
+    export_formats = ('ndjson', 'csv')
+    export_columns = ('product_id', 'product_name', 'description', 'status', 'main_category', 'sub_category',
+                      'variant_id', 'option1', 'option2', 'option3', 'price', 'stock', 'image')
+
+    @classmethod
+    def export_products(cls, export_format: str, product_status: Optional[str] = None) -> Iterator[str]:
+        """
+        Stream the catalog as one row per stored variant (with its product, option item names and main image),
+        encoded as NDJSON lines or CSV.
+
+        Rows are read with a server-side cursor (`yield_per`) on a dedicated session, and each batch is encoded
+        and yielded before the next one is fetched, so memory use doesn't depend on the size of the catalog.
+        """
+
+        # the base url is taken before streaming, the request is gone when the generator runs
+        base_url = cls.__get_base_url()
+        query = cls._build_export_query(product_status)
+
+        session = DatabaseManager.get_session(read_only=True)
+        try:
+            result = session.execute(query.execution_options(yield_per=settings.products_export_batch_size))
+
+            if export_format == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(cls.export_columns)
+                for rows in result.partitions():
+                    writer.writerows(cls._export_row(row, base_url).values() for row in rows)
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            else:
+                for rows in result.partitions():
+                    yield ''.join(json.dumps(cls._export_row(row, base_url), ensure_ascii=False) + '\n'
+                                  for row in rows)
+        finally:
+            session.close()
+
+    @staticmethod
+    def _build_export_query(product_status: Optional[str] = None):
+        item1, item2, item3 = aliased(ProductOptionItem), aliased(ProductOptionItem), aliased(ProductOptionItem)
+        query = (
+            select(
+                Product.id.label('product_id'),
+                Product.product_name,
+                Product.description,
+                Product.status,
+                Product.main_category,
+                Product.sub_category,
+                ProductVariant.id.label('variant_id'),
+                item1.item_name.label('option1'),
+                item2.item_name.label('option2'),
+                item3.item_name.label('option3'),
+                ProductVariant.price,
+                ProductVariant.stock,
+                # the main media is taken from the card, so media rows aren't scanned for every variant
+                ProductCard.main_media_src,
+                ProductCard.external_image_url
+            )
+            .join(ProductVariant, ProductVariant.product_id == Product.id)
+            .outerjoin(item1, item1.id == ProductVariant.option1)
+            .outerjoin(item2, item2.id == ProductVariant.option2)
+            .outerjoin(item3, item3.id == ProductVariant.option3)
+            .outerjoin(ProductCard, ProductCard.product_id == Product.id)
+            .order_by(Product.id, ProductVariant.id)
+        )
+        if product_status:
+            query = query.where(Product.status.in_(product_status.split(",")))
+        return query
+
+    @classmethod
+    def _export_row(cls, row, base_url: str) -> dict:
+        if row.main_media_src is not None:
+            image = base_url + cls.__get_media_path(row.product_id, row.main_media_src)
+        else:
+            image = row.external_image_url
+
+        return {
+            'product_id': row.product_id,
+            'product_name': row.product_name,
+            'description': row.description,
+            'status': row.status,
+            'main_category': row.main_category,
+            'sub_category': row.sub_category,
+            'variant_id': row.variant_id,
+            'option1': row.option1,
+            'option2': row.option2,
+            'option3': row.option3,
+            'price': str(row.price) if row.price is not None else None,
+            'stock': row.stock,
+            'image': image
+        }
 
     @classmethod
     def create_media(cls, product_id, alt, files):
@@ -340,17 +1163,30 @@ class ProductService:
         """
 
         product: Product = Product.get_or_404(product_id)
-        media_service = MediaService(parent_directory="/products", sub_directory=product_id)
+        alt = alt if alt is not None else product.product_name
+        media_store = cls._get_media_store()
 
         for file in files:
-            file_name, file_extension = media_service.save_file(file)
-            ProductMedia.create(
-                product_id=product_id,
-                alt=alt if alt is not None else product.product_name,
-                src=file_name,
-                type=file_extension
-            )
-
+            # the file is linked and its media committed under the lock of its content (see `_release_media_files`)
+            with DatabaseManager.session as session:
+                is_new = False
+                try:
+                    src, file_extension, content_hash, is_new = media_store.store_file(
+                        file, lock=lambda content_hash: cls._lock_media_file(session, content_hash))
+                    session.add(ProductMedia(product_id=product_id, alt=alt, src=src, type=file_extension,
+                                             content_hash=content_hash))
+                    cls.notify_changes(session, [product_id])
+                    session.commit()
+                except Exception:
+                    # nothing else references a file written by this upload, it is deleted while still locked
+                    if is_new:
+                        media_store.delete_file(src)
+                    session.rollback()
+                    raise
+            cls._create_derivatives(media_store, src, content_hash, is_new)
+
+        cls.refresh_cards([product_id])
+        cls.invalidate_cache(product_id)
         media = cls.retrieve_media_list(product_id)
         return media
 
@@ -360,19 +1196,16 @@ class ProductService:
         Get all media of a product.
         """
 
+        media_list = product_cache.get_or_set(f"media:{product_id}", lambda: cls._load_media_list(product_id))
+        return cls._with_base_url(media_list)
+
+    @classmethod
+    def _load_media_list(cls, product_id):
         media_list = []
-        product_media: list[ProductMedia] = ProductMedia.filter(ProductMedia.product_id == product_id).all()
+        product_media: list[ProductMedia] = ProductMedia.filter(ProductMedia.product_id == product_id) \
+            .order_by(ProductMedia.id).all()
         for media in product_media:
-            media_list.append(
-                {
-                    "media_id": media.id,
-                    "product_id": media.product_id,
-                    "alt": media.alt,
-                    "src": cls.__get_media_url(media.product_id, media.src),
-                    "type": media.type,
-                    "created_at": DateTime.string(media.created_at),
-                    "updated_at": DateTime.string(media.updated_at)
-                })
+            media_list.append(cls._media_to_dict(media, with_base_url=False))
         if media_list:
             return media_list
         else:
@@ -386,42 +1219,233 @@ class ProductService:
 
         media_obj = ProductMedia.filter(ProductMedia.id == media_id).first()
         if media_obj:
-            media = {
-                "media_id": media_obj.id,
-                "product_id": media_obj.product_id,
-                "alt": media_obj.alt,
-                "src": cls.__get_media_url(media_obj.product_id, media_obj.src),
-                "type": media_obj.type,
-                "created_at": DateTime.string(media_obj.created_at),
-                "updated_at": DateTime.string(media_obj.updated_at)
-            }
-            return media
+            return cls._media_to_dict(media_obj)
         else:
             return None
 
     @classmethod
-    def __get_media_url(cls, product_id, file_name: str):
-        if cls.request is None:
-            base_url = "http://127.0.0.1:8000/"
-        else:
-            base_url = str(cls.request.base_url)
+    def _media_to_dict(cls, media: ProductMedia, with_base_url: bool = True):
+        src = cls.__get_media_path(media.product_id, media.src)
+        media_dict = {
+            "media_id": media.id,
+            "product_id": media.product_id,
+            "alt": media.alt,
+            "src": src,
+            "sizes": cls._get_media_sizes(media.product_id, media.src) if media.has_derivatives else None,
+            "type": media.type,
+            "created_at": DateTime.string(media.created_at),
+            "updated_at": DateTime.string(media.updated_at)
+        }
+        return cls._with_base_url([media_dict])[0] if with_base_url else media_dict
 
-        return f"{base_url}media/products/{product_id}/{file_name}" if file_name is not None else None
+    @classmethod
+    def _get_media_sizes(cls, product_id: int, file_name: Optional[str]):
+        """
+        Paths of the resized copies (`MediaService.create_derivatives`) of a media, by size and format.
+        """
+
+        sizes = MediaService.get_derivative_names(file_name) if file_name is not None else None
+        if sizes is None:
+            return None
+        return {size: {image_format: cls.__get_media_path(product_id, name) for image_format, name in names.items()}
+                for size, names in sizes.items()}
+
+    @classmethod
+    def _create_derivatives(cls, media_store: MediaService, src: str, content_hash: str, is_new: bool):
+        """
+        Make the derivatives of a stored file in the background, must be called after its media row is committed:
+        the media with its hash get `has_derivatives` when they are done.
+
+        A duplicate reuses the derivatives of the stored file, if they aren't done yet, the pending ones mark it.
+        """
+
+        if is_new:
+            future = media_store.create_derivatives(src)
+            if future is not None:
+                future.add_done_callback(lambda done: cls._derivatives_done(done, content_hash))
+        elif media_store.has_derivatives(src):
+            cls._mark_derivatives(ProductMedia.content_hash == content_hash)
+
+    @classmethod
+    def _derivatives_done(cls, future, content_hash: str):
+        # runs in a thread of the process pool, failures are logged by `MediaService`
+        if future.cancelled() or future.exception() is not None or not future.result():
+            return
+        try:
+            cls._mark_derivatives(ProductMedia.content_hash == content_hash)
+        except Exception as e:
+            logger.error(f"Marking the derivatives of {content_hash} failed: {e}")
+
+    @classmethod
+    def _mark_derivatives(cls, condition):
+        """
+        Set `has_derivatives` of the media matched by `condition`, and refresh their products.
+        """
+
+        with DatabaseManager.session as session:
+            try:
+                product_ids = set(session.scalars(
+                    update(ProductMedia)
+                    .where(condition, ProductMedia.has_derivatives.is_(False))
+                    .values(has_derivatives=True)
+                    .returning(ProductMedia.product_id)))
+                cls.refresh_cards(product_ids, session)
+                cls.notify_changes(session, product_ids)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+        cls.invalidate_cache(*product_ids)
+
+    @classmethod
+    def backfill_media_derivatives(cls) -> int:
+        """
+        Make the missing derivatives of existing media (e.g. uploaded before they were introduced, or whose
+        background job was lost with its worker) and mark them, returns the number of marked media.
+        """
+
+        with DatabaseManager.session as session:
+            rows = session.execute(
+                select(ProductMedia.id, ProductMedia.product_id, ProductMedia.src, ProductMedia.content_hash)
+                .where(ProductMedia.has_derivatives.is_(False))).all()
+
+        # a content-addressed file is shared by the media with its hash, older uploads have a file of their own
+        files = {}
+        for row in rows:
+            key = (None, row.src) if row.content_hash is not None else (row.product_id, row.src)
+            files.setdefault(key, []).append(row.id)
+
+        pending = []
+        media_ids = []
+        for (product_id, src), ids in files.items():
+            media_store = cls._get_media_store() if product_id is None else \
+                MediaService(parent_directory="/products", sub_directory=product_id)
+            if media_store.has_derivatives(src):
+                media_ids.extend(ids)
+            elif os.path.exists(os.path.join(media_store.path, src)):
+                future = media_store.create_derivatives(src)
+                if future is not None:
+                    pending.append((future, ids))
+
+        for future, ids in pending:
+            if future.exception() is None and future.result():
+                media_ids.extend(ids)
+
+        for index in range(0, len(media_ids), 1000):
+            cls._mark_derivatives(ProductMedia.id.in_(media_ids[index:index + 1000]))
+        return len(media_ids)
+
+    @classmethod
+    def __get_base_url(cls):
+        request = _current_request.get()
+        if request is None:
+            return "http://127.0.0.1:8000/"
+        return str(request.base_url)
+
+    @staticmethod
+    def __get_media_path(product_id, file_name: str):
+        if file_name is None:
+            return None
+        # content-addressed files (`ab/cd/<sha256>.<ext>`) are shared by all products, older uploads have a
+        # directory per product
+        if '/' in file_name:
+            return f"media/products/{ProductService.media_store_directory}/{file_name}"
+        return f"media/products/{product_id}/{file_name}"
+
+    @classmethod
+    def _get_media_store(cls) -> MediaService:
+        return MediaService(parent_directory="/products", sub_directory=cls.media_store_directory)
+
+    @classmethod
+    def _release_media_files(cls, media_files):
+        """
+        Delete files of deleted (or replaced) media, `media_files` are `(product_id, src, content_hash)` tuples.
+
+        A content-addressed file is shared, it is deleted with its last reference, i.e. when no `ProductMedia`
+        row has its hash anymore.
+        """
+
+        for product_id, src, content_hash in media_files:
+            if content_hash is None:
+                MediaService(parent_directory="/products", sub_directory=product_id).delete_file(src)
+                continue
+
+            # an upload of the same content links the file and commits its media under the same lock, so it either
+            # is counted here, or links the name again after the file is deleted
+            with DatabaseManager.session as session:
+                try:
+                    cls._lock_media_file(session, content_hash)
+                    references = session.scalar(
+                        select(func.count()).select_from(ProductMedia)
+                        .where(ProductMedia.content_hash == content_hash))
+                    if not references:
+                        cls._get_media_store().delete_file(src)
+                    session.commit()
+                except Exception:
+                    session.rollback()
+                    raise
+
+    @staticmethod
+    def _lock_media_file(session: Session, content_hash: str):
+        """
+        Lock a content-addressed file until the end of the transaction of `session`.
+        """
+
+        session.execute(select(func.pg_advisory_xact_lock(func.hashtext(content_hash))))
+
+    @classmethod
+    def _with_base_url(cls, media_list: Optional[List[dict]]):
+        """
+        Copy a media list (loaded with `with_base_url=False`) with absolute urls.
+        """
+
+        if media_list is None:
+            return None
+        base_url = cls.__get_base_url()
+        return [{
+            **media,
+            'src': base_url + media['src'] if media['src'] is not None else None,
+            'sizes': {size: {image_format: base_url + path for image_format, path in paths.items()}
+                      for size, paths in media['sizes'].items()} if media.get('sizes') else None
+        } for media in media_list]
 
     @classmethod
     def update_media(cls, media_id, **kwargs):
         # check media exist
         media: ProductMedia = ProductMedia.get_or_404(media_id)
+        replaced_file = (media.product_id, media.src, media.content_hash)
         file = kwargs.pop('file', None)
+        media_store = cls._get_media_store()
+        with DatabaseManager.session as session:
+            is_new = False
+            try:
+                if file is not None:
+                    # linked and committed under the lock of its content, as in `create_media`
+                    src, file_extension, content_hash, is_new = media_store.store_file(
+                        file, lock=lambda content_hash: cls._lock_media_file(session, content_hash))
+                    kwargs['src'] = src
+                    kwargs['type'] = file_extension
+                    kwargs['content_hash'] = content_hash
+                    kwargs['has_derivatives'] = False
+                media = session.get(ProductMedia, media_id)
+                if media is None:
+                    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="ProductMedia not found")
+                for key, value in kwargs.items():
+                    setattr(media, key, value)
+                cls.notify_changes(session, [replaced_file[0]])
+                session.commit()
+            except Exception:
+                # e.g. the media was deleted meanwhile, the new file is released as in `create_media`
+                if is_new:
+                    media_store.delete_file(kwargs['src'])
+                session.rollback()
+                raise
         if file is not None:
-            media_service = MediaService(parent_directory="/products", sub_directory=media.product_id)
-            file_name, file_extension = media_service.save_file(file)
-            kwargs['src'] = file_name
-            kwargs['type'] = file_extension
-
-        # TODO `updated_at` is autoupdate dont need to code
-        kwargs['updated_at'] = DateTime.now()
-        ProductMedia.update(media_id, **kwargs)
+            cls._create_derivatives(media_store, kwargs['src'], kwargs['content_hash'], is_new)
+        if file is not None and replaced_file[1] != kwargs['src']:
+            cls._release_media_files([replaced_file])
+        cls.refresh_cards([replaced_file[0]])
+        cls.invalidate_cache(replaced_file[0])
 
         return cls.retrieve_single_media(media_id)
 
@@ -435,10 +1459,14 @@ class ProductService:
                 for media_id in media_ids
             ]
             media_to_delete = session.query(ProductMedia).filter(or_(*filters)).all()
+            media_files = [(media.product_id, media.src, media.content_hash) for media in media_to_delete]
 
             # Delete the product media records
             for media in media_to_delete:
                 ProductMedia.delete(ProductMedia.get_or_404(media.id))
+        ProductService._release_media_files(media_files)
+        ProductService.refresh_cards([product_id])
+        ProductService.invalidate_cache(product_id)
         return None
 
     @classmethod
@@ -475,202 +1503,35 @@ class ProductService:
             )
 
         # Удаляем сам продукт (если проверки прав пройдены)
+        with DatabaseManager.session as session:
+            media_files = session.execute(
+                select(ProductMedia.product_id, ProductMedia.src, ProductMedia.content_hash)
+                .where(ProductMedia.product_id == product_id)).all()
         Product.delete(product)
+        cls._release_media_files(media_files)
+        cls.invalidate_cache(product_id)
 
     @classmethod
     def delete_media_file(cls, media_id: int):
         media = ProductMedia.get_or_404(media_id)
         product_id = media.product_id
 
-        media_service = MediaService(parent_directory="/products", sub_directory=product_id)
-        is_fie_deleted = media_service.delete_file(media.src)
-        if is_fie_deleted:
+        if media.content_hash is None:
+            # a file of its own, the media is kept if the file can't be deleted
+            media_service = MediaService(parent_directory="/products", sub_directory=product_id)
+            if not media_service.delete_file(media.src):
+                return False
             ProductMedia.delete(ProductMedia.get_or_404(media_id))
-            return True
-        return False
-
-
-# Добавляем в apps/products/services.py
-
-from sqlalchemy import or_, and_, func
-from fastapi import HTTPException, status
-
-@classmethod
-def list_products(cls, page: int = 1, limit: int = 12, filters: dict = None):
-    """
-    Retrieve paginated and filtered list of products.
-    """
-    offset = (page - 1) * limit
-    query = cls._build_product_query(filters)
-    
-    with DatabaseManager.session as session:
-        # Get total count for pagination
-        total = session.query(func.count(Product.id)).select_from(Product)
-        if query is not None:
-            total = total.filter(query)
-        total = total.scalar()
-        
-        # Get paginated results
-        products_query = session.query(Product)
-        if query is not None:
-            products_query = products_query.filter(query)
-            
-        products = products_query.offset(offset).limit(limit).all()
-        
-        products_list = []
-        for product in products:
-            products_list.append(cls.retrieve_product(product.id))
-        
-        return {
-            "items": products_list,
-            "total": total,
-            "page": page,
-            "limit": limit,
-            "pages": (total + limit - 1) // limit  # Calculate total pages
-        }
+        else:
+            media_file = (product_id, media.src, media.content_hash)
+            ProductMedia.delete(ProductMedia.get_or_404(media_id))
+            cls._release_media_files([media_file])
 
-@classmethod
-def _build_product_query(cls, filters: dict):
-    """
-    Build SQLAlchemy query based on filters.
-    """
-    if not filters:
-        return None
-        
-    conditions = []
-    
-    # Status filter
-    if filters.get("status"):
-        status_values = filters["status"].split(",")
-        conditions.append(Product.status.in_(status_values))
-    
-    # Price range filter
-    if filters.get("min_price") is not None or filters.get("max_price") is not None:
-        # Join with variants to filter by price
-        from apps.products.models import ProductVariant
-        subquery = (
-            DatabaseManager.session.query(ProductVariant.product_id)
-            .group_by(ProductVariant.product_id)
-            .having(func.min(ProductVariant.price) >= (filters.get("min_price") or 0))
-            .having(func.max(ProductVariant.price) <= (filters.get("max_price") or float('inf')))
-            .subquery()
-        )
-        conditions.append(Product.id.in_(subquery))
-    
-    # Search filter
-    if filters.get("search"):
-        search = f"%{filters['search']}%"
-        conditions.append(
-            or_(
-                Product.product_name.ilike(search),
-                Product.description.ilike(search)
-            )
-        )
-    
-    return and_(*conditions) if conditions else None
-
-@classmethod
-def get_products_paginated(cls, request: Request, page: int, per_page: int, filters: dict):
-    """
-    Get paginated list of products with optional filters
-    
-    Args:
-        page: Page number (1-based)
-        per_page: Items per page
-        filters: Dictionary of filter parameters
-        
-    Returns:
-        Dictionary with paginated products and metadata
-    """
-    query = select(Product).where(Product.status == 'active')
-    
-    # Apply filters
-    if filters.get('status'):
-        query = query.where(Product.status == filters['status'])
-        
-    if filters.get('min_price') is not None:
-        query = query.join(ProductVariant).where(ProductVariant.price >= filters['min_price'])
-        
-    if filters.get('max_price') is not None:
-        query = query.join(ProductVariant).where(ProductVariant.price <= filters['max_price'])
-        
-    if filters.get('seller_id'):
-        query = query.where(Product.seller_id == filters['seller_id'])
-        
-    if filters.get('search'):
-        search = f"%{filters['search']}%"
-        query = query.where(Product.product_name.ilike(search))
-    
-    # Count total items
-    total_query = select(func.count()).select_from(query)
-    
-    # Apply pagination
-    query = query.offset((page - 1) * per_page).limit(per_page)
-    
-    with DatabaseManager.session as session:
-        total = session.execute(total_query).scalar()
-        products = session.execute(query).scalars().all()
-        
-        # Convert products to dict format
-        product_list = [cls._product_to_dict(p) for p in products]
-        
-        return {
-            "items": product_list,
-            "total": total,
-            "page": page,
-            "per_page": per_page,
-            "total_pages": (total + per_page - 1) // per_page
-        }
+        cls.refresh_cards([product_id])
+        cls.invalidate_cache(product_id)
+        return True
 
-@classmethod
-def _product_to_dict(cls, product: Product):
-    """
-    Convert Product object to dictionary with essential fields
-    """
-    variants = ProductVariant.filter(ProductVariant.product_id == product.id).all()
-    main_variant = variants[0] if variants else None
-    
-    return {
-        "id": product.id,
-        "product_name": product.product_name,
-        "description": product.description,
-        "status": product.status,
-        "price": main_variant.price if main_variant else 0,
-        "image_url": cls._get_main_image_url(product.id, request),
-        "seller_id": product.seller_id,
-        "created_at": DateTime.string(product.created_at)
-    }
-
-@classmethod
-def _get_main_image_url(cls, product_id: int, request: Request):
-    """
-    Get URL of the main product image
-    """
-    media = ProductMedia.filter(
-        ProductMedia.product_id == product_id
-    ).order_by(ProductMedia.id).first()
-    
-    if media:
-        return str(request.base_url) + f"media/products/{product_id}/{media.src}"
-    return None
-
-from apps.accounts.models import Seller
-
-@classmethod
-def update_product(cls, product_id, current_user, **kwargs):
-    """Update product with seller permission check"""
-    product = Product.get_or_404(product_id)
-    
-    # Проверяем, является ли пользователь продавцом и владельцем товара
-    if current_user.role != 'admin':
-        seller = Seller.filter(Seller.user_id == current_user.id).first()
-        if not seller or product_id not in seller.product_ids:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You don't have permission to update this product"
-            )
 
-    # Обновляем данные
-    kwargs['updated_at'] = DateTime.now()
-    Product.update(product_id, **kwargs)
-    return cls.retrieve_product(product_id)
\ No newline at end of file
+# drop cached products of this worker when another worker changes them
+invalidation_bus.subscribe(Product.notify_channel, ProductService.evict_local_cache)
+
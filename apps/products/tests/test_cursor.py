@@ -0,0 +1,90 @@
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+
+from apps.products.services import ProductService
+
+
+def encode(payload) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+@pytest.mark.parametrize('sort, value', [
+    ('id', 42),
+    ('-id', 42),
+    ('created_at', datetime(2024, 5, 1, 12, 30, 15, 123456)),
+    ('-created_at', datetime(2024, 5, 1, 12, 30, 15)),
+    ('price', Decimal('1099.50')),
+    ('-price', Decimal('0.00')),
+    ('relevance', 0.0607927),
+])
+def test_cursor_round_trip(sort, value):
+    cursor = ProductService._encode_cursor(sort, value, 7)
+
+    assert ProductService._decode_cursor(cursor, sort) == (value, 7)
+
+
+@pytest.mark.parametrize('cursor', [
+    '',
+    'not base64 !',
+    base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+    base64.urlsafe_b64encode(b'{"sort": "id", "value": 1').decode(),
+    encode([1, 2]),
+    encode('id'),
+    encode({'value': 1, 'id': 1}),
+    encode({'sort': 'id', 'id': 1}),
+    encode({'sort': 'id', 'value': 1}),
+])
+def test_malformed_cursor(cursor):
+    with pytest.raises(HTTPException) as error:
+        ProductService._decode_cursor(cursor, 'id')
+    assert error.value.status_code == 400
+
+
+def test_truncated_cursor():
+    cursor = ProductService._encode_cursor('price', Decimal('10.00'), 7)
+
+    with pytest.raises(HTTPException) as error:
+        ProductService._decode_cursor(cursor[:len(cursor) // 2], 'price')
+    assert error.value.status_code == 400
+
+
+def test_cursor_of_another_sort():
+    cursor = ProductService._encode_cursor('id', 42, 7)
+
+    with pytest.raises(HTTPException) as error:
+        ProductService._decode_cursor(cursor, '-id')
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize('sort, value, product_id', [
+    ('id', '42', 7),
+    ('id', 4.2, 7),
+    ('id', True, 7),
+    ('id', None, 7),
+    ('id', -1, 7),
+    ('id', 2 ** 31, 7),
+    ('id', 42, '7'),
+    ('id', 42, 7.5),
+    ('id', 42, 2 ** 63),
+    ('price', 'abc', 7),
+    ('price', 'NaN', 7),
+    ('price', 'Infinity', 7),
+    ('price', 10.5, 7),
+    ('price', None, 7),
+    ('created_at', 'yesterday', 7),
+    ('created_at', 1714566615, 7),
+    ('relevance', '0.5', 7),
+    ('relevance', True, 7),
+    ('relevance', None, 7),
+])
+def test_tampered_cursor_value(sort, value, product_id):
+    cursor = encode({'sort': sort, 'value': value, 'id': product_id})
+
+    with pytest.raises(HTTPException) as error:
+        ProductService._decode_cursor(cursor, sort)
+    assert error.value.status_code == 400
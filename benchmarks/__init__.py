@@ -0,0 +1,11 @@
+"""
+API benchmark suite.
+
+Seeds a database of its own (`<DB_NAME>_benchmark`) to a scale factor, drives the hot endpoints at a fixed
+concurrency and compares latency percentiles, throughput and queries per request with a stored baseline:
+
+    $ python -m benchmarks --scale 1 --concurrency 16
+    $ python -m benchmarks --save-baseline      # after an intended change of the numbers
+
+The exit status is 1 when a scenario regressed beyond the tolerances, so it can gate CI.
+"""
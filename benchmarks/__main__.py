@@ -0,0 +1,139 @@
+"""
+Command line of the benchmarks, see `python -m benchmarks --help`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import platform
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Benchmark the hot endpoints of the API.')
+    parser.add_argument('--scale', type=float, default=1,
+                        help='scale factor of the data set, 1 is 1000 products and 100 customers (default 1)')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent requests (default 16)')
+    parser.add_argument('--requests', type=int, default=500, help='measured requests per scenario (default 500)')
+    parser.add_argument('--warmup', type=int, default=50, help='unmeasured requests per scenario (default 50)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the data set and of the requests (default 0)')
+    parser.add_argument('--scenario', action='append', dest='scenarios', metavar='NAME',
+                        help="run only this scenario (e.g. 'GET /products'), can be repeated")
+    parser.add_argument('--no-seed', action='store_true', help='reuse the data of the previous run')
+    parser.add_argument('--url', help='benchmark a running server (using the same database) instead of the app '
+                                      'in this process, `GET /search` then uses its search backend')
+    parser.add_argument('--baseline', type=Path, default=BENCHMARKS_DIR / 'baseline.json',
+                        help='baseline to compare with (default benchmarks/baseline.json)')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--output', type=Path, default=BENCHMARKS_DIR / 'results' / 'latest.json',
+                        help='report of this run (default benchmarks/results/latest.json)')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed p95 latency and throughput regression ratio (default 0.2)')
+    parser.add_argument('--query-tolerance', type=float, default=0.5,
+                        help='allowed increase of queries per request (default 0.5)')
+    return parser.parse_args()
+
+
+def configure_environment(in_process: bool):
+    """
+    Point the app to the benchmark database, it's recreated by every seeding. Must run before `config` is
+    imported.
+    """
+    database = os.getenv('DB_NAME', 'online_store')
+    if not database.endswith('_benchmark'):
+        os.environ['DB_NAME'] = f"{database}_benchmark"
+    if in_process:
+        # queries per request come from `Server-Timing`, and profiled requests would skew the numbers
+        os.environ['SQL_INSTRUMENTATION'] = 'true'
+        os.environ['PROFILING_SAMPLE_RATE'] = '0'
+
+
+async def run(args) -> dict:
+    import httpx
+
+    from benchmarks import seed
+    from benchmarks.runner import BenchmarkRunner, StubSearchBackend
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+        search_backend = None
+    else:
+        import apps.search.services
+        from apps.main import app
+
+        # the lifespan isn't run: the invalidation bus and the replica monitor aren't needed by one worker
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://benchmark', timeout=60)
+        search_backend = StubSearchBackend(BenchmarkRunner.get_search_documents())
+        apps.search.services.es = search_backend
+
+    async with client:
+        runner = BenchmarkRunner(client, args.concurrency, args.requests, args.warmup, args.seed)
+        await runner.prepare(seed.get_customer_emails(), seed.PASSWORD)
+
+        scenarios = [scenario for scenario in runner.get_scenarios()
+                     if not args.scenarios or scenario.name in args.scenarios]
+        results = {}
+        for scenario in scenarios:
+            print(f"running {scenario.name} ...", file=sys.stderr)
+            result = await runner.run(scenario)
+            results[scenario.name] = result.summary()
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "parameters": {"scale": args.scale, "concurrency": args.concurrency, "requests": args.requests,
+                       "warmup": args.warmup, "seed": args.seed, "in_process": not args.url},
+        "scenarios": results,
+    }
+
+
+def main() -> int:
+    args = parse_args()
+    configure_environment(in_process=not args.url)
+
+    from benchmarks import report as reports
+    from benchmarks import seed
+
+    seed.create_database()
+    from config.database import DatabaseManager
+    DatabaseManager()
+    if not args.no_seed:
+        print(f"seeding scale {args.scale} ...", file=sys.stderr)
+        seed.seed(args.scale, args.seed)
+
+    # the app prints debug lines for every login and order, and the N+1 warnings of every order would bury the
+    # report (the queries per request show them)
+    logging.getLogger('apps.core.middleware').setLevel(logging.ERROR)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        report = asyncio.run(run(args))
+
+    print(reports.format_table(report))
+    reports.save(report, args.output)
+    if args.save_baseline:
+        reports.save(report, args.baseline)
+        print(f"\nbaseline saved to {args.baseline}")
+        return 0
+
+    baseline = reports.load(args.baseline)
+    if baseline is None:
+        print(f"\nno baseline at {args.baseline}, run with --save-baseline to store one")
+        return 0
+    regressions = reports.compare(report, baseline, args.tolerance, args.query_tolerance)
+    if regressions:
+        print('\nregressions against the baseline:')
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print('\nno regressions against the baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Reports of the benchmarks and their comparison with the baseline.
+"""
+
+import json
+from pathlib import Path
+from typing import Optional
+
+COLUMNS = (('requests', 'requests'), ('errors', 'errors'), ('p50_ms', 'p50 ms'), ('p95_ms', 'p95 ms'),
+           ('p99_ms', 'p99 ms'), ('throughput_rps', 'req/s'), ('queries_per_request', 'queries/req'))
+# the run parameters a baseline is only comparable with
+COMPARABLE = ('scale', 'concurrency', 'requests', 'seed', 'in_process')
+
+
+def format_table(report: dict) -> str:
+    rows = [['scenario'] + [title for _, title in COLUMNS]]
+    for name, summary in report['scenarios'].items():
+        rows.append([name] + ['-' if summary[key] is None else str(summary[key]) for key, _ in COLUMNS])
+    widths = [max(len(row[index]) for row in rows) for index in range(len(rows[0]))]
+    lines = ['  '.join(cell.ljust(width) if index == 0 else cell.rjust(width)
+                       for index, (cell, width) in enumerate(zip(row, widths))) for row in rows]
+    lines.insert(1, '-' * len(lines[0]))
+    return '\n'.join(lines)
+
+
+def load(path: Path) -> Optional[dict]:
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding='utf-8'))
+
+
+def save(report: dict, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2) + '\n', encoding='utf-8')
+
+
+def compare(report: dict, baseline: dict, tolerance: float, query_tolerance: float) -> list[str]:
+    """
+    Regressions of `report` against `baseline`, an empty list if there are none.
+
+    p95 latency and throughput may be worse by `tolerance` (a ratio, they are noisy), the queries per request by
+    `query_tolerance` queries (they only change with the code), and the error rate must not grow. p99 is reported
+    but not checked, a handful of slow requests decides it.
+    """
+    mismatched = [key for key in COMPARABLE if report['parameters'].get(key) != baseline['parameters'].get(key)]
+    if mismatched:
+        return [f"the baseline was run with other parameters ({', '.join(mismatched)}), "
+                f"run with the same ones or save a new baseline"]
+
+    regressions = []
+    for name, current in report['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']} ms, baseline {previous['p95_ms']} ms")
+        if current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {current['throughput_rps']} req/s, "
+                               f"baseline {previous['throughput_rps']} req/s")
+        if current['queries_per_request'] is not None and previous['queries_per_request'] is not None \
+                and current['queries_per_request'] > previous['queries_per_request'] + query_tolerance:
+            regressions.append(f"{name}: {current['queries_per_request']} queries per request, "
+                               f"baseline {previous['queries_per_request']}")
+        if current['error_rate'] > previous['error_rate']:
+            regressions.append(f"{name}: error rate {current['error_rate']}, baseline {previous['error_rate']}")
+    return regressions
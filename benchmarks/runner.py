@@ -0,0 +1,192 @@
+"""
+Load generator of the benchmarks: every scenario sends its requests from a fixed number of concurrent workers,
+after a warmup, and records the latency, status and query count of each request.
+"""
+
+import asyncio
+import itertools
+import random
+import re
+import statistics
+import time
+from typing import Callable, Optional
+
+import httpx
+from sqlalchemy import select
+
+from apps.products.models import Product, ProductVariant
+from config.database import DatabaseManager
+
+# `desc="N queries"` of the `db` metric of `Server-Timing` (see `SQLInstrumentationMiddleware`)
+QUERIES_PATTERN = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+SEARCH_TERMS = ('backpack', 'camera', 'watch', 'smart lamp', 'soft jacket', 'premium')
+
+
+class Scenario:
+    """
+    An endpoint under load, `build` returns the arguments of `httpx.AsyncClient.request` of the next request.
+    `weight` scales the number of requests of the run (the login hashes a password, it's much slower).
+    """
+
+    def __init__(self, name: str, build: Callable[[random.Random], dict], weight: float = 1.0):
+        self.name = name
+        self.build = build
+        self.weight = weight
+
+
+class ScenarioResult:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: list[float] = []
+        self.queries: list[int] = []
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def summary(self) -> dict:
+        requests = len(self.latencies)
+        percentiles = statistics.quantiles(self.latencies, n=100, method='inclusive') if requests > 1 \
+            else self.latencies * 99
+        return {
+            "requests": requests,
+            "errors": self.errors,
+            "error_rate": round(self.errors / requests, 4) if requests else 0.0,
+            "p50_ms": round(percentiles[49] * 1000, 2),
+            "p95_ms": round(percentiles[94] * 1000, 2),
+            "p99_ms": round(percentiles[98] * 1000, 2),
+            "throughput_rps": round(requests / self.elapsed, 2) if self.elapsed else 0.0,
+            # `None` when the server doesn't report its queries (`SQL_INSTRUMENTATION` off)
+            "queries_per_request": round(statistics.fmean(self.queries), 2) if self.queries else None,
+        }
+
+
+class StubSearchBackend:
+    """
+    Stand-in for Elasticsearch in `apps.search.services`: answers `search` with documents of the seeded products,
+    so `GET /search` measures the app and not the search cluster.
+    """
+
+    def __init__(self, documents: list[dict]):
+        self.documents = documents
+
+    async def search(self, index: str, body: dict, **kwargs) -> dict:
+        words = body["query"]["bool"]["must"][0]["multi_match"]["query"].lower().split()
+        size = body.get("size", 10)
+        hits = [document for document in self.documents if any(word in document["name"].lower() for word in words)]
+        return {"hits": {"hits": [{"_id": str(document["id"]), "_score": 1.0, "_source": document}
+                                  for document in hits[:size]]}}
+
+
+class BenchmarkRunner:
+    def __init__(self, client: httpx.AsyncClient, concurrency: int, requests: int, warmup: int,
+                 random_seed: int = 0):
+        self.client = client
+        self.concurrency = concurrency
+        self.requests = requests
+        self.warmup = warmup
+        self.random_seed = random_seed
+
+        self.product_ids: list[int] = []
+        self.variant_ids: list[int] = []
+        self.tokens: list[str] = []
+        self.login_emails: list[str] = []
+        self.password: Optional[str] = None
+
+    async def prepare(self, customer_emails: list[str], password: str):
+        """
+        Load the ids of the seeded rows and log in the customers that place orders, the others are used by the
+        login scenario (a login replaces the token of the customer).
+        """
+        with DatabaseManager.session as session:
+            self.product_ids = list(session.scalars(select(Product.id).order_by(Product.id)))
+            self.variant_ids = list(session.scalars(select(ProductVariant.id).order_by(ProductVariant.id)))
+
+        ordering = customer_emails[:max(len(customer_emails) // 2, 1)]
+        self.login_emails = customer_emails[len(ordering):] or ordering
+        self.password = password
+        for email in ordering[:self.concurrency]:
+            response = await self.client.post('/accounts/login', data={'username': email, 'password': password})
+            response.raise_for_status()
+            self.tokens.append(response.json()['access_token'])
+
+    @staticmethod
+    def get_search_documents(limit: int = 1000) -> list[dict]:
+        """
+        Documents of the seeded products in the shape of the `products` index (see `sync_products_to_elasticsearch`).
+        """
+        with DatabaseManager.session as session:
+            products = session.scalars(select(Product).order_by(Product.id).limit(limit)).all()
+            return [{"id": product.id, "name": product.product_name, "description": product.description or "",
+                     "status": product.status, "category": product.main_category or "general", "rating": 4.5,
+                     "created_at": product.created_at.isoformat() if product.created_at else None}
+                    for product in products]
+
+    def get_scenarios(self) -> list[Scenario]:
+        return [
+            Scenario('GET /products', self._list_products),
+            Scenario('GET /products/{id}', self._retrieve_product),
+            Scenario('POST /orders', self._create_order),
+            Scenario('POST /accounts/login', self._login, weight=0.2),
+            Scenario('GET /search', self._search),
+        ]
+
+    async def run(self, scenario: Scenario) -> ScenarioResult:
+        rng = random.Random(f"{self.random_seed}:{scenario.name}")
+        warmup = ScenarioResult(scenario.name)
+        await self._run(scenario, rng, max(int(self.warmup * scenario.weight), 1), warmup)
+
+        result = ScenarioResult(scenario.name)
+        started = time.perf_counter()
+        await self._run(scenario, rng, max(int(self.requests * scenario.weight), 1), result)
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    async def _run(self, scenario: Scenario, rng: random.Random, requests: int, result: ScenarioResult):
+        counter = itertools.count()
+
+        async def worker():
+            while next(counter) < requests:
+                arguments = scenario.build(rng)
+                started = time.perf_counter()
+                try:
+                    response = await self.client.request(**arguments)
+                except httpx.HTTPError:
+                    result.latencies.append(time.perf_counter() - started)
+                    result.errors += 1
+                    continue
+                result.latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    result.errors += 1
+                match = QUERIES_PATTERN.search(response.headers.get('server-timing', ''))
+                if match:
+                    result.queries.append(int(match.group(1)))
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, requests))))
+
+    # -----------------
+    # --- Scenarios ---
+    # -----------------
+
+    def _list_products(self, rng: random.Random) -> dict:
+        params = {'page': rng.randint(1, 5), 'limit': 12}
+        if rng.random() < 0.3:
+            params['search'] = rng.choice(SEARCH_TERMS)
+        elif rng.random() < 0.3:
+            params.update(min_price=50, max_price=250)
+        return {'method': 'GET', 'url': '/products/', 'params': params}
+
+    def _retrieve_product(self, rng: random.Random) -> dict:
+        return {'method': 'GET', 'url': f"/products/{rng.choice(self.product_ids)}"}
+
+    def _create_order(self, rng: random.Random) -> dict:
+        items = [{'variant_id': variant_id, 'quantity': rng.randint(1, 3)}
+                 for variant_id in rng.sample(self.variant_ids, min(rng.randint(1, 3), len(self.variant_ids)))]
+        return {'method': 'POST', 'url': '/orders/', 'json': items,
+                'headers': {'Authorization': f"Bearer {rng.choice(self.tokens)}"}}
+
+    def _login(self, rng: random.Random) -> dict:
+        return {'method': 'POST', 'url': '/accounts/login',
+                'data': {'username': rng.choice(self.login_emails), 'password': self.password}}
+
+    def _search(self, rng: random.Random) -> dict:
+        return {'method': 'GET', 'url': '/search/', 'params': {'q': rng.choice(SEARCH_TERMS)}}
@@ -0,0 +1,118 @@
+"""
+Reproducible data set of the benchmarks: the same scale factor and seed always give the same rows.
+"""
+
+import random
+
+from sqlalchemy import MetaData, create_engine, insert, select, text
+from sqlalchemy.engine import URL
+
+from apps.accounts.models import Seller, User, UserVerification
+from apps.accounts.services.password import PasswordManager
+from apps.products.services import ProductService
+from config import settings
+from config.database import DatabaseManager
+
+# rows per unit of scale factor
+PRODUCTS_PER_SCALE = 1000
+CUSTOMERS_PER_SCALE = 100
+PRODUCTS_PER_SELLER = 100
+
+BATCH_SIZE = 500
+# all customers share it, so their password is hashed once
+PASSWORD = 'Benchmark-1234'
+CUSTOMER_EMAIL = 'bench-customer-{}@example.com'
+# orders never run out of stock during a run
+STOCK = 1_000_000
+
+CATEGORIES = ('accessories', 'appliances', 'bags & luggage', 'beauty & health', 'car & motorbike', 'home & kitchen',
+              'men\'s clothing', 'sports & fitness', 'stores', 'tv, audio & cameras')
+ADJECTIVES = ('classic', 'compact', 'durable', 'elegant', 'light', 'modern', 'portable', 'premium', 'smart', 'soft')
+NOUNS = ('backpack', 'bottle', 'camera', 'chair', 'headphones', 'jacket', 'lamp', 'shoes', 'speaker', 'watch')
+OPTIONS = {'color': ['black', 'white', 'red', 'blue'], 'size': ['S', 'M', 'L', 'XL'], 'material': ['cotton', 'wool']}
+
+
+def create_database():
+    """
+    Create the database of `settings.DATABASES` if it doesn't exist.
+    """
+    url = URL.create(**{**settings.DATABASES, "database": "postgres"})
+    engine = create_engine(url, isolation_level="AUTOCOMMIT")
+    try:
+        with engine.connect() as connection:
+            name = settings.DATABASES["database"]
+            exists = connection.scalar(text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": name})
+            if not exists:
+                connection.execute(text(f'CREATE DATABASE "{name}"'))
+    finally:
+        engine.dispose()
+
+
+def seed(scale: float, random_seed: int = 0):
+    """
+    Recreate the tables and fill them for `scale`.
+    """
+    metadata = MetaData()
+    metadata.reflect(bind=DatabaseManager.engine)
+    metadata.drop_all(bind=DatabaseManager.engine)
+    DatabaseManager.create_database_tables()
+
+    rng = random.Random(random_seed)
+    products = max(int(PRODUCTS_PER_SCALE * scale), 1)
+    customers = max(int(CUSTOMERS_PER_SCALE * scale), 1)
+
+    seller_ids = create_sellers(max(products // PRODUCTS_PER_SELLER, 1))
+    create_customers(customers)
+    for start in range(0, products, BATCH_SIZE):
+        batch = [generate_product(rng, number, rng.choice(seller_ids))
+                 for number in range(start, min(start + BATCH_SIZE, products))]
+        ProductService.create_products(batch)
+    with DatabaseManager.engine.begin() as connection:
+        connection.execute(text("ANALYZE"))
+
+
+def create_sellers(count: int) -> list[int]:
+    password = PasswordManager.hash_password(PASSWORD)
+    with DatabaseManager.session as session:
+        user_ids = session.scalars(insert(User).returning(User.id, sort_by_parameter_order=True), [
+            {"email": f"bench-seller-{number}@example.com", "password": password, "is_verified_email": True,
+             "is_active": True, "role": "seller"} for number in range(count)]).all()
+        seller_ids = session.scalars(insert(Seller).returning(Seller.id, sort_by_parameter_order=True),
+                                     [{"user_id": user_id} for user_id in user_ids]).all()
+        session.commit()
+    return list(seller_ids)
+
+
+def create_customers(count: int):
+    password = PasswordManager.hash_password(PASSWORD)
+    with DatabaseManager.session as session:
+        for start in range(0, count, BATCH_SIZE):
+            user_ids = session.scalars(insert(User).returning(User.id), [
+                {"email": CUSTOMER_EMAIL.format(number), "password": password, "first_name": "Bench",
+                 "last_name": str(number), "is_verified_email": True, "is_active": True, "role": "user"}
+                for number in range(start, min(start + BATCH_SIZE, count))]).all()
+            # verified at registration, logins only update it
+            session.execute(insert(UserVerification), [{"user_id": user_id} for user_id in user_ids])
+        session.commit()
+
+
+def generate_product(rng: random.Random, number: int, seller_id: int) -> dict:
+    name = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {number}"
+    options = [{"option_name": option_name, "items": OPTIONS[option_name]}
+               for option_name in rng.sample(sorted(OPTIONS), rng.randint(0, 2))]
+    return {
+        "product_name": name.capitalize(),
+        "description": f"A {name} for everyday use, {rng.choice(ADJECTIVES)} and {rng.choice(ADJECTIVES)}.",
+        "status": "active",
+        "price": round(rng.uniform(1, 500), 2),
+        "stock": STOCK,
+        "seller_id": seller_id,
+        "main_category": rng.choice(CATEGORIES),
+        "options": options,
+    }
+
+
+def get_customer_emails() -> list[str]:
+    with DatabaseManager.session as session:
+        return list(session.scalars(
+            select(User.email).where(User.email.like(CUSTOMER_EMAIL.format('%'))).order_by(User.id)))
@@ -1,24 +1,132 @@
+import asyncio
 import importlib
+import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from operator import and_
 from pathlib import Path
 
-from fastapi import HTTPException
-from sqlalchemy import create_engine, URL, MetaData, Index
+from typing import Optional, List
+
+from fastapi import HTTPException, Request
+from sqlalchemy import create_engine, URL, MetaData, Index, text, select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy.orm import sessionmaker, Session, Query
+from sqlalchemy.orm import sessionmaker, scoped_session, Session, Query
+from sqlalchemy.pool import NullPool, QueuePool, AsyncAdaptedQueuePool
 
 from . import settings
+from .metrics import DB_POOL_CHECKOUT_SECONDS, DB_POOL_CONNECTIONS_IN_USE, DB_POOL_CAPACITY
+
+logger = logging.getLogger(__name__)
 
 testing = False
 
+# the session scope of the current request (see `DatabaseManager.session_scope`)
+_session_scope: ContextVar[Optional[object]] = ContextVar('session_scope', default=None)
+# True in read-only routes, their SELECTs may go to the replica (see `DatabaseManager.read_only`)
+_read_only: ContextVar[bool] = ContextVar('read_only', default=False)
+
+# seconds since the last replayed transaction of a standby, 0 when everything it received is replayed (an idle
+# primary commits nothing, so the replay timestamp alone would grow), or on a server that isn't a standby
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+
+def _get_session_scope():
+    # outside of requests (startup, scripts, background threads) every thread has a session of its own
+    return _session_scope.get() or threading.get_ident()
+
+
+class ScopedSession(scoped_session):
+    """
+    `scoped_session` that can be used like a `Session` in `with DatabaseManager.session as session`,
+    the session of the current scope is closed on exit (and is usable again, like a closed `Session`).
+    """
+
+    def __enter__(self) -> Session:
+        return self()
+
+    def __exit__(self, *exc_info):
+        self().close()
+
+
+class RoutingSession(Session):
+    """
+    `Session` that sends the SELECTs of read-only routes to the replica while it is available
+    (see `DatabaseManager.use_replica`), everything else (and any statement of a flush) goes to the primary.
+    """
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        bind = super().get_bind(mapper, clause=clause, **kwargs)
+        if getattr(clause, 'is_select', False) and not self._flushing and DatabaseManager.use_replica():
+            return DatabaseManager.replica_binds.get(bind, bind)
+        return bind
+
+
+class _InstrumentedPoolMixin:
+    """
+    Report checkout time, connections in use and capacity of a pool to Prometheus, labelled by the
+    `pool_logging_name` of its engine.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # `max_overflow=-1` is unbounded
+        DB_POOL_CAPACITY.labels(self.logging_name).set(self.size() + max(self._max_overflow, 0))
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.labels(self.logging_name).observe(time.perf_counter() - started_at)
+            DB_POOL_CONNECTIONS_IN_USE.labels(self.logging_name).set(self.checkedout())
+
+    def _do_return_conn(self, record):
+        try:
+            super()._do_return_conn(record)
+        finally:
+            DB_POOL_CONNECTIONS_IN_USE.labels(self.logging_name).set(self.checkedout())
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
 
 class DatabaseManager:
     """
     A utility class for managing database operations using SQLAlchemy.
     """
     engine: create_engine = None
-    session: Session = None
+    session_factory: sessionmaker = None
+    # the session of the current request (or thread), see `session_scope`
+    session: ScopedSession = None
+
+    # asyncpg engine of the same database for `async def` routes, queries don't block the event loop
+    # (see the `a*` helpers of `FastModel`)
+    async_engine: AsyncEngine = None
+    async_session_factory: async_sessionmaker = None
+
+    # engines of the replica by the (sync) engine of the primary they replace in read-only routes
+    replica_binds: dict = {}
+    # last measured replication lag in seconds (`None` if the replica couldn't be reached), see `check_replica`
+    replica_lag: Optional[float] = None
+    replica_checked_at: float = 0.0
+
+    # cookie of clients that wrote recently (see `ReadYourWritesMiddleware`), they read from the primary
+    primary_cookie = 'db_primary_until'
 
     @classmethod
     def __init__(cls):
@@ -32,24 +140,159 @@ class DatabaseManager:
             db_config["database"] = "test_" + db_config["database"]
 
         # Master database configuration
-        cls.engine = create_engine(URL.create(**db_config))
+        pool_options = cls.get_pool_options()
+        cls.engine = create_engine(URL.create(**db_config), poolclass=InstrumentedQueuePool,
+                                   pool_logging_name="primary", **pool_options)
         
         # For replica (if needed)
         cls.engine_replica = None
-        if hasattr(settings, 'REPLICA_DB_CONFIG'):
-            cls.engine_replica = create_engine(URL.create(**settings.REPLICA_DB_CONFIG))
+        replica_config = settings.REPLICA_DB_CONFIG.copy() if settings.REPLICA_DB_CONFIG else None
+        if replica_config:
+            if testing:
+                replica_config["database"] = "test_" + replica_config["database"]
+            cls.engine_replica = create_engine(URL.create(**replica_config), poolclass=InstrumentedQueuePool,
+                                               pool_logging_name="replica", **pool_options)
+
+        cls.session_factory = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=cls.engine)
+        cls.session = ScopedSession(cls.session_factory, scopefunc=_get_session_scope)
+
+        # `TestClient` runs every request in a new event loop, and asyncpg connections can't move between loops
+        async_pool_options = {"poolclass": NullPool} if testing else {"poolclass": InstrumentedAsyncQueuePool,
+                                                                      **pool_options}
+        cls.async_engine = create_async_engine(cls.get_async_url(db_config), pool_logging_name="primary_async",
+                                               **async_pool_options)
+        # async sessions are short-lived (one per unit of work), loaded attributes stay readable after a commit
+        cls.async_session_factory = async_sessionmaker(cls.async_engine, sync_session_class=RoutingSession,
+                                                       autoflush=False, expire_on_commit=False)
+        cls.async_engine_replica = None
+        cls.replica_binds = {}
+        cls.replica_lag = None
+        if replica_config:
+            cls.async_engine_replica = create_async_engine(cls.get_async_url(replica_config),
+                                                           pool_logging_name="replica_async", **async_pool_options)
+            cls.replica_binds = {cls.engine: cls.engine_replica,
+                                 cls.async_engine.sync_engine: cls.async_engine_replica.sync_engine}
+
+    @staticmethod
+    def get_pool_options() -> dict:
+        """
+        Connection pool settings of the engines, every engine of a worker has a pool of its own.
+        """
+        return {
+            "pool_size": settings.DB_POOL_SIZE,
+            "max_overflow": settings.DB_MAX_OVERFLOW,
+            "pool_timeout": settings.DB_POOL_TIMEOUT,
+            # a connection dropped by the server (restart, idle timeout) is replaced instead of failing a request
+            "pool_pre_ping": settings.DB_POOL_PRE_PING,
+            "pool_recycle": settings.DB_POOL_RECYCLE,
+        }
+
+    @classmethod
+    async def session_scope(cls):
+        """
+        FastAPI dependency of every route (see `apps.main`): the request gets a `Session` of its own, used by
+        `DatabaseManager.session` and the `FastModel` helpers (also in the thread pool, which copies the context),
+        so concurrent requests never share one. The session is removed when the request is done.
+        """
+        token = _session_scope.set(object())
+        try:
+            yield
+        finally:
+            cls.session.remove()
+            _session_scope.reset(token)
 
-        session = sessionmaker(autocommit=False, autoflush=False, bind=cls.engine)
-        cls.session = session()
+    @classmethod
+    async def read_only(cls, request: Request):
+        """
+        FastAPI dependency of read-only routes: their SELECTs go to the replica while it is available, except for
+        clients that wrote in the last `DB_READ_YOUR_WRITES_SECONDS`, so they always see their own writes.
+
+        Must be listed in the `dependencies` of a route, which are solved before its other dependencies.
+        """
+        token = _read_only.set(not cls.wrote_recently(request))
+        try:
+            yield
+        finally:
+            _read_only.reset(token)
+
+    @classmethod
+    def wrote_recently(cls, request: Request) -> bool:
+        try:
+            return float(request.cookies.get(cls.primary_cookie, 0)) > time.time()
+        except ValueError:
+            return False
+
+    @staticmethod
+    @contextmanager
+    def read_from_primary():
+        """
+        Send the queries in the block to the primary, also in a read-only route.
+        """
+        token = _read_only.set(False)
+        try:
+            yield
+        finally:
+            _read_only.reset(token)
+
+    @classmethod
+    def replica_available(cls) -> bool:
+        """
+        The replica is used only while its lag, measured recently (see `ReplicaMonitor`), is within
+        `DB_REPLICA_MAX_LAG`.
+        """
+        return (
+            cls.engine_replica is not None
+            and cls.replica_lag is not None
+            and cls.replica_lag <= settings.DB_REPLICA_MAX_LAG
+            and time.monotonic() - cls.replica_checked_at <= 3 * settings.DB_REPLICA_CHECK_INTERVAL
+        )
+
+    @classmethod
+    def use_replica(cls) -> bool:
+        return _read_only.get() and cls.replica_available()
+
+    @classmethod
+    async def check_replica(cls) -> Optional[float]:
+        """
+        Measure the replication lag of the replica in seconds, `None` if it can't be reached.
+        """
+        try:
+            async with cls.async_engine_replica.connect() as connection:
+                lag = await asyncio.wait_for(connection.scalar(REPLICA_LAG_QUERY),
+                                             timeout=settings.DB_REPLICA_CHECK_INTERVAL)
+            lag = float(lag) if lag is not None else None
+        except Exception as e:
+            logger.warning(f"Replica lag check failed: {e}")
+            lag = None
+
+        cls.replica_lag = lag
+        cls.replica_checked_at = time.monotonic()
+        return lag
 
     @classmethod
     def get_session(cls, read_only=False):
         """
-        Returns a session - uses replica if read_only=True and replica is configured
+        Returns a session - uses replica if read_only=True and replica is available
         """
-        if read_only and cls.engine_replica:
-            return sessionmaker(bind=cls.engine_replica)()
-        return sessionmaker(bind=cls.engine)()
+        if read_only and cls.replica_available():
+            return cls.session_factory(bind=cls.engine_replica)
+        return cls.session_factory()
+
+    @classmethod
+    def get_async_session(cls, read_only=False) -> AsyncSession:
+        """
+        Returns a new `AsyncSession`, use it as `async with DatabaseManager.get_async_session() as session`.
+        Uses the replica if read_only=True and replica is available, in read-only routes SELECTs go to the
+        replica anyway (see `RoutingSession`).
+        """
+        if read_only and cls.replica_available():
+            return cls.async_session_factory(bind=cls.async_engine_replica)
+        return cls.async_session_factory()
+
+    @staticmethod
+    def get_async_url(db_config: dict) -> URL:
+        # the async engine always uses asyncpg, whatever the driver of the sync engine is
+        return URL.create(**{**db_config, "drivername": "postgresql+asyncpg"})
 
     @classmethod
     def create_test_database(cls):
@@ -97,11 +340,39 @@ class DatabaseManager:
     def get_testing_mode(cls):
         return testing
 
+    @staticmethod
+    def notify(session: Session, channel: str, payload: str):
+        """
+        Send a Postgres NOTIFY on `channel`, it's delivered to listeners only when the transaction is committed.
+        """
+        session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+
+    @staticmethod
+    async def anotify(session: AsyncSession, channel: str, payload: str):
+        """
+        `notify` in an `AsyncSession`.
+        """
+        await session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+
 
 class FastModel(DeclarativeBase):
     """
     Base class for all models with CRUD operations.
+
+    If a model sets `notify_channel`, the CRUD helpers send a NOTIFY with `notify_payload()` on every
+    create/update/delete, so other workers can drop what they have cached about the row.
     """
+    notify_channel: Optional[str] = None
+
+    def notify_payload(self) -> str:
+        return str(self.id)
+
+    @classmethod
+    def _notify(cls, session: Session, instance):
+        if cls.notify_channel is not None:
+            session.flush()
+            DatabaseManager.notify(session, cls.notify_channel, instance.notify_payload())
+
     @classmethod
     def __eq__(cls, **kwargs):
         filter_conditions = [getattr(cls, key) == value for key, value in kwargs.items()]
@@ -113,6 +384,7 @@ class FastModel(DeclarativeBase):
         session = DatabaseManager.session
         try:
             session.add(instance)
+            cls._notify(session, instance)
             session.commit()
             session.refresh(instance)
         except Exception:
@@ -153,6 +425,7 @@ class FastModel(DeclarativeBase):
                 setattr(instance, key, value)
 
             try:
+                cls._notify(session, instance)
                 session.commit()
                 session.refresh(instance)
             except Exception:
@@ -163,9 +436,80 @@ class FastModel(DeclarativeBase):
     @staticmethod
     def delete(instance):
         with DatabaseManager.session as session:
-            session.delete(instance)
             try:
+                type(instance)._notify(session, instance)
+                session.delete(instance)
                 session.commit()
             except Exception:
                 session.rollback()
-                raise
\ No newline at end of file
+                raise
+
+    # --------------------------
+    # --- Async CRUD Helpers ---
+    # --------------------------
+
+    # Each helper runs in a session of its own, so concurrent requests never share one. Returned instances are
+    # detached with their columns loaded, relationships must be loaded explicitly (lazy loading isn't possible).
+    # A session that is closed without a commit is rolled back.
+
+    @classmethod
+    async def _anotify(cls, session: AsyncSession, instance):
+        if cls.notify_channel is not None:
+            await session.flush()
+            await DatabaseManager.anotify(session, cls.notify_channel, instance.notify_payload())
+
+    @classmethod
+    async def acreate(cls, **kwargs):
+        instance = cls(**kwargs)
+        async with DatabaseManager.get_async_session() as session:
+            session.add(instance)
+            await cls._anotify(session, instance)
+            await session.commit()
+            await session.refresh(instance)
+        return instance
+
+    @classmethod
+    async def afilter(cls, condition, *order_by) -> List:
+        async with DatabaseManager.get_async_session() as session:
+            result = await session.scalars(select(cls).where(condition).order_by(*order_by))
+            return list(result)
+
+    @classmethod
+    async def afirst(cls, condition, *order_by):
+        async with DatabaseManager.get_async_session() as session:
+            return await session.scalar(select(cls).where(condition).order_by(*order_by).limit(1))
+
+    @classmethod
+    async def aget(cls, pk):
+        async with DatabaseManager.get_async_session() as session:
+            return await session.get(cls, pk)
+
+    @classmethod
+    async def aget_or_404(cls, pk):
+        instance = await cls.aget(pk)
+        if not instance:
+            raise HTTPException(status_code=404, detail=f"{cls.__name__} not found")
+        return instance
+
+    @classmethod
+    async def aupdate(cls, pk, **kwargs):
+        async with DatabaseManager.get_async_session() as session:
+            instance = await session.get(cls, pk)
+            if not instance:
+                raise HTTPException(status_code=404, detail=f"{cls.__name__} not found")
+
+            for key, value in kwargs.items():
+                setattr(instance, key, value)
+
+            await cls._anotify(session, instance)
+            await session.commit()
+            await session.refresh(instance)
+        return instance
+
+    @staticmethod
+    async def adelete(instance):
+        async with DatabaseManager.get_async_session() as session:
+            instance = await session.merge(instance)
+            await type(instance)._anotify(session, instance)
+            await session.delete(instance)
+            await session.commit()
@@ -1,10 +1,29 @@
 from elasticsearch import AsyncElasticsearch
 import os
+import time
+
+from config.metrics import ES_REQUEST_SECONDS
+
+
+class InstrumentedAsyncElasticsearch(AsyncElasticsearch):
+    """
+    `AsyncElasticsearch` that reports the latency of every API call to Prometheus.
+    """
+
+    async def perform_request(self, method, path, **kwargs):
+        # the API of the call (`_search`, `_doc`, `_bulk`, ...), index names and ids aren't labels
+        endpoint = next((part for part in path.split('/') if part.startswith('_')), method)
+        started_at = time.perf_counter()
+        try:
+            return await super().perform_request(method, path, **kwargs)
+        finally:
+            ES_REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started_at)
+
 
 host = os.getenv("ELASTICSEARCH_HOST", "elasticsearch")
 port = os.getenv("ELASTICSEARCH_PORT", "9200")
 
-es = AsyncElasticsearch(
+es = InstrumentedAsyncElasticsearch(
     hosts=[f"http://{host}:{port}"],
     timeout=30,
     max_retries=3,
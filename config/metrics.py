@@ -0,0 +1,87 @@
+"""
+Prometheus metrics of the app, exposed on `GET /metrics` (see `apps/core/routers.py`).
+
+With several worker processes (`uvicorn --workers`, gunicorn), set `PROMETHEUS_MULTIPROC_DIR` to a directory shared by
+the workers and emptied before they start: every worker writes its samples there, and `/metrics` of any worker
+reports the sum of all of them.
+"""
+
+import os
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# ------------
+# --- HTTP ---
+# ------------
+
+# `route` is the path template of the matched route (`/products/{product_id}`), not the requested path
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "Requests by route and status code", ["method", "route", "status"])
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Request latency by route, until the response is sent", ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1, 2.5, 5, 10))
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being served", ["method", "route"], multiprocess_mode="livesum")
+
+# ----------------
+# --- Database ---
+# ----------------
+
+# `pool` is the name of the engine: primary, replica, primary_async or replica_async
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds", "Time to get a connection from the pool, waiting for a free one or connecting",
+    ["pool"], buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5, 10, 30))
+# utilization is `db_pool_connections_in_use / db_pool_capacity`
+DB_POOL_CONNECTIONS_IN_USE = Gauge(
+    "db_pool_connections_in_use", "Connections checked out of the pool", ["pool"], multiprocess_mode="livesum")
+DB_POOL_CAPACITY = Gauge(
+    "db_pool_capacity", "Connections the pool can hand out (pool size and overflow)", ["pool"],
+    multiprocess_mode="livesum")
+
+# ---------------------
+# --- Elasticsearch ---
+# ---------------------
+
+ES_REQUEST_SECONDS = Histogram(
+    "elasticsearch_request_duration_seconds", "Latency of Elasticsearch API calls by endpoint (`_search`, "
+                                              "`_doc`, ...)", ["endpoint"])
+
+# -------------
+# --- Cache ---
+# -------------
+
+# hit ratio is `sum(rate(cache_requests_total{result=~"l1|l2"}[5m])) / sum(rate(cache_requests_total[5m]))`
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache lookups by namespace and result (`l1` or `l2` hit, or `miss`)",
+    ["namespace", "result"])
+
+# --------------
+# --- Orders ---
+# --------------
+
+ORDERS_CREATED = Counter("orders_created_total", "Created orders")
+ORDERS_AMOUNT = Counter("orders_amount_total", "Total amount of created orders")
+PAYMENTS = Counter("payments_total", "Processed payments by status", ["status"])
+
+
+def generate_metrics() -> bytes:
+    """
+    The metrics in the Prometheus text format, of all workers in multiprocess mode.
+    """
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def mark_process_dead():
+    """
+    Remove the live gauges of this worker when it exits, so they aren't summed with the running workers.
+    """
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
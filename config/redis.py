@@ -1,4 +1,5 @@
 from redis import Redis
-from config.settings import REDIS_HOST, REDIS_PORT
+from config.settings import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD, REDIS_DB
 
-redis = Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+redis = Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_DB, decode_responses=True,
+              socket_connect_timeout=1, socket_timeout=1)
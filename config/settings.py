@@ -76,6 +76,30 @@ DATABASES = {
     "port": int(os.getenv("DB_PORT", "5432"))
 }
 
+# read replica (streaming replication of the primary), the SELECTs of read-only routes go to it when
+# `REPLICA_DB_HOST` is set (see `DatabaseManager.read_only`)
+REPLICA_DB_CONFIG = {
+    **DATABASES,
+    "host": os.getenv("REPLICA_DB_HOST"),
+    "port": int(os.getenv("REPLICA_DB_PORT", DATABASES["port"]))
+} if os.getenv("REPLICA_DB_HOST") else None
+# reads go to the primary while the replica is behind by more than this (seconds), or wasn't measured recently
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+# seconds between measurements of the replica lag
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+# a client reads from the primary for this long after a write, so it always sees its own writes
+DB_READ_YOUR_WRITES_SECONDS = int(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "10"))
+
+# connection pool of every engine (per worker process). Sync routes run in a thread pool of 40 threads, each one
+# can hold a connection, so `DB_POOL_SIZE + DB_MAX_OVERFLOW` shouldn't be less than that.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# seconds to wait for a free connection before failing
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# reconnect connections older than this (seconds), before the server or a proxy drops them
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
 # ----------------------
 # --- Media Settings ---
 # ----------------------
@@ -88,10 +112,71 @@ MEDIA_DIR.mkdir(parents=True, exist_ok=True)
 
 # int number as MB
 MAX_FILE_SIZE = 5
+
+# resized copies of uploaded images (the longest side in pixels), each one is saved in the format of the original
+# and as WebP, next to the original file
+MEDIA_DERIVATIVE_SIZES = {'thumb': 150, 'card': 400, 'full': 1200}
+MEDIA_DERIVATIVE_QUALITY = 82
+# processes that resize images, so decoding and encoding don't block the workers
+MEDIA_DERIVATIVE_WORKERS = int(os.getenv("MEDIA_DERIVATIVE_WORKERS", 2))
+# `Cache-Control: max-age` of content-addressed media (their names change with the content), and of other media
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+MEDIA_MAX_AGE = int(os.getenv("MEDIA_MAX_AGE", 60 * 60))
+
 products_list_limit = 12
+# max number of products in a single `POST /products/bulk` request
+products_bulk_create_limit = 500
+# text search configuration of the product list `search` filter
+products_search_config = 'english'
+# rows fetched per round trip by the server-side cursor of `GET /products/export`
+products_export_batch_size = 1000
 
 # TODO add settings to limit register new user or close register
 
+# ----------------------
+# --- Redis Settings ---
+# ----------------------
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_PASSWORD = os.getenv("REDIS_PASSWORD") or None
+REDIS_DB = int(os.getenv("REDIS_DB", "0"))
+
+# ----------------------
+# --- Cache Settings ---
+# ----------------------
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+# in-process cache (L1) of each worker
+CACHE_L1_MAX_SIZE = int(os.getenv("CACHE_L1_MAX_SIZE", "1024"))
+CACHE_L1_TTL = int(os.getenv("CACHE_L1_TTL", "30"))
+# shared Redis cache (L2)
+CACHE_L2_TTL = int(os.getenv("CACHE_L2_TTL", "300"))
+# seconds to skip Redis after a connection error
+CACHE_L2_RETRY_SECONDS = int(os.getenv("CACHE_L2_RETRY_SECONDS", "30"))
+
+# ------------------------------------
+# --- SQL Instrumentation Settings ---
+# ------------------------------------
+
+# count and time the SQL statements of every request, see `SQLInstrumentationMiddleware`
+SQL_INSTRUMENTATION = os.getenv("SQL_INSTRUMENTATION", "true").lower() == "true"
+# a statement repeated this many times in one request (with different parameters) is logged as an N+1 query
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "3"))
+
+# --------------------------
+# --- Profiling Settings ---
+# --------------------------
+
+# reports of profiled requests, a directory per route (see `ProfilingMiddleware`)
+PROFILING_DIR = Path(os.getenv("PROFILING_DIR", BASE_DIR / "profiles"))
+# admins can profile a request with the `X-Profile: 1` header or the `profile=1` query parameter
+PROFILING_ON_DEMAND = os.getenv("PROFILING_ON_DEMAND", "true").lower() == "true"
+# fraction of all requests profiled at random, 0 disables sampling
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+# newest reports kept per route
+PROFILING_KEEP_PER_ROUTE = int(os.getenv("PROFILING_KEEP_PER_ROUTE", "20"))
+
 # Elasticsearch settings
 ELASTICSEARCH_HOST = os.getenv("ELASTICSEARCH_HOST", "elasticsearch")
 ELASTICSEARCH_PORT = int(os.getenv("ELASTICSEARCH_PORT", "9200"))
@@ -2,6 +2,7 @@ ALTER SYSTEM SET wal_level = 'logical';
 -- Enable necessary extensions
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 CREATE EXTENSION IF NOT EXISTS "pgcrypto";
+CREATE EXTENSION IF NOT EXISTS "pg_trgm";
 
 -- Create users table
 CREATE TABLE users (
@@ -67,12 +68,17 @@ CREATE TABLE products (
     external_ratings_count INTEGER,
     external_discount_price VARCHAR(50),
     external_price VARCHAR(50),
+    external_hash VARCHAR(32),
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     published_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    sparse_variants BOOLEAN NOT NULL DEFAULT FALSE,
     seller_id INTEGER NOT NULL REFERENCES sellers(id)
 );
 
+-- feed key of the CSV import (see `load_products_from_csv`)
+CREATE UNIQUE INDEX ix_products_external_link ON products (external_link);
+
 -- Create product_options table
 CREATE TABLE product_options (
     id SERIAL PRIMARY KEY,
@@ -102,6 +108,8 @@ CREATE TABLE product_variants (
     updated_at TIMESTAMP WITH TIME ZONE
 );
 
+CREATE INDEX ix_product_variants_product_id_price ON product_variants (product_id, price);
+
 -- Create product_media table
 CREATE TABLE product_media (
     id SERIAL PRIMARY KEY,
@@ -109,10 +117,43 @@ CREATE TABLE product_media (
     alt VARCHAR,
     src TEXT NOT NULL,
     type VARCHAR NOT NULL,
+    content_hash VARCHAR(64),
+    has_derivatives BOOLEAN NOT NULL DEFAULT FALSE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE
 );
 
+CREATE INDEX ix_product_media_content_hash ON product_media (content_hash);
+
+-- Create product_cards table (denormalized listing data, refreshed on product, variant and media writes)
+CREATE TABLE product_cards (
+    product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    product_name VARCHAR(255) NOT NULL,
+    status VARCHAR,
+    created_at TIMESTAMP WITH TIME ZONE,
+    price NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    min_price NUMERIC(12, 2),
+    max_price NUMERIC(12, 2),
+    total_stock INTEGER NOT NULL DEFAULT 0,
+    main_media_src VARCHAR,
+    main_media_has_derivatives BOOLEAN NOT NULL DEFAULT FALSE,
+    external_image_url VARCHAR(500),
+    rating FLOAT,
+    ratings_count INTEGER,
+    main_category VARCHAR(100),
+    sub_category VARCHAR(200),
+    search_vector TSVECTOR
+);
+
+CREATE INDEX ix_product_cards_created_at_product_id ON product_cards (created_at, product_id);
+CREATE INDEX ix_product_cards_price_product_id ON product_cards (price, product_id);
+CREATE INDEX ix_product_cards_min_price ON product_cards (min_price);
+CREATE INDEX ix_product_cards_max_price ON product_cards (max_price);
+CREATE INDEX ix_product_cards_status ON product_cards (status);
+CREATE INDEX ix_product_cards_main_category ON product_cards (main_category);
+CREATE INDEX ix_product_cards_search_vector ON product_cards USING GIN (search_vector);
+CREATE INDEX ix_product_cards_product_name_trgm ON product_cards USING GIN (product_name gin_trgm_ops);
+
 -- Create orders table
 CREATE TABLE orders (
     id SERIAL PRIMARY KEY,
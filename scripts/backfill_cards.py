@@ -0,0 +1,24 @@
+"""
+Create the missing listing cards (`ProductCard`) of products inserted with raw SQL, e.g. by
+`scripts/simulate_data.py` or `scripts/seed_data.py`. The app keeps the cards of its own writes up to date.
+
+    $ python -m scripts.backfill_cards
+
+Safe to re-run, existing cards are left as they are.
+"""
+
+import time
+
+from apps.products.services import ProductService
+from config.database import DatabaseManager
+
+
+def main():
+    DatabaseManager()
+    started = time.monotonic()
+    ProductService.backfill_cards()
+    print(f"Listing cards backfilled in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Make the missing resized copies (derivatives) of product media and mark them, so listings and product pages start
+advertising them.
+
+    $ python -m scripts.create_media_derivatives
+
+Media uploaded before derivatives were introduced have none, and a background job of an upload is lost if its
+worker stops. Until a media is marked, clients get its original `src`. Safe to re-run, existing derivatives are
+only marked.
+"""
+
+import time
+
+from apps.core.services.media import MediaService
+from apps.products.services import ProductService
+from config.database import DatabaseManager
+
+
+def main():
+    DatabaseManager()
+    started = time.monotonic()
+    try:
+        marked = ProductService.backfill_media_derivatives()
+    finally:
+        MediaService.shutdown_executor()
+    print(f"Marked derivatives of {marked} media in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 from datetime import datetime
 from sqlalchemy import create_engine, text
@@ -14,11 +15,19 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Настройка хеширования паролей
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+def hash_password(password):
+    return pwd_context.hash(password)
+
+def hash_passwords(passwords):
+    # bcrypt is slow by design, the passwords are hashed in parallel processes
+    with ProcessPoolExecutor() as executor:
+        return list(executor.map(hash_password, passwords))
+
 def create_users(session):
     users_data = [
         {
             "email": "admin@example.com",
-            "password": pwd_context.hash("admin123"),
+            "password": "admin123",
             "first_name": "Admin",
             "last_name": "User",
             "is_verified_email": True,
@@ -28,7 +37,7 @@ def create_users(session):
         },
         {
             "email": "seller1@example.com",
-            "password": pwd_context.hash("seller123"),
+            "password": "seller123",
             "first_name": "John",
             "last_name": "Doe",
             "is_verified_email": True,
@@ -38,7 +47,7 @@ def create_users(session):
         },
         {
             "email": "seller2@example.com",
-            "password": pwd_context.hash("seller123"),
+            "password": "seller123",
             "first_name": "Jane",
             "last_name": "Smith",
             "is_verified_email": True,
@@ -48,7 +57,7 @@ def create_users(session):
         },
         {
             "email": "user1@example.com",
-            "password": pwd_context.hash("user123"),
+            "password": "user123",
             "first_name": "Alice",
             "last_name": "Johnson",
             "is_verified_email": True,
@@ -58,7 +67,7 @@ def create_users(session):
         },
         {
             "email": "user2@example.com",
-            "password": pwd_context.hash("user123"),
+            "password": "user123",
             "first_name": "Bob",
             "last_name": "Brown",
             "is_verified_email": True,
@@ -68,6 +77,10 @@ def create_users(session):
         }
     ]
     
+    hashes = hash_passwords([user_data["password"] for user_data in users_data])
+    for user_data, password_hash in zip(users_data, hashes):
+        user_data["password"] = password_hash
+
     user_ids = []
     for user_data in users_data:
         result = session.execute(
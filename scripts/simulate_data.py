@@ -1,8 +1,34 @@
-import psycopg2
+"""
+Generate realistic test data at a scale factor: users, sellers, products with options and variants, orders with
+items and payments.
+
+    $ python scripts/simulate_data.py --scale 100 --workers 8
+
+Scale 1 is 10 000 users and products and 20 000 orders, rows grow linearly with it (scale 100 is about 1 million
+users and products, 5 million variants and 3.5 million order items). The data is generated in chunks by parallel
+worker processes, every chunk is self-contained (its orders are placed by its users for its products) and written
+with `COPY FROM STDIN`, so chunks never wait for each other.
+
+All timestamps are relative to `--now` (default: the start of today), so the same scale, seed and `--now` give the
+same users, products and orders. Only the ids (and the emails made of them) depend on the order in which the workers
+write their chunks, and the password hash on its random salt.
+
+The new products get their listing cards from `python -m scripts.backfill_cards`, run it afterwards.
+"""
+
+import argparse
+import io
+import itertools
+import logging
+import multiprocessing
+import os
 import random
+import time
 from datetime import datetime, timedelta
+
+import psycopg2
 from faker import Faker
-import logging
+from passlib.context import CryptContext
 
 # Configure logging
 logging.basicConfig(
@@ -13,15 +39,76 @@ logger = logging.getLogger(__name__)
 
 # Database configuration
 DB_CONFIG = {
-    'dbname': 'online_store',
-    'user': 'postgres',
-    'password': 'postgres',
-    'host': 'postgres',
-    'port': '5432'
+    'dbname': os.getenv('DB_NAME', 'online_store'),
+    'user': os.getenv('DB_USER', 'postgres'),
+    'password': os.getenv('DB_PASSWORD', 'postgres'),
+    'host': os.getenv('DB_HOST', 'postgres'),
+    'port': os.getenv('DB_PORT', '5432')
+}
+
+# rows of a chunk, scale 1 is 10 chunks
+CHUNK_USERS = 1000
+CHUNK_PRODUCTS = 1000
+CHUNK_ORDERS = 2000
+CHUNKS_PER_SCALE = 10
+SELLERS_PER_SCALE = 100
+
+# all generated users share it, so it's hashed once
+PASSWORD = 'Password-1234'
+
+CATEGORIES = {
+    'Electronics': ['Phones', 'Laptops', 'Accessories', 'Cameras'],
+    'Clothing': ['Men', 'Women', 'Kids'],
+    'Books': ['Fiction', 'Non-Fiction', 'Educational'],
+    'Home': ['Furniture', 'Decor', 'Kitchen'],
+    'Sports': ['Fitness', 'Outdoor', 'Team Sports']
 }
+OPTIONS = {
+    'Color': ['Black', 'White', 'Red', 'Blue', 'Green'],
+    'Size': ['XS', 'S', 'M', 'L', 'XL'],
+    'Material': ['Cotton', 'Leather', 'Polyester'],
+    'Storage': ['64GB', '128GB', '256GB']
+}
+# weights of product statuses, order statuses, and items per order
+PRODUCT_STATUSES = (('active', 90), ('draft', 5), ('archived', 5))
+ORDER_STATUSES = (('created', 15), ('paid', 20), ('shipped', 15), ('delivered', 45), ('cancelled', 5))
+ITEMS_PER_ORDER = ((1, 50), (2, 30), (3, 15), (4, 5))
+
+# the tables a run writes, in the order of their foreign keys
+TABLES = ('users', 'sellers', 'products', 'product_options', 'product_option_items', 'product_variants', 'orders',
+          'order_items', 'payments')
+COLUMNS = {
+    'users': ('id', 'email', 'password', 'first_name', 'last_name', 'age', 'is_verified_email', 'is_active',
+              'is_superuser', 'role', 'date_joined', 'last_login'),
+    'sellers': ('id', 'user_id', 'first_name', 'last_name', 'product_ids', 'is_active', 'created_at'),
+    'products': ('id', 'product_name', 'description', 'status', 'created_at', 'published_at', 'sparse_variants',
+                 'seller_id', 'main_category', 'sub_category', 'external_image_url', 'external_ratings',
+                 'external_ratings_count'),
+    'product_options': ('id', 'product_id', 'option_name'),
+    'product_option_items': ('id', 'option_id', 'item_name'),
+    'product_variants': ('id', 'product_id', 'price', 'stock', 'option1', 'option2', 'option3', 'created_at'),
+    'orders': ('id', 'user_id', 'status', 'total_amount', 'created_at'),
+    'order_items': ('id', 'order_id', 'product_id', 'variant_id', 'seller_id', 'quantity', 'price'),
+    'payments': ('id', 'order_id', 'amount', 'method', 'status', 'transaction_id', 'created_at'),
+}
+
+# connection of a worker process, see `init_worker`
+connection = None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate test data at a scale factor.')
+    parser.add_argument('--scale', type=float, default=1,
+                        help='scale factor, 1 is 10 000 users and products and 20 000 orders (default 1)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='worker processes (default: number of CPUs)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default 0)')
+    parser.add_argument('--now', type=datetime.fromisoformat,
+                        default=datetime.now().replace(hour=0, minute=0, second=0, microsecond=0),
+                        help='reference time of the generated timestamps, ISO format (default: the start of today)')
+    parser.add_argument('--truncate', action='store_true', help='delete all existing rows of the tables first')
+    return parser.parse_args()
 
-# Initialize Faker
-fake = Faker()
 
 def create_connection():
     """Create a database connection."""
@@ -32,164 +119,260 @@ def create_connection():
         logger.error(f"Error connecting to database: {e}")
         raise
 
-def generate_users(conn, count=10):
-    """Generate test users."""
-    cursor = conn.cursor()
-    try:
-        for _ in range(count):
-            cursor.execute("""
-                INSERT INTO users (age, first_name, last_name, is_verified_email, is_active, date_joined, last_login)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
-            """, (
-                random.randint(18, 65),
-                fake.first_name(),
-                fake.last_name(),
-                random.choice([True, False]),
-                random.choice([True, False]),
-                fake.date_time_this_year(),
-                fake.date_time_this_month()
-            ))
-        conn.commit()
-        logger.info(f"Generated {count} users")
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error generating users: {e}")
-        raise
 
-def generate_sellers(conn, count=5):
-    """Generate test sellers."""
+# ---------------
+# --- Writing ---
+# ---------------
+
+def format_value(value) -> str:
+    """Format a value for the text format of `COPY`."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, list):
+        return '{' + ','.join(str(item) for item in value) + '}'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(cursor, table: str, rows: list):
+    """Write rows (tuples in the order of `COLUMNS[table]`) with `COPY FROM STDIN`."""
+    if not rows:
+        return
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(format_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(COLUMNS[table])}) FROM STDIN", buffer)
+
+
+def reserve_ids(cursor, table: str, count: int) -> list:
+    """
+    Take `count` ids from the sequence of the table, so rows can reference each other before they are written and
+    concurrent workers never collide (ids of a worker may interleave with the ids of the others).
+    """
+    if not count:
+        return []
+    cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)", (table, count))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def weighted(rng: random.Random, choices: tuple):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+# ---------------
+# --- Sellers ---
+# ---------------
+
+def generate_sellers(conn, count: int, password: str, now: datetime, rng: random.Random, fake: Faker) -> list:
+    """Generate seller users and their sellers, return the ids of the sellers."""
     cursor = conn.cursor()
     try:
-        for _ in range(count):
-            cursor.execute("""
-                INSERT INTO sellers (first_name, last_name)
-                VALUES (%s, %s)
-                RETURNING id
-            """, (
-                fake.first_name(),
-                fake.last_name()
-            ))
+        user_ids = reserve_ids(cursor, 'users', count)
+        seller_ids = reserve_ids(cursor, 'sellers', count)
+        users, sellers = [], []
+        for user_id, seller_id in zip(user_ids, seller_ids):
+            first_name, last_name = fake.first_name(), fake.last_name()
+            joined = now - timedelta(days=rng.randint(30, 1500))
+            users.append((user_id, f"seller{user_id}@example.com", password, first_name, last_name,
+                          rng.randint(21, 65), True, True, False, 'seller', joined, now))
+            sellers.append((seller_id, user_id, first_name, last_name, [], True, joined))
+        copy_rows(cursor, 'users', users)
+        copy_rows(cursor, 'sellers', sellers)
         conn.commit()
         logger.info(f"Generated {count} sellers")
+        return seller_ids
     except Exception as e:
         conn.rollback()
         logger.error(f"Error generating sellers: {e}")
         raise
 
-def generate_products(conn, count=20):
-    """Generate test products."""
-    cursor = conn.cursor()
-    categories = ['Electronics', 'Clothing', 'Books', 'Home', 'Sports']
-    subcategories = {
-        'Electronics': ['Phones', 'Laptops', 'Accessories'],
-        'Clothing': ['Men', 'Women', 'Kids'],
-        'Books': ['Fiction', 'Non-Fiction', 'Educational'],
-        'Home': ['Furniture', 'Decor', 'Kitchen'],
-        'Sports': ['Fitness', 'Outdoor', 'Team Sports']
-    }
-    
+
+# --------------
+# --- Chunks ---
+# --------------
+
+def init_worker():
+    global connection
+    connection = create_connection()
+
+
+def generate_chunk(task: tuple) -> dict:
+    """Generate and write a chunk (in a worker process), return its row counts."""
+    number, seller_ids, password, seed, now = task
+    rng = random.Random(f"{seed}:{number}")
+    fake = Faker()
+    fake.seed_instance(f"{seed}:{number}")
+    cursor = connection.cursor()
     try:
-        for _ in range(count):
-            main_category = random.choice(categories)
-            sub_category = random.choice(subcategories[main_category])
-            cursor.execute("""
-                INSERT INTO products (product_name, main_category, sub_category, external_ratings, external_ratings_count, external_price)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                RETURNING id
-            """, (
-                fake.catch_phrase(),
-                main_category,
-                sub_category,
-                round(random.uniform(1, 5), 1),
-                random.randint(0, 1000),
-                str(round(random.uniform(10, 1000), 2))
-            ))
-        conn.commit()
-        logger.info(f"Generated {count} products")
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error generating products: {e}")
+        rows = {table: [] for table in TABLES}
+        user_ids = generate_users(cursor, now, rng, fake, password, rows)
+        variants = generate_products(cursor, now, rng, fake, seller_ids, rows)
+        generate_orders(cursor, now, rng, user_ids, variants, rows)
+        for table in TABLES:
+            copy_rows(cursor, table, rows[table])
+        connection.commit()
+        return {table: len(table_rows) for table, table_rows in rows.items()}
+    except Exception:
+        connection.rollback()
         raise
 
-def generate_orders(conn, count=50):
-    """Generate test orders with items and payments."""
+
+def generate_users(cursor, now: datetime, rng: random.Random, fake: Faker, password: str, rows: dict) -> list:
+    user_ids = reserve_ids(cursor, 'users', CHUNK_USERS)
+    for user_id in user_ids:
+        joined = now - timedelta(days=rng.randint(1, 1500), seconds=rng.randint(0, 86400))
+        verified = rng.random() < 0.9
+        rows['users'].append((
+            user_id, f"user{user_id}@example.com", password, fake.first_name(), fake.last_name(),
+            rng.randint(18, 75), verified, verified, False, 'user', joined,
+            joined + timedelta(days=rng.randint(0, max((now - joined).days, 0))) if verified else None))
+    return user_ids
+
+
+def generate_products(cursor, now: datetime, rng: random.Random, fake: Faker, seller_ids: list, rows: dict) -> list:
+    """Generate products with their options and variants, return the variants as (id, product id, seller id,
+    price) tuples."""
+    product_ids = reserve_ids(cursor, 'products', CHUNK_PRODUCTS)
+
+    # options first, their items are referenced by the variants
+    products_options = []
+    for product_id in product_ids:
+        names = rng.sample(sorted(OPTIONS), weighted(rng, ((0, 30), (1, 40), (2, 25), (3, 5))))
+        products_options.append([(name, rng.sample(OPTIONS[name], rng.randint(2, len(OPTIONS[name]))))
+                                 for name in names])
+    option_ids = iter(reserve_ids(cursor, 'product_options', sum(map(len, products_options))))
+    item_ids = iter(reserve_ids(cursor, 'product_option_items',
+                                sum(len(items) for options in products_options for _, items in options)))
+
+    products_items = []
+    for product_id, options in zip(product_ids, products_options):
+        product_items = []
+        for name, items in options:
+            option_id = next(option_ids)
+            rows['product_options'].append((option_id, product_id, name))
+            ids = []
+            for item in items:
+                item_id = next(item_ids)
+                rows['product_option_items'].append((item_id, option_id, item))
+                ids.append(item_id)
+            product_items.append(ids)
+        products_items.append(product_items)
+
+    # every combination of the options is a variant, a product without options has one
+    combinations = [list(itertools.product(*items)) for items in products_items]
+    variant_ids = iter(reserve_ids(cursor, 'product_variants', sum(map(len, combinations))))
+    variants = []
+    for product_id, product_combinations in zip(product_ids, combinations):
+        seller_id = rng.choice(seller_ids)
+        main_category = rng.choice(sorted(CATEGORIES))
+        created_at = now - timedelta(days=rng.randint(1, 1000), seconds=rng.randint(0, 86400))
+        status = weighted(rng, PRODUCT_STATUSES)
+        rows['products'].append((
+            product_id, fake.catch_phrase(), fake.paragraph(nb_sentences=rng.randint(2, 6)), status, created_at,
+            created_at + timedelta(hours=rng.randint(1, 72)) if status != 'draft' else None, False, seller_id,
+            main_category, rng.choice(CATEGORIES[main_category]), f"https://picsum.photos/seed/{product_id}/600",
+            round(rng.uniform(1, 5), 1), rng.randint(0, 5000)))
+
+        base_price = rng.uniform(5, 1000)
+        for combination in product_combinations:
+            variant_id = next(variant_ids)
+            price = round(base_price * rng.uniform(0.9, 1.2), 2)
+            options = list(combination) + [None] * (3 - len(combination))
+            rows['product_variants'].append((variant_id, product_id, price, rng.randint(0, 500), *options,
+                                             created_at))
+            variants.append((variant_id, product_id, seller_id, price))
+    return variants
+
+
+def generate_orders(cursor, now: datetime, rng: random.Random, user_ids: list, variants: list, rows: dict):
+    order_ids = reserve_ids(cursor, 'orders', CHUNK_ORDERS)
+    orders_items = [rng.sample(variants, weighted(rng, ITEMS_PER_ORDER)) for _ in order_ids]
+    item_ids = iter(reserve_ids(cursor, 'order_items', sum(map(len, orders_items))))
+
+    orders_payments = []
+    for order_id, items in zip(order_ids, orders_items):
+        status = weighted(rng, ORDER_STATUSES)
+        created_at = now - timedelta(days=rng.randint(0, 365), seconds=rng.randint(0, 86400))
+        total = 0
+        for variant_id, product_id, seller_id, price in items:
+            quantity = weighted(rng, ((1, 70), (2, 20), (3, 10)))
+            rows['order_items'].append((next(item_ids), order_id, product_id, variant_id, seller_id, quantity,
+                                        price))
+            total += price * quantity
+        total = round(total, 2)
+        rows['orders'].append((order_id, rng.choice(user_ids), status, total, created_at))
+
+        # paid orders have a completed payment, some new and cancelled orders a pending or failed one
+        if status in ('paid', 'shipped', 'delivered'):
+            orders_payments.append((order_id, total, 'completed', created_at))
+        elif rng.random() < 0.3:
+            orders_payments.append((order_id, total, 'pending' if status == 'created' else 'failed', created_at))
+
+    payment_ids = reserve_ids(cursor, 'payments', len(orders_payments))
+    for payment_id, (order_id, amount, status, created_at) in zip(payment_ids, orders_payments):
+        rows['payments'].append((
+            payment_id, order_id, amount, weighted(rng, (('card', 80), ('paypal', 20))), status,
+            f"{rng.getrandbits(64):016x}" if status == 'completed' else None,
+            created_at + timedelta(minutes=rng.randint(1, 30))))
+
+
+# ------------
+# --- Main ---
+# ------------
+
+def truncate_tables(conn):
     cursor = conn.cursor()
-    try:
-        # Get all user IDs
-        cursor.execute("SELECT id FROM users")
-        user_ids = [row[0] for row in cursor.fetchall()]
-        
-        # Get all product IDs
-        cursor.execute("SELECT id FROM products")
-        product_ids = [row[0] for row in cursor.fetchall()]
-        
-        # Get all seller IDs
-        cursor.execute("SELECT id FROM sellers")
-        seller_ids = [row[0] for row in cursor.fetchall()]
-        
-        for _ in range(count):
-            # Create order
-            order_date = fake.date_time_this_month()
-            cursor.execute("""
-                INSERT INTO orders (user_id, status, created_at)
-                VALUES (%s, %s, %s)
-                RETURNING id
-            """, (
-                random.choice(user_ids),
-                random.choice(['pending', 'completed', 'cancelled']),
-                order_date
-            ))
-            order_id = cursor.fetchone()[0]
-            
-            # Create order items (1-3 items per order)
-            num_items = random.randint(1, 3)
-            for _ in range(num_items):
-                product_id = random.choice(product_ids)
-                seller_id = random.choice(seller_ids)
-                quantity = random.randint(1, 5)
-                
-                cursor.execute("""
-                    INSERT INTO order_items (order_id, product_id, seller_id, quantity)
-                    VALUES (%s, %s, %s, %s)
-                """, (order_id, product_id, seller_id, quantity))
-            
-            # Create payment
-            cursor.execute("""
-                INSERT INTO payments (order_id, amount, currency, status, payment_method, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                order_id,
-                round(random.uniform(10, 1000), 2),
-                'USD',
-                random.choice(['pending', 'completed', 'failed']),
-                random.choice(['credit_card', 'paypal', 'bank_transfer']),
-                order_date + timedelta(minutes=random.randint(1, 30))
-            ))
-            
-        conn.commit()
-        logger.info(f"Generated {count} orders with items and payments")
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error generating orders: {e}")
-        raise
+    cursor.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE")
+    conn.commit()
+    logger.info("Truncated tables")
+
 
 def main():
     """Main function to generate all test data."""
+    args = parse_args()
+    chunks = max(round(args.scale * CHUNKS_PER_SCALE), 1)
+    workers = max(min(args.workers or 1, chunks), 1)
+    started = time.monotonic()
+
     conn = create_connection()
     try:
-        # Generate data in correct order
-        generate_users(conn)
-        generate_sellers(conn)
-        generate_products(conn)
-        generate_orders(conn)
-        logger.info("Test data generation completed successfully")
+        if args.truncate:
+            truncate_tables(conn)
+        password = CryptContext(schemes=["bcrypt"]).hash(PASSWORD)
+        rng = random.Random(f"{args.seed}:sellers")
+        fake = Faker()
+        fake.seed_instance(args.seed)
+        seller_ids = generate_sellers(conn, max(round(args.scale * SELLERS_PER_SCALE), 1), password, args.now,
+                                      rng, fake)
+
+        logger.info(f"Generating {chunks} chunks with {workers} workers")
+        totals = dict.fromkeys(TABLES, 0)
+        totals.update(users=len(seller_ids), sellers=len(seller_ids))
+        tasks = [(number, seller_ids, password, args.seed, args.now) for number in range(chunks)]
+        with multiprocessing.Pool(workers, initializer=init_worker) as pool:
+            for done, counts in enumerate(pool.imap_unordered(generate_chunk, tasks), start=1):
+                for table, count in counts.items():
+                    totals[table] += count
+                logger.info(f"Chunk {done}/{chunks} done, {totals['products']} products, "
+                            f"{totals['orders']} orders")
+
+        # fresh statistics for the query planner
+        conn.autocommit = True
+        conn.cursor().execute(f"ANALYZE {', '.join(TABLES)}")
+        logger.info(', '.join(f"{table}: {count}" for table, count in totals.items()))
+        logger.info(f"Test data generation completed in {time.monotonic() - started:.1f}s")
     except Exception as e:
         logger.error(f"Error in main: {e}")
         raise
     finally:
         conn.close()
 
+
 if __name__ == "__main__":
-    main() 
- 
\ No newline at end of file
+    main()